@@ -0,0 +1,282 @@
+import asyncio
+from collections import deque
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+from app.config import (
+    ADMISSION_ENABLED, ADMISSION_HIGH_QUEUE, ADMISSION_HIGH_TIMEOUT, ADMISSION_LIMIT,
+    ADMISSION_LOW_LIMIT, ADMISSION_LOW_QUEUE, ADMISSION_LOW_TIMEOUT, ADMISSION_RETRY_AFTER,
+    ADMISSION_ROUTES)
+from app.metrics import Counter, Gauge, Histogram, registry
+from app.replicas import is_read
+from app.utils import response_wrapper
+
+# Priority classes, most urgent first
+PRIORITIES = ("high", "low")
+
+# Routes bypassing admission: they never touch the database, or hold no
+# session while open (the /events streams)
+EXEMPT_ROUTES = {
+    ("GET", "/metrics"),
+    ("GET", "/cache/stats"),
+    ("GET", "/products/suggest"),
+    ("GET", "/events"),
+}
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed; reason is "queue_full" or "timeout"."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def parse_routes(spec: str) -> dict:
+    """
+    Parse per-route admission overrides.
+
+    :param spec: Comma-separated "METHOD /path/template=class[:limit]" entries,
+        e.g. "GET /products/export=low:2,GET /inventory/summary=high".
+
+    :return: {(method, path template): (class or None to bypass, limit or None)}.
+    """
+    overrides = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(","))):
+        route, _, policy = entry.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        priority, _, limit = policy.strip().partition(":")
+        if not path or priority not in PRIORITIES + ("none",):
+            raise ValueError(f"Invalid admission route '{entry}'")
+        overrides[(method.upper(), path.strip())] = (
+            None if priority == "none" else priority, int(limit) if limit else None)
+    return overrides
+
+
+def default_priority(method: str, path: str) -> str:
+    if (method, path) in EXEMPT_ROUTES:
+        return None
+    if not is_read(method, path):
+        return "high"
+    # Single entities, e.g. /products/{product_id}, are point reads; lists,
+    # searches, lookups, exports and range reads can hold a connection for long
+    return "high" if path.endswith("}") else "low"
+
+
+class Limiter:
+    """
+    Concurrency limit with one bounded FIFO queue per priority class.
+
+    A request is admitted at once while there is room and nothing of its
+    class or a more urgent one is waiting. Otherwise it queues until a slot
+    frees up, and is refused when its queue is full or its deadline passes.
+    Freed slots go to the most urgent class whose own limit allows it.
+    Only ever used from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, limit: int, class_limits: dict, queue_sizes: dict):
+        self.limit = limit
+        self.class_limits = class_limits
+        self.queue_sizes = queue_sizes
+        self.active = 0
+        self.class_active = dict.fromkeys(PRIORITIES, 0)
+        self.queues = {priority: deque() for priority in PRIORITIES}
+
+    def _has_room(self, priority: str) -> bool:
+        return self.active < self.limit and (
+            self.class_active[priority] < self.class_limits[priority])
+
+    def _take(self, priority: str):
+        self.active += 1
+        self.class_active[priority] += 1
+
+    async def acquire(self, priority: str, deadline: float):
+        """
+        Wait for a slot.
+
+        :param priority: The request's priority class.
+        :param deadline: Event loop time after which the request gives up.
+        """
+        urgent = PRIORITIES[:PRIORITIES.index(priority) + 1]
+        if self._has_room(priority) and not any(self.queues[p] for p in urgent):
+            self._take(priority)
+            return
+        queue = self.queues[priority]
+        if len(queue) >= self.queue_sizes[priority]:
+            raise OverloadedError("queue_full")
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        queue.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, deadline - loop.time())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait ended: hand the slot back
+                self.release(priority)
+            elif waiter in queue:
+                queue.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise OverloadedError("timeout")
+            raise
+
+    def release(self, priority: str):
+        self.active -= 1
+        self.class_active[priority] -= 1
+        for waiting in PRIORITIES:
+            queue = self.queues[waiting]
+            while queue and self._has_room(waiting):
+                waiter = queue.popleft()
+                # Waiters that timed out or disconnected are cancelled
+                if not waiter.done():
+                    self._take(waiting)
+                    waiter.set_result(None)
+            if self.active >= self.limit:
+                return
+
+    def waiting(self, priority: str) -> int:
+        return len(self.queues[priority])
+
+
+class AdmissionController:
+    """
+    Admits the requests that hold a database session, by priority class.
+
+    Writes and single-entity reads are "high", the other reads "low"; both
+    share one limit sized to the connection pool, so requests queue here
+    in order of priority instead of in the threadpool and the pool. Routes
+    may be reclassified, exempted or given a limit of their own with
+    ADMISSION_ROUTES.
+    """
+
+    def __init__(self, limit: int, low_limit: int, queue_sizes: dict, timeouts: dict,
+                 overrides: dict = None):
+        self.limiter = Limiter(limit, {"high": limit, "low": min(low_limit, limit)}, queue_sizes)
+        self.queue_sizes = queue_sizes
+        self.timeouts = timeouts
+        self.overrides = overrides or {}
+        # (priority, route limiter) per route, decided on the route's first request
+        self.policies = {}
+        self.route_limiters = {}
+
+    def policy(self, method: str, route) -> tuple:
+        """
+        Decide how the requests of a route are admitted.
+
+        :param method: The request method.
+        :param route: The matched APIRoute.
+
+        :return: The priority class, None to bypass admission, and the route's own limiter, if any.
+        """
+        key = (method, route.path_format)
+        policy = self.policies.get(key)
+        if policy is None:
+            priority, limit = self.overrides.get(key, (default_priority(*key), None))
+            limiter = None
+            if priority is not None and limit is not None:
+                limiter = self.route_limiters[key] = Limiter(
+                    limit, dict.fromkeys(PRIORITIES, limit), self.queue_sizes)
+            policy = self.policies[key] = (priority, limiter)
+        return policy
+
+    async def acquire(self, priority: str, route_limiter: Limiter = None) -> float:
+        """
+        Wait for a slot of the route, if limited, and then of the worker.
+
+        :return: Seconds waited.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.timeouts[priority]
+        if route_limiter is not None:
+            await route_limiter.acquire(priority, deadline)
+        try:
+            await self.limiter.acquire(priority, deadline)
+        except BaseException:
+            if route_limiter is not None:
+                route_limiter.release(priority)
+            raise
+        return loop.time() - started
+
+    def release(self, priority: str, route_limiter: Limiter = None):
+        self.limiter.release(priority)
+        if route_limiter is not None:
+            route_limiter.release(priority)
+
+    def queue_depths(self) -> list:
+        limiters = [self.limiter, *self.route_limiters.values()]
+        return [((priority,), sum(limiter.waiting(priority) for limiter in limiters))
+                for priority in PRIORITIES]
+
+    def in_flight(self) -> list:
+        return [((priority,), self.limiter.class_active[priority]) for priority in PRIORITIES]
+
+
+admission = AdmissionController(
+    ADMISSION_LIMIT, ADMISSION_LOW_LIMIT,
+    {"high": ADMISSION_HIGH_QUEUE, "low": ADMISSION_LOW_QUEUE},
+    {"high": ADMISSION_HIGH_TIMEOUT, "low": ADMISSION_LOW_TIMEOUT},
+    parse_routes(ADMISSION_ROUTES),
+) if ADMISSION_ENABLED and ADMISSION_LIMIT > 0 else None
+
+ADMISSION_WAIT = registry.register(Histogram(
+    "admission_wait_seconds", "Time admitted requests queued for a slot.", ("class",)))
+ADMISSION_SHED = registry.register(Counter(
+    "admission_shed_total", "Requests refused with a 503 by admission control.",
+    ("class", "route", "reason")))
+registry.register(Gauge("admission_queue_depth", "Requests waiting for a slot.", ("class",),
+                        lambda: admission.queue_depths() if admission else []))
+registry.register(Gauge("admission_in_flight", "Admitted requests in progress.", ("class",),
+                        lambda: admission.in_flight() if admission else []))
+
+
+def overloaded_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=503, content=response_wrapper("error", "Service Overloaded"),
+        headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware queueing requests by priority before they reach a route.
+
+    The route is matched here, ahead of the router, to pick its class; a
+    request is held until the body of its response is sent, so streamed
+    exports keep their slot to the end. Shed requests get a 503 with
+    Retry-After straight away, without reading their body.
+    """
+
+    def __init__(self, app, routes: list, controller: AdmissionController,
+                 retry_after: int = ADMISSION_RETRY_AFTER):
+        self.app = app
+        # The application's route list, filled in as routers are included
+        self.routes = routes
+        self.controller = controller
+        self.retry_after = retry_after
+
+    def match(self, scope):
+        for route in self.routes:
+            if isinstance(route, APIRoute) and route.matches(scope)[0] == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route = self.match(scope) if scope["type"] == "http" else None
+        priority, route_limiter = (
+            self.controller.policy(scope["method"], route) if route else (None, None))
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            waited = await self.controller.acquire(priority, route_limiter)
+        except OverloadedError as e:
+            ADMISSION_SHED.inc(priority, route.path_format, e.reason)
+            # Label the 503 with its route in the request metrics
+            scope["route"] = route
+            await overloaded_response(self.retry_after)(scope, receive, send)
+            return
+        ADMISSION_WAIT.observe(waited, priority)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(priority, route_limiter)
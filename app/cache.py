@@ -0,0 +1,317 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from app.config import CACHE_ENABLED, CACHE_MAX_SIZE, CACHE_REDIS_URL, CACHE_TTL
+
+
+class LRUCache:
+    """
+    In-process LRU cache with a per-entry TTL and a size bound.
+
+    Safe to share between the threadpool workers serving sync routes.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_many(self, keys: list) -> dict:
+        # The values found, by key
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key: str, value, tags: tuple = ()):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, self.clock() + self.ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_tags(self, *tags: str):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """
+    Shared cache backend on Redis, with the same interface as LRUCache.
+
+    Values are stored as strings; tags are Redis sets of the keys carrying them.
+    """
+
+    def __init__(self, client, ttl: float = 60.0, prefix: str = "bakery:cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float = 60.0):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "CACHE_REDIS_URL is set but the 'redis' package is not installed") from e
+        return cls(redis.Redis.from_url(url), ttl=ttl)
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: list) -> dict:
+        # One MGET round trip for all the keys
+        if not keys:
+            return {}
+        values = {key: value for key, value in zip(
+            keys, self.client.mget([self.prefix + key for key in keys])) if value is not None}
+        self.hits += len(values)
+        self.misses += len(keys) - len(values)
+        return values
+
+    def set(self, key: str, value, tags: tuple = ()):
+        self.set_many([(key, value, tags)])
+
+    def set_many(self, entries: list):
+        # (key, value, tags) entries, written in one pipelined round trip
+        ttl_ms = int(self.ttl * 1000)
+        pipe = self.client.pipeline()
+        for key, value, tags in entries:
+            pipe.set(self.prefix + key, value, px=ttl_ms)
+            for tag in tags:
+                pipe.sadd(self.prefix + "tag:" + tag, key)
+                pipe.pexpire(self.prefix + "tag:" + tag, ttl_ms)
+        pipe.execute()
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def invalidate_tags(self, *tags: str):
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            keys = self.client.smembers(tag_key)
+            self.client.delete(
+                tag_key, *(self.prefix + key.decode() for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def encode_entry(value, tags: tuple) -> str:
+    # The tags on a first line, so whoever reads the entry can tag its copy
+    return json.dumps(list(tags)) + "\n" + value.model_dump_json()
+
+
+def decode_entry(data, schema) -> tuple:
+    # (value, tags) of an entry written by encode_entry
+    if isinstance(data, bytes):
+        data = data.decode()
+    tags, separator, value = data.partition("\n")
+    if not separator:
+        # Written without tags, before they were stored
+        return schema.model_validate_json(data), ()
+    return schema.model_validate_json(value), tuple(json.loads(tags))
+
+
+class EntityCache:
+    """
+    Read-through cache of pydantic entity schemas, e.g. "product:1".
+
+    Reads go to the in-process tier first and then to the optional shared
+    tier (which holds JSON with the entry's tags); writes and invalidations
+    go to both. An entry read from the database or the shared tier is only
+    stored locally if no invalidation happened while it was being read, so
+    a concurrent write cannot leave it stale.
+    """
+
+    def __init__(self, local: LRUCache, shared=None):
+        self.local = local
+        self.shared = shared
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, schema):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        if self.shared is not None:
+            generation = self._generation
+            data = self.shared.get(key)
+            if data is not None:
+                value, tags = decode_entry(data, schema)
+                self._set_local([(key, value, tags)], generation)
+                return value
+        return None
+
+    def get_many(self, keys: list, schema) -> dict:
+        """
+        Read several entries, going to the shared tier once for all the local misses.
+
+        :param keys: The keys, e.g. ["product:1", "product:2"].
+        :param schema: The pydantic model of the entries.
+
+        :return: The entries found, by key.
+        """
+        values = self.local.get_many(keys)
+        misses = [key for key in keys if key not in values]
+        if self.shared is not None and misses:
+            generation = self._generation
+            entries = []
+            for key, data in self.shared.get_many(misses).items():
+                value, tags = decode_entry(data, schema)
+                values[key] = value
+                entries.append((key, value, tags))
+            self._set_local(entries, generation)
+        return values
+
+    def generation(self) -> int:
+        """Token to pass to set() for an entry about to be loaded from the database."""
+        return self._generation
+
+    def set(self, key: str, value, tags: tuple = (), generation: int = None):
+        if not self._set_local([(key, value, tags)], generation):
+            return
+        if self.shared is not None:
+            self.shared.set(key, encode_entry(value, tags), tags)
+
+    def set_many(self, entries: list, generation: int = None):
+        """
+        Store several entries loaded from the database, like set() for each.
+
+        :param entries: (key, value, tags) tuples.
+        :param generation: The generation() taken before loading them.
+        """
+        if not self._set_local(entries, generation):
+            return
+        if self.shared is not None and entries:
+            self.shared.set_many([
+                (key, encode_entry(value, tags), tags) for key, value, tags in entries])
+
+    def _set_local(self, entries: list, generation: int = None) -> bool:
+        # Store (key, value, tags) entries in the local tier, unless an
+        # invalidation happened since generation was taken
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            for key, value, tags in entries:
+                self.local.set(key, value, tags)
+        return True
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            self._generation += 1
+            self.local.delete(*keys)
+        if self.shared is not None:
+            self.shared.delete(*keys)
+
+    def invalidate_tags(self, *tags: str):
+        with self._lock:
+            self._generation += 1
+            self.local.invalidate_tags(*tags)
+        if self.shared is not None:
+            self.shared.invalidate_tags(*tags)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        stats = {"local": self.local.stats()}
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+def create_entity_cache():
+    """
+    Build the entity cache from the environment configuration.
+
+    :return: The EntityCache, or None when caching is disabled.
+    """
+    if not CACHE_ENABLED:
+        return None
+    shared = RedisCache.from_url(
+        CACHE_REDIS_URL, ttl=CACHE_TTL) if CACHE_REDIS_URL else None
+    return EntityCache(LRUCache(max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL), shared)
+
+
+# Cache shared by the product and category services
+entity_cache = create_entity_cache()
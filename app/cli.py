@@ -0,0 +1,77 @@
+"""
+Management commands.
+
+Usage:
+    python -m app.cli migrate    Apply the pending schema migrations
+    python -m app.cli version    Print the schema version of the database and of the code
+    python -m app.cli rebuild-inventory
+                                 Recompute the inventory summary from the products
+    python -m app.cli prune-history --days 90
+                                 Delete the product history older than 90 days, keeping the rollups
+    python -m app.cli prune-events --days 7
+                                 Delete the change events older than 7 days
+"""
+import argparse
+import logging
+from app.database import engine
+from app.inventory import install_inventory_triggers, prune_history, rebuild_inventory
+from app.migrations import SCHEMA_VERSION, current_version, migrate
+from app.outbox import prune_events
+
+
+def migrate_command(args):
+    before, after = migrate(engine)
+    if before == after:
+        print(f"Schema already at version {after}")
+    else:
+        print(f"Schema migrated from version {before} to {after}")
+
+
+def version_command(args):
+    with engine.connect() as connection:
+        print(f"Database: {current_version(connection)}")
+    print(f"Expected: {SCHEMA_VERSION}")
+
+
+def rebuild_inventory_command(args):
+    # Reinstall the triggers too, in case they were dropped by hand
+    with engine.begin() as connection:
+        install_inventory_triggers(connection)
+        rows = rebuild_inventory(connection)
+    print(f"Inventory summary rebuilt: {rows} categories")
+
+
+def prune_history_command(args):
+    with engine.begin() as connection:
+        rows = prune_history(connection, args.days)
+    print(f"Product history pruned: {rows} changes older than {args.days} days deleted")
+
+
+def prune_events_command(args):
+    with engine.begin() as connection:
+        rows = prune_events(connection, args.days)
+    print(f"Change events pruned: {rows} events older than {args.days} days deleted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fantastic Bakery management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="Apply the pending schema migrations").set_defaults(
+        handler=migrate_command)
+    commands.add_parser("version", help="Print the database and expected schema versions").set_defaults(
+        handler=version_command)
+    commands.add_parser("rebuild-inventory", help="Recompute the inventory summary from the products").set_defaults(
+        handler=rebuild_inventory_command)
+    prune = commands.add_parser("prune-history", help="Delete old product history, keeping the rollups")
+    prune.add_argument("--days", type=int, required=True, help="Age in days of the oldest change kept")
+    prune.set_defaults(handler=prune_history_command)
+    prune = commands.add_parser("prune-events", help="Delete old change events")
+    prune.add_argument("--days", type=int, required=True, help="Age in days of the oldest event kept")
+    prune.set_defaults(handler=prune_events_command)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
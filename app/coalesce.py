@@ -0,0 +1,124 @@
+import asyncio
+import threading
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import LRUCache
+from app.config import LIST_CACHE_MAX_SIZE, LIST_CACHE_TTL, LIST_COALESCING
+from app.database import RoutingSession, open_session
+from app.metrics import Counter, registry
+
+LIST_READS = registry.register(Counter(
+    "list_reads_total",
+    "List reads by outcome: executed against the database, joined to an identical "
+    "one in flight, or served from the micro-cache.",
+    ("list", "outcome")))
+
+
+def session_info(db) -> dict:
+    return db.sync_session.info if isinstance(db, AsyncSession) else db.info
+
+
+class SingleFlight:
+    """
+    Runs identical concurrent reads once and hands every caller the result.
+
+    Calls are keyed on their normalized parameters. The first call of a key
+    starts the read as a task of its own, on a session of its own, so the
+    callers joining it do not depend on the request that started it. With
+    a ttl, results are also kept for that long in an LRU cache.
+
+    Every commit in the process bumps a generation that is part of the key,
+    so a read started before a write is neither joined nor served from the
+    cache after it; writes of other processes show after at most the ttl.
+    """
+
+    def __init__(self, ttl: float = 0, max_size: int = 1000):
+        self.results = LRUCache(max_size=max_size, ttl=ttl) if ttl > 0 else None
+        self.generation = 0
+        # In-flight reads by key; only used from the event loop
+        self.flights = {}
+        self._lock = threading.Lock()
+
+    async def run(self, key: tuple, load):
+        """
+        Read through the in-flight reads and the cache.
+
+        :param key: The list name followed by the normalized parameters of the read.
+        :param load: Async callable taking a session and returning the result, never None.
+
+        :return: The result of the shared read.
+        """
+        key = (self.generation, *key)
+        if self.results is not None:
+            result = self.results.get(key)
+            if result is not None:
+                LIST_READS.inc(key[1], "cached")
+                return result
+        flight = self.flights.get(key)
+        if flight is not None:
+            LIST_READS.inc(key[1], "joined")
+        else:
+            LIST_READS.inc(key[1], "executed")
+            flight = self.flights[key] = asyncio.create_task(self.fly(load))
+            flight.add_done_callback(lambda flight: self.land(key, flight))
+        # A caller going away does not cancel the read for the others
+        return await asyncio.shield(flight)
+
+    async def fly(self, load):
+        async with open_session() as db:
+            return await load(db)
+
+    def land(self, key: tuple, flight):
+        del self.flights[key]
+        if flight.cancelled() or flight.exception() is not None:
+            return
+        if self.results is not None:
+            self.results.set(key, flight.result())
+
+    def invalidate(self):
+        # Called from the threads committing sessions
+        with self._lock:
+            self.generation += 1
+        if self.results is not None:
+            self.results.clear()
+
+
+# Shared by the product and category list routes
+list_flights = SingleFlight(LIST_CACHE_TTL, LIST_CACHE_MAX_SIZE) if LIST_COALESCING else None
+
+
+if list_flights is not None:
+    @event.listens_for(RoutingSession, "after_commit")
+    def invalidate_lists(session):
+        # Any write may change any list: product lists embed categories and
+        # category lists count products
+        list_flights.invalidate()
+
+
+async def coalesced(db, key: tuple, load):
+    """
+    Run a list read, shared with identical concurrent ones when coalescing is on.
+
+    :param db: The request's session; used directly when coalescing is off.
+    :param key: The list name followed by the normalized parameters of the read.
+    :param load: Async callable taking a session and returning the result.
+
+    :return: The result of the read.
+    """
+    if list_flights is None:
+        return await load(db)
+    # Requests pinned to the primary and requests allowed on a replica
+    # may see different data, so they never share a read
+    replica_allowed = session_info(db).get("replica_allowed", False)
+
+    async def load_routed(session):
+        session_info(session)["replica_allowed"] = replica_allowed
+        return await load(session)
+    return await list_flights.run((*key, replica_allowed), load_routed)
+
+
+def normalize_fields(fields: str) -> str:
+    # Sparse fieldsets select in a fixed field order, so "name,id" reads like "id,name"
+    if fields is None:
+        return None
+    return ",".join(sorted({name.strip() for name in fields.split(",") if name.strip()}))
@@ -0,0 +1,138 @@
+import os
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """
+    Read a boolean flag from the environment.
+
+    :param name: The environment variable name.
+    :param default: Value used when the variable is not set.
+
+    :return: True for "1", "true", "yes" or "on" (case-insensitive).
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Read database credentials from environment variables
+DB_USERNAME = os.environ.get("DB_USERNAME")
+DB_PASSWORD = os.environ.get("DB_PASSWORD")
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_NAME = os.environ.get("DB_NAME", "fantastic_bakery")
+
+# A full DATABASE_URL overrides the individual credentials above
+DATABASE_URL = os.environ.get(
+    "DATABASE_URL", f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
+
+# Connection pool of each engine, per worker process; the defaults match SQLAlchemy's
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced on checkout, -1 to keep connections forever
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "-1"))
+# Test connections with a lightweight ping on checkout
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING")
+# Open a new connection per checkout, for use behind an external pooler such as pgbouncer
+DB_NULL_POOL = env_bool("DB_NULL_POOL")
+# Server-side limit on the run time of every statement (PostgreSQL only)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ["DB_STATEMENT_TIMEOUT_MS"]) if os.environ.get(
+    "DB_STATEMENT_TIMEOUT_MS") else None
+
+# Connections opened per engine at startup, ahead of the first requests
+DB_POOL_WARMUP = int(os.environ.get("DB_POOL_WARMUP", str(DB_POOL_SIZE)))
+# Seconds startup keeps retrying while the database does not accept connections
+DB_STARTUP_TIMEOUT = float(os.environ.get("DB_STARTUP_TIMEOUT", "30"))
+# Apply pending schema migrations at startup instead of only checking the
+# version; convenient in development, racy with many workers in production
+DB_AUTO_MIGRATE = env_bool("DB_AUTO_MIGRATE")
+
+# Comma-separated URLs of read replicas serving the product and category reads
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get(
+    "DB_REPLICA_URLS", "").split(",") if url.strip()]
+# How a replica is picked per request: "round_robin" or "least_busy"
+DB_REPLICA_SELECTION = os.environ.get("DB_REPLICA_SELECTION", "round_robin")
+# Seconds a client reads from the primary after one of its writes
+DB_READ_YOUR_WRITES_SECONDS = float(os.environ.get("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# Serve requests through the asyncio engine instead of the blocking one
+DB_ASYNC = env_bool("DB_ASYNC")
+
+# Read-through cache for single products and categories
+CACHE_ENABLED = env_bool("CACHE_ENABLED", True)
+CACHE_MAX_SIZE = int(os.environ.get("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "60"))
+# Categories loaded into the cache at startup
+CACHE_WARMUP_CATEGORIES = int(os.environ.get("CACHE_WARMUP_CATEGORIES", "1000"))
+# Optional shared tier (requires the redis package), e.g. redis://localhost:6379/0
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+
+# Share one database execution and one encoded body between identical
+# concurrent product and category list requests of a worker
+LIST_COALESCING = env_bool("LIST_COALESCING", True)
+# Seconds a list result is reused after its execution, 0 to only share
+# in-flight ones; writes of the worker drop them at once, those of other
+# workers show after at most this long
+LIST_CACHE_TTL = float(os.environ.get("LIST_CACHE_TTL", "0"))
+LIST_CACHE_MAX_SIZE = int(os.environ.get("LIST_CACHE_MAX_SIZE", "1000"))
+
+# Change feed served on /events from the change_events outbox
+EVENTS_ENABLED = env_bool("EVENTS_ENABLED", True)
+# What wakes the feed when events are written: "postgres" (LISTEN/NOTIFY, so
+# writes of every worker show at once) or "memory" (commits of this worker
+# only); by default "postgres" on PostgreSQL
+EVENTS_BROKER = os.environ.get("EVENTS_BROKER")
+# Seconds between reads of the outbox when nothing woke the feed
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", "2"))
+# Recent events kept in memory; clients further behind catch up from the table
+EVENTS_BUFFER_SIZE = int(os.environ.get("EVENTS_BUFFER_SIZE", "10000"))
+# Seconds between keep-alive comments on idle streams
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Seconds after which a stream ends and the client reconnects with its
+# Last-Event-ID, so streams spread over workers and never hold up a shutdown
+EVENTS_STREAM_SECONDS = float(os.environ.get("EVENTS_STREAM_SECONDS", "300"))
+# Longest the feed holds back events behind a missing id, waiting for the
+# transaction that took it to commit or roll back
+EVENTS_GAP_TIMEOUT = float(os.environ.get("EVENTS_GAP_TIMEOUT", "10"))
+
+# In-memory prefix index over product and category names serving /products/suggest
+SUGGEST_ENABLED = env_bool("SUGGEST_ENABLED", True)
+# Seconds between catch-ups with the writes of other worker processes, 0 to disable
+SUGGEST_REFRESH_SECONDS = float(os.environ.get("SUGGEST_REFRESH_SECONDS", "10"))
+# Versions a refresh re-reads below the highest it has seen, to catch writes
+# that drew their version before a higher one committed
+SUGGEST_REFRESH_OVERLAP = int(os.environ.get("SUGGEST_REFRESH_OVERLAP", "1000"))
+
+# Admission control: requests holding a database session admitted at once
+# per worker, by default as many as the pool can serve; the rest queue by
+# priority class and are shed with a 503 when their queue is full or their
+# deadline passes
+ADMISSION_ENABLED = env_bool("ADMISSION_ENABLED", True)
+ADMISSION_LIMIT = int(os.environ.get("ADMISSION_LIMIT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+# Most requests of the low class (lists, searches, exports) admitted at once,
+# by default leaving a quarter of ADMISSION_LIMIT to the high class
+ADMISSION_LOW_LIMIT = int(os.environ.get(
+    "ADMISSION_LOW_LIMIT", str(max(ADMISSION_LIMIT - max(ADMISSION_LIMIT // 4, 1), 1))))
+# Requests waiting per class, and seconds each may wait before being shed
+ADMISSION_HIGH_QUEUE = int(os.environ.get("ADMISSION_HIGH_QUEUE", "100"))
+ADMISSION_LOW_QUEUE = int(os.environ.get("ADMISSION_LOW_QUEUE", "50"))
+ADMISSION_HIGH_TIMEOUT = float(os.environ.get("ADMISSION_HIGH_TIMEOUT", "10"))
+ADMISSION_LOW_TIMEOUT = float(os.environ.get("ADMISSION_LOW_TIMEOUT", "2"))
+# Per-route overrides, e.g. "GET /products/export=low:2,GET /inventory/summary=high":
+# the class ("high", "low" or "none" to bypass admission) and an optional
+# limit on the route's own concurrent requests
+ADMISSION_ROUTES = os.environ.get("ADMISSION_ROUTES", "")
+# Seconds clients are told to wait in the Retry-After of a shed request
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+
+# Serialize the read endpoints straight to JSON with orjson, skipping the
+# response model validation (requires the orjson package)
+FAST_RESPONSES = env_bool("FAST_RESPONSES")
+
+# Request latency, SQL and pool metrics served on /metrics
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+# Log statements slower than this many milliseconds, with their parameters
+SLOW_QUERY_MS = float(os.environ["SLOW_QUERY_MS"]) if os.environ.get(
+    "SLOW_QUERY_MS") else None
@@ -1,22 +1,455 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event, false, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.dml import Delete, Insert
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from app.config import (
+    DATABASE_URL, DB_ASYNC, DB_MAX_OVERFLOW, DB_NULL_POOL, DB_POOL_PRE_PING, DB_POOL_RECYCLE,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_REPLICA_SELECTION, DB_REPLICA_URLS,
+    DB_STATEMENT_TIMEOUT_MS, METRICS_ENABLED)
+from app.metrics import (
+    TimedAsyncQueuePool, TimedNullPool, TimedQueuePool, instrument_engine, record_pool_wait)
+from app.replicas import ReplicaSet, is_read, pinned_to_primary
 
-# Read database credentials from environment variables
-DB_USERNAME = os.environ.get("DB_USERNAME")
-DB_PASSWORD = os.environ.get("DB_PASSWORD")
-DB_HOST = os.environ.get("DB_HOST", "localhost")
-DB_NAME = os.environ.get("DB_NAME", "fantastic_bakery")
+# Async drivers used when DB_ASYNC is enabled, keyed by backend name
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+# Insert constructs supporting ON CONFLICT, keyed by backend name
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
 
 # Construct the database URL
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+
+def connect_args(database_url: str) -> dict:
+    # SQLite connections are shared between the threadpool workers of one request
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {"check_same_thread": False}
+    return {}
+
+
+CONNECT_ARGS = connect_args(SQLALCHEMY_DATABASE_URL)
+
+
+def pool_args(pool_class, name: str, database_url: str = SQLALCHEMY_DATABASE_URL) -> dict:
+    """
+    Engine arguments for the connection pool configured in the environment.
+
+    The pools report how long each checkout waited for a connection. With
+    DB_NULL_POOL every checkout opens a new connection, leaving the pooling
+    to an external pooler such as pgbouncer.
+
+    :param pool_class: The timed queue pool class for the engine flavour.
+    :param name: Label of the engine in the metrics.
+    :param database_url: The URL the engine connects to.
+
+    :return: Keyword arguments for create_engine; empty for SQLite, which keeps its default pool.
+    """
+    if connect_args(database_url):
+        return {}
+    args = {
+        "pool_logging_name": name,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if DB_NULL_POOL:
+        args["poolclass"] = TimedNullPool
+    else:
+        args.update(poolclass=pool_class, pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return args
+
+
+def configure_engine(engine, name: str):
+    """
+    Apply the per-connection settings and the metrics hooks to an engine.
+
+    :param engine: The sync Engine (for an AsyncEngine, its sync_engine).
+    :param name: Label of the engine in the metrics.
+    """
+    if DB_STATEMENT_TIMEOUT_MS is not None and engine.dialect.name == "postgresql":
+        @event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS:d}")
+            cursor.close()
+    if METRICS_ENABLED:
+        instrument_engine(engine, name)
+
 
 # Create a database engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=CONNECT_ARGS,
+                       **pool_args(TimedQueuePool, "primary"))
+configure_engine(engine, "primary")
+
+
+class RoutingSession(Session):
+    """
+    Session sending the reads of replica_read service methods to a replica.
+
+    The replica is chosen on first use and kept for the rest of the session,
+    so the queries of one request see the same snapshot. Flushes, and every
+    statement outside a replica read, go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("replica_reads") and not self._flushing:
+            replica = self.info.get("replica")
+            if replica is None:
+                replica = self.info["replica"] = replicas.choose()
+            return replica
+        return super().get_bind(mapper, clause, **kw)
+
 
 # Create a session class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
 
 # Create a base class for declarative class definitions
 Base = declarative_base()
+
+
+def get_async_database_url(database_url: str) -> URL:
+    """
+    Rewrite a database URL to use the asyncio driver for its backend.
+
+    :param database_url: The sync database URL.
+
+    :return: The same URL with an async driver, e.g. postgresql+asyncpg://.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+# Create the asyncio engine and session class only when async mode is on,
+# so the async driver is not required by sync deployments
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    async_engine = create_async_engine(
+        get_async_database_url(SQLALCHEMY_DATABASE_URL),
+        **pool_args(TimedAsyncQueuePool, "primary_async"))
+    configure_engine(async_engine.sync_engine, "primary_async")
+    # Objects must stay readable after commit, as nothing can lazy-load
+    # outside of the greenlet once the service call has returned
+    AsyncSessionLocal = sessionmaker(
+        async_engine, class_=AsyncSession, sync_session_class=RoutingSession,
+        autoflush=False, expire_on_commit=False)
+
+
+def create_replica_engine(database_url: str, name: str):
+    """
+    Create the engine of a read replica, in the flavour requests are served with.
+
+    :param database_url: The sync URL of the replica.
+    :param name: Label of the engine in the metrics.
+
+    :return: The sync Engine (for async mode, the AsyncEngine's sync_engine).
+    """
+    if DB_ASYNC:
+        replica = create_async_engine(
+            get_async_database_url(database_url),
+            **pool_args(TimedAsyncQueuePool, name, database_url)).sync_engine
+    else:
+        replica = create_engine(database_url, connect_args=connect_args(database_url),
+                                **pool_args(TimedQueuePool, name, database_url))
+    configure_engine(replica, name)
+    return replica
+
+
+# Read replicas; without any, every read stays on the primary
+replicas = ReplicaSet([
+    create_replica_engine(url, f"replica{n}") for n, url in enumerate(DB_REPLICA_URLS, 1)
+], DB_REPLICA_SELECTION)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def record_write(session):
+    # Sessions only commit writes
+    if replicas:
+        replicas.record_write()
+
+
+def allow_replica_reads(db, request: Request):
+    # Reads of safe requests may go to a replica, unless the client wrote recently
+    db.info["replica_allowed"] = bool(replicas) and is_read(request.method, request.url.path) and (
+        not pinned_to_primary(request.headers.get("cookie")))
+
+
+def cacheable(db) -> bool:
+    """
+    Whether entities a session just read may be cached.
+
+    Rows read from a replica shortly after a write of this process may
+    predate it, and caching them would outlive the read-your-writes window.
+
+    :param db: The sync session the entities were read with.
+
+    :return: False for replica reads until the replicas are assumed to have caught up.
+    """
+    return db.info.get("replica") is None or replicas.settled()
+
+
+@event.listens_for(Session, "after_begin")
+def add_pool_wait(session, transaction, connection):
+    # Every transaction checks out a connection; sum their waits per session
+    session.info["pool_wait"] = session.info.get("pool_wait", 0.0) + connection.info.get(
+        "pool_wait", 0.0)
+
+
+# Dependency to get a database session
+def get_db(request: Request):
+    """
+    Dependency to get a blocking database session.
+
+    The session may read from a replica when the request is a read. The time
+    it spent waiting for pooled connections is added to the request's
+    metrics when it closes, apart from the SQL time.
+    """
+    db = SessionLocal()
+    allow_replica_reads(db, request)
+    try:
+        yield db
+    finally:
+        db.close()
+        record_pool_wait(db.info.get("pool_wait", 0.0))
+
+
+async def get_async_db(request: Request):
+    """
+    Dependency to get an asyncio database session, routed and reporting its pool wait like get_db.
+    """
+    async with AsyncSessionLocal() as db:
+        allow_replica_reads(db.sync_session, request)
+        try:
+            yield db
+        finally:
+            record_pool_wait(db.sync_session.info.get("pool_wait", 0.0))
+
+
+# Session dependency used by the routes, selected by DB_ASYNC
+get_session = get_async_db if DB_ASYNC else get_db
+
+
+async def run_in_session(db, fn, *args, **kwargs):
+    """
+    Run a service call against either session flavour without blocking the event loop.
+
+    With an AsyncSession the call runs through ``run_sync`` on the async
+    driver, otherwise it is handed to the threadpool as a sync route would be.
+
+    :param db: The Session or AsyncSession from the session dependency.
+    :param fn: A service method taking the sync session as first argument.
+
+    :return: Whatever the service method returns.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def run_with_connection(fn, *args):
+    """
+    Run a function on a connection of the engine serving the requests.
+
+    :param fn: Callable taking a sync Connection as first argument.
+
+    :return: Whatever fn returns.
+    """
+    if async_engine is not None:
+        async with async_engine.connect() as connection:
+            return await connection.run_sync(fn, *args)
+
+    def run():
+        with engine.connect() as connection:
+            return fn(connection, *args)
+    return await run_in_threadpool(run)
+
+
+@asynccontextmanager
+async def open_session():
+    """
+    Open a session of its own, outside of any request, in the flavour requests are served with.
+
+    :return: A context manager yielding the Session or AsyncSession, closed on exit.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
+
+
+async def run_in_new_session(fn, *args, **kwargs):
+    """
+    Run a service call on a session of its own, outside of any request.
+
+    :param fn: A service method taking the sync session as first argument.
+
+    :return: Whatever the service method returns.
+    """
+    async with open_session() as db:
+        return await run_in_session(db, fn, *args, **kwargs)
+
+
+async def warm_up_pool(size: int) -> int:
+    """
+    Open pooled connections of the serving engine ahead of the first requests.
+
+    :param size: Number of connections to open; capped to the pool size.
+
+    :return: The number of connections opened.
+    """
+    pool = (async_engine.sync_engine if async_engine is not None else engine).pool
+    if not isinstance(pool, QueuePool):
+        # Nothing to keep: NullPool (external pooler) or SQLite
+        return 0
+    size = min(size, pool.size())
+    if async_engine is not None:
+        connections = [await async_engine.connect() for _ in range(size)]
+        for connection in connections:
+            await connection.close()
+        return size
+
+    def open_connections():
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
+    await run_in_threadpool(open_connections)
+    return size
+
+
+def execute_returning(db, statement, lookup) -> list:
+    """
+    Execute an INSERT, UPDATE or DELETE and return the rows it wrote in one round trip.
+
+    On backends with RETURNING the statement becomes a data-modifying CTE
+    and lookup selects from it, so related rows can be joined in the same
+    statement. Elsewhere lookup runs against the table itself, restricted to
+    the primary keys matched by the statement: before a DELETE, or after an
+    INSERT or UPDATE. On SQLite the keys are read under the write lock, so
+    they are the rows the statement then writes.
+
+    :param db: The sync session.
+    :param statement: A Core insert() of at most one row, update() or delete() of a single table.
+    :param lookup: Callable taking the written rows as a table-like source
+        (the CTE or the table) and returning the SELECT of the result rows.
+
+    :return: The selected rows.
+    """
+    table = statement.table
+    if db.get_bind().dialect.full_returning:
+        written = statement.returning(*table.c).cte("written")
+        return db.execute(lookup(written)).all()
+
+    (primary_key,) = table.primary_key.columns
+    if isinstance(statement, Insert):
+        # A single row, or none for an INSERT ... SELECT whose WHERE did not hold
+        result = db.execute(statement)
+        if not result.rowcount:
+            return []
+        # SQLAlchemy only tracks the key of INSERT ... VALUES; the driver's
+        # last row id stands in for INSERT ... SELECT
+        (key,) = result.inserted_primary_key
+        if key is None:
+            key = result.lastrowid
+        return db.execute(lookup(table).where(primary_key == key)).all()
+    if db.get_bind().dialect.name == "sqlite":
+        # Take SQLite's database-wide write lock before reading the keys, with
+        # an UPDATE of no rows, so no other writer can change which rows the
+        # statement matches before it runs. It also opens the transaction:
+        # the driver only begins one before statements starting with a DML
+        # keyword, so a statement starting with WITH would otherwise commit
+        # on its own
+        db.execute(update(table).where(false()).values({primary_key.name: primary_key}))
+    keys = db.execute(
+        select(primary_key).where(statement.whereclause)).scalars().all()
+    if not keys:
+        return []
+    if isinstance(statement, Delete):
+        rows = db.execute(lookup(table).where(primary_key.in_(keys))).all()
+        db.execute(statement)
+        return rows
+    db.execute(statement)
+    return db.execute(lookup(table).where(primary_key.in_(keys))).all()
+
+
+def upsert(db, table, key, columns) -> Insert:
+    """
+    Build an INSERT that updates the row already holding the same key instead of failing.
+
+    The row is matched by the database itself (ON CONFLICT ... DO UPDATE),
+    so concurrent writers of the same key end up with one row, written last
+    by whichever committed last. Columns with a SQL onupdate, such as the
+    version, get it as they would from an UPDATE.
+
+    :param db: The sync session.
+    :param table: The table written.
+    :param key: The column of a unique index identifying rows.
+    :param columns: Names of the columns given by the rows, replaced on conflict.
+
+    :return: The insert(), to execute with the rows.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}")
+    statement = UPSERT_INSERTS[dialect](table)
+    values = {name: statement.excluded[name] for name in columns if name != key.name}
+    values.update({column.name: column.onupdate.arg for column in table.c
+                   if column.onupdate is not None and column.onupdate.is_clause_element})
+    return statement.on_conflict_do_update(index_elements=[key], set_=values)
+
+
+async def stream_partitions(build_statement, size: int):
+    """
+    Stream the rows of a statement from a server-side cursor, size rows at a time.
+
+    The rows are read on a dedicated session that lives as long as the
+    iteration, so this can feed a StreamingResponse after the request's own
+    session dependency has been closed.
+
+    :param build_statement: Callable taking the sync session and returning the statement.
+    :param size: Number of rows fetched per round trip and yielded per list.
+
+    :return: An async iterator of lists of rows.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            statement = build_statement(db.sync_session)
+            result = await db.stream(statement.execution_options(yield_per=size))
+            async for rows in result.partitions(size):
+                yield rows
+        return
+
+    db = SessionLocal()
+    try:
+        statement = build_statement(db)
+        result = await run_in_threadpool(
+            db.execute, statement.execution_options(stream_results=True, yield_per=size))
+        partitions = result.partitions(size)
+        while True:
+            rows = await run_in_threadpool(next, partitions, None)
+            if rows is None:
+                break
+            yield rows
+    finally:
+        await run_in_threadpool(db.close)
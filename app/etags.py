@@ -0,0 +1,174 @@
+import hashlib
+from sqlalchemy import Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+# Tables whose rows carry a version, each drawn from a counter of its own
+VERSIONED_TABLES = ("categories", "products", "category_inventory")
+
+
+class PreconditionFailedError(Exception):
+    """Raised when an If-Match precondition does not hold for the current row version."""
+
+
+def next_version_sql(table_name: str, dialect: str) -> str:
+    """
+    SQL giving a written row the next version of its table, for raw statements and triggers.
+
+    :param table_name: One of the VERSIONED_TABLES.
+    :param dialect: The backend name, "postgresql" or "sqlite".
+
+    :return: The SQL expression.
+    """
+    if dialect == "postgresql":
+        return f"nextval('{table_name}_version_seq')"
+    return f"(coalesce((SELECT value FROM version_counters WHERE name = '{table_name}'), 0) + 1)"
+
+
+class next_version(ColumnElement):
+    """
+    SQL expression giving a written row the next table-wide version.
+
+    Every insert and update stamps the row with a version above all others
+    ever given in the table, so the max version of any set of rows moves
+    forward whenever one of them changes; list ETags rely on that. The
+    versions come from a counter per table that deletes never move back: a
+    sequence on PostgreSQL, so concurrent writers never share a version, and
+    a row of version_counters kept by triggers on SQLite, whose writers are
+    serialized. install_version_counters creates them.
+
+    :param table_name: One of the VERSIONED_TABLES.
+    """
+
+    type = Integer()
+    inherit_cache = True
+    _traverse_internals = [("table_name", InternalTraversal.dp_string)]
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+
+@compiles(next_version)
+def compile_next_version(element, compiler, **kw):
+    return next_version_sql(element.table_name, compiler.dialect.name)
+
+
+def install_version_counters(connection):
+    """
+    Create the version counter of every versioned table, starting after its highest version.
+
+    The statements are idempotent and never move a counter back, so this
+    can run again to repair the counters.
+
+    :param connection: A sync Connection, inside a transaction.
+    """
+    dialect = connection.dialect.name
+    for table_name in VERSIONED_TABLES:
+        if dialect == "postgresql":
+            sequence = f"{table_name}_version_seq"
+            connection.exec_driver_sql(f"CREATE SEQUENCE IF NOT EXISTS {sequence}")
+            connection.exec_driver_sql(
+                f"SELECT setval('{sequence}', greatest("
+                f"(SELECT coalesce(max(version), 0) + 1 FROM {table_name}), "
+                f"(SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END "
+                f"FROM {sequence})), false)")
+        elif dialect == "sqlite":
+            connection.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS version_counters "
+                "(name VARCHAR PRIMARY KEY, value INTEGER NOT NULL)")
+            record = ("INSERT INTO version_counters (name, value) VALUES ('{}', {}) "
+                      "ON CONFLICT (name) DO UPDATE SET value = max(value, excluded.value)")
+            connection.exec_driver_sql(record.format(
+                table_name, f"(SELECT coalesce(max(version), 0) FROM {table_name})"))
+            for operation in ("INSERT", "UPDATE OF version"):
+                name = f"{table_name}_version_{operation.split()[0].lower()}"
+                connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+                connection.exec_driver_sql(
+                    f"CREATE TRIGGER {name} AFTER {operation} ON {table_name} "
+                    f"BEGIN {record.format(table_name, 'NEW.version')}; END")
+        else:
+            raise NotImplementedError(f"No version counters for '{dialect}'")
+
+
+def product_etag(version: int, category_version: int) -> str:
+    """
+    Strong ETag of a product representation, which embeds its category.
+
+    :param version: The product version.
+    :param category_version: The version of the product's category.
+
+    :return: The quoted ETag.
+    """
+    return f'"p{version}.c{category_version}"'
+
+
+def category_etag(version: int) -> str:
+    """
+    Strong ETag of a category representation.
+
+    :param version: The category version.
+
+    :return: The quoted ETag.
+    """
+    return f'"c{version}"'
+
+
+def list_etag(kind: str, count: int, *max_versions) -> str:
+    """
+    Strong ETag of a filtered list, from its size and the max versions of the rows it covers.
+
+    :param kind: Short prefix naming the listed entity.
+    :param count: Number of rows in the filtered set.
+    :param max_versions: Max version of each table contributing to the representation.
+
+    :return: The quoted ETag.
+    """
+    return '"{}{}.{}"'.format(kind, count, ".".join(str(version or 0) for version in max_versions))
+
+
+def content_etag(kind: str, body: bytes) -> str:
+    """
+    Strong ETag of an encoded representation, from a digest of its bytes.
+
+    For responses without a cheap version to derive one from, such as a
+    cursor page, whose set-wide version would cost a scan of the filtered
+    set on every page.
+
+    :param kind: Short prefix naming the listed entity.
+    :param body: The encoded response body.
+
+    :return: The quoted ETag.
+    """
+    return f'"{kind}-{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Check an If-None-Match or If-Match header against an ETag.
+
+    :param header: The header value, a list of ETags or "*".
+    :param etag: The current ETag.
+
+    :return: True if any listed ETag matches.
+    """
+    if header is None:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def parse_version(etag: str, prefix: str) -> int:
+    """
+    Extract the row version from an ETag issued by product_etag or category_etag.
+
+    :param etag: The quoted ETag from an If-Match header.
+    :param prefix: "p" for products, "c" for categories.
+
+    :return: The version, or None if the ETag was not issued for this entity.
+    """
+    value = etag.strip().strip('"')
+    if not value.startswith(prefix):
+        return None
+    version = value[len(prefix):].split(".")[0]
+    return int(version) if version.isdigit() else None
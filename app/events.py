@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_right
+from sqlalchemy import BigInteger, event, func, literal_column, select
+from starlette.concurrency import run_in_threadpool
+from app.config import (
+    EVENTS_BROKER, EVENTS_BUFFER_SIZE, EVENTS_ENABLED, EVENTS_GAP_TIMEOUT, EVENTS_POLL_SECONDS)
+from app.database import RoutingSession, engine, run_in_new_session
+from app.metrics import Counter, Gauge, registry
+from app.models.change_event import ChangeEvent
+from app.outbox import CHANGE_CHANNEL
+
+logger = logging.getLogger("app.events")
+
+# Events read per query, by the feed and by streams catching up
+EVENTS_PAGE = 1000
+# Seconds between reads while events are held back behind a missing id
+GAP_RETRY_SECONDS = 0.05
+# Milliseconds browsers wait before reconnecting a dropped stream
+RECONNECT_MS = 3000
+
+EVENT_COLUMNS = tuple(ChangeEvent.__table__.c)
+# Oldest transaction still running and next one to start, as of the
+# snapshot of the read, to tell when a missing id can no longer commit
+SNAPSHOT_COLUMNS = (
+    literal_column("pg_snapshot_xmin(pg_current_snapshot())::text").cast(BigInteger).label("xmin"),
+    literal_column("pg_snapshot_xmax(pg_current_snapshot())::text").cast(BigInteger).label("xmax"),
+)
+
+EVENTS_PUBLISHED = registry.register(Counter(
+    "events_published_total", "Change events published to the /events streams."))
+
+
+def format_event(row) -> bytes:
+    # One SSE message, encoded once and sent as it is to every stream
+    payload = json.dumps({
+        "id": row.id,
+        "entity": row.entity,
+        "action": row.action,
+        "entity_id": row.entity_id,
+        "created_at": row.created_at.isoformat(),
+        "data": json.loads(row.data),
+    }, separators=(",", ":"))
+    return f"id: {row.id}\nevent: {row.entity}.{row.action}\ndata: {payload}\n\n".encode()
+
+
+def reset_message(last_id: int) -> bytes:
+    # Tells a client that the events it asked for are gone and it should reload
+    return f'id: {last_id}\nevent: reset\ndata: {{"id":{last_id}}}\n\n'.encode()
+
+
+class MemoryBroker:
+    """
+    Wakes the feed when a session of this process commits.
+
+    Stands in for LISTEN/NOTIFY on SQLite and in tests; writes of other
+    processes only show at the feed's periodic read.
+    """
+
+    def __init__(self):
+        self.wake = None
+        self.loop = None
+        event.listen(RoutingSession, "after_commit", self.notify)
+
+    async def start(self, wake):
+        self.loop = asyncio.get_running_loop()
+        self.wake = wake
+
+    def notify(self, session):
+        # Sessions commit in threadpool workers as well as on the event loop
+        if self.wake is not None:
+            self.loop.call_soon_threadsafe(self.wake)
+
+    async def listen(self):
+        pass
+
+    async def stop(self):
+        self.wake = None
+
+
+class PostgresBroker:
+    """
+    Wakes the feed on the notifications of the outbox triggers.
+
+    A connection of its own, outside the pool, stays in LISTEN and is
+    read from the event loop. If it drops, the feed keeps polling and the
+    connection is reopened on its next read.
+    """
+
+    def __init__(self, engine, channel: str = CHANGE_CHANNEL):
+        self.engine = engine
+        self.channel = channel
+        self.connection = None
+        self.wake = None
+        self.loop = None
+
+    async def start(self, wake):
+        self.loop = asyncio.get_running_loop()
+        self.wake = wake
+        await self.listen()
+
+    async def listen(self):
+        """Open the listening connection, unless it is open already."""
+        if self.connection is not None or self.wake is None:
+            return
+        try:
+            connection = await run_in_threadpool(self.open)
+        except Exception:
+            logger.warning("Could not LISTEN for change events; polling every %.1fs instead",
+                           EVENTS_POLL_SECONDS, exc_info=True)
+            return
+        self.connection = connection
+        self.loop.add_reader(connection.fileno(), self.read)
+
+    def open(self):
+        fairy = self.engine.raw_connection()
+        fairy.detach()
+        connection = fairy.connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return connection
+
+    def read(self):
+        try:
+            self.connection.poll()
+        except Exception:
+            logger.warning("Lost the LISTEN connection for change events", exc_info=True)
+            self.close()
+            self.wake()
+            return
+        if self.connection.notifies:
+            self.connection.notifies.clear()
+            self.wake()
+
+    def close(self):
+        if self.connection is not None:
+            self.loop.remove_reader(self.connection.fileno())
+            self.connection.close()
+            self.connection = None
+
+    async def stop(self):
+        self.wake = None
+        self.close()
+
+
+def create_broker():
+    """
+    Build the broker configured by EVENTS_BROKER.
+
+    :return: A PostgresBroker on PostgreSQL unless "memory" is asked for, a MemoryBroker otherwise.
+    """
+    name = EVENTS_BROKER or ("postgres" if engine.dialect.name == "postgresql" else "memory")
+    if name == "postgres":
+        return PostgresBroker(engine)
+    if name == "memory":
+        return MemoryBroker()
+    raise ValueError(f"Unknown events broker '{name}'")
+
+
+class ChangeFeed:
+    """
+    Fans the change_events outbox out to the /events streams of this process.
+
+    One task reads the new events when the broker wakes it, or every
+    poll_interval, and keeps the latest ones in memory. Each stream follows
+    the feed from its own last event id, at its own pace: a slow client
+    holds no queue, it only falls behind, and once behind the events kept
+    in memory it catches up from the table a page at a time.
+
+    Events are published in id order. Ids are taken before commit, so a
+    transaction can commit after another one holding a higher id; events
+    behind a missing id are held back until every transaction that could
+    hold it has ended (on PostgreSQL, known from the snapshot xmin), or for
+    at most gap_timeout.
+    """
+
+    def __init__(self, broker, buffer_size: int = 10000, poll_interval: float = 2.0,
+                 gap_timeout: float = 10.0):
+        self.broker = broker
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        # Published (id, entity, message), in id order
+        self.events = []
+        # Every published event after floor is in events
+        self.floor = 0
+        # Last published id
+        self.head = 0
+        # (missing id, detected at, snapshot xmax) while events are held back
+        self.gap = None
+        self.subscribers = 0
+        self.closed = False
+        self.changed = None
+        self.wakeup = None
+        self.task = None
+
+    async def start(self):
+        """Start from the newest event in the table and follow the new ones."""
+        self.changed = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        self.head = self.floor = await run_in_new_session(self.last_id)
+        await self.broker.start(self.wakeup.set)
+        self.task = asyncio.create_task(self.follow())
+
+    async def stop(self):
+        self.closed = True
+        if self.changed is not None:
+            self.changed.set()
+        if self.task is not None:
+            self.task.cancel()
+        await self.broker.stop()
+
+    def last_id(self, db) -> int:
+        return db.scalar(select(func.coalesce(func.max(ChangeEvent.id), 0)))
+
+    def read_new(self, db) -> list:
+        query = select(*EVENT_COLUMNS).where(ChangeEvent.id > self.head)
+        if db.get_bind().dialect.name == "postgresql":
+            query = query.add_columns(*SNAPSHOT_COLUMNS)
+        return db.execute(query.order_by(ChangeEvent.id).limit(EVENTS_PAGE)).all()
+
+    async def follow(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(), GAP_RETRY_SECONDS if self.gap else self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.broker.listen()
+                while True:
+                    rows = await run_in_new_session(self.read_new)
+                    if not self.publish(rows) or len(rows) < EVENTS_PAGE:
+                        break
+            except Exception:
+                logger.exception("Reading the change events failed")
+
+    def gap_settled(self, row) -> bool:
+        if self.gap is None or self.gap[0] != self.head + 1:
+            self.gap = (self.head + 1, time.monotonic(), getattr(row, "xmax", None))
+        _, detected_at, horizon = self.gap
+        # Without snapshots (SQLite), writers are serialized and commit in id order
+        if horizon is None or row.xmin >= horizon:
+            return True
+        return time.monotonic() - detected_at >= self.gap_timeout
+
+    def publish(self, rows: list) -> bool:
+        """
+        Publish the rows read, in id order, up to the first missing id that may still commit.
+
+        :return: Whether every row was published.
+        """
+        published = []
+        for row in rows:
+            if row.id != self.head + 1 and not self.gap_settled(row):
+                break
+            self.gap = None
+            published.append((row.id, row.entity, format_event(row)))
+            self.head = row.id
+        if published:
+            self.events.extend(published)
+            if len(self.events) > 2 * self.buffer_size:
+                # Trim in bulk, so the list is only copied once per buffer_size events
+                trimmed = len(self.events) - self.buffer_size
+                self.floor = self.events[trimmed - 1][0]
+                del self.events[:trimmed]
+            EVENTS_PUBLISHED.inc(amount=len(published))
+            changed, self.changed = self.changed, asyncio.Event()
+            changed.set()
+        return len(published) == len(rows)
+
+    def read_after(self, db, last_id: int, head: int) -> tuple:
+        # A page of published events from the table, and whether last_id was pruned
+        oldest = db.scalar(select(func.min(ChangeEvent.id)))
+        if oldest is None or oldest > last_id + 1:
+            return [], True
+        rows = db.execute(
+            select(*EVENT_COLUMNS).where(ChangeEvent.id > last_id, ChangeEvent.id <= head)
+            .order_by(ChangeEvent.id).limit(EVENTS_PAGE)).all()
+        return [(row.id, row.entity, format_event(row)) for row in rows], False
+
+    async def stream(self, last_id: int = None, entities: set = None,
+                     heartbeat: float = 15.0, duration: float = 300.0):
+        """
+        Yield the SSE messages of the events after last_id, then of every new one.
+
+        :param last_id: Id of the last event the client received; None to start from now.
+        :param entities: Entities to send the events of, e.g. {"product"}; None for all.
+        :param heartbeat: Seconds between keep-alive comments while idle.
+        :param duration: Seconds after which the stream ends, for the client to reconnect.
+
+        :return: An async iterator of encoded messages.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        if last_id is None:
+            last_id = self.head
+        self.subscribers += 1
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n".encode()
+            while not self.closed:
+                changed = self.changed
+                if last_id < self.floor:
+                    # Behind the events kept in memory: catch up from the table
+                    events, pruned = await run_in_new_session(
+                        self.read_after, last_id, self.floor)
+                    if pruned:
+                        last_id = self.head
+                        yield reset_message(last_id)
+                        continue
+                    if not events:
+                        last_id = self.floor
+                else:
+                    start = bisect_right(self.events, last_id, key=lambda e: e[0])
+                    events = self.events[start:start + EVENTS_PAGE]
+                if events:
+                    last_id = events[-1][0]
+                    messages = [message for _, entity, message in events
+                                if entities is None or entity in entities]
+                    if messages:
+                        yield b"".join(messages)
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            self.subscribers -= 1
+
+
+change_feed = ChangeFeed(
+    create_broker(), EVENTS_BUFFER_SIZE, EVENTS_POLL_SECONDS, EVENTS_GAP_TIMEOUT,
+) if EVENTS_ENABLED else None
+
+registry.register(Gauge("events_subscribers", "Open /events streams.", (),
+                        lambda: [((), change_feed.subscribers)] if change_feed else []))
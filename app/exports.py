@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+import zlib
+
+# Media types of the streaming export formats
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def encode_rows(rows, columns: list, export_format: str) -> str:
+    """
+    Encode a list of rows as NDJSON lines or CSV records.
+
+    :param rows: Rows with the given columns, in order.
+    :param columns: The column names.
+    :param export_format: "csv" or "ndjson".
+
+    :return: The encoded text, ending with a newline.
+    """
+    if export_format == "ndjson":
+        return "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+async def iter_export(partitions, columns: list, export_format: str, compress: bool = False):
+    """
+    Turn streamed row partitions into the chunks of an export body.
+
+    Memory use is bounded by one partition, whatever the size of the result.
+
+    :param partitions: Async iterator of lists of rows, e.g. from stream_partitions.
+    :param columns: The column names, written as the CSV header and NDJSON keys.
+    :param export_format: "csv" or "ndjson".
+    :param compress: Whether to gzip the body.
+
+    :return: An async iterator of bytes chunks.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    if export_format == "csv":
+        yield encode(encode_rows([columns], columns, "csv"))
+    async for rows in partitions:
+        chunk = encode(encode_rows(rows, columns, export_format))
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
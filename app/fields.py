@@ -0,0 +1,45 @@
+class UnknownFieldError(ValueError):
+    """Raised when a sparse fieldset names a field the resource does not have."""
+
+
+def parse_fields(fields: str, available: dict, required: tuple = ("id",)) -> list:
+    """
+    Resolve a comma-separated sparse fieldset into the columns to select.
+
+    :param fields: The requested field names, e.g. "id,name,price"; None for every field.
+    :param available: Columns behind each public field name, in output order.
+    :param required: Fields always included, e.g. the id needed for cursors.
+
+    :return: The columns to select, without duplicates.
+    """
+    if fields is None:
+        names = list(available)
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise UnknownFieldError(f"Unknown Field: {', '.join(unknown)}")
+        names = [name for name in available if name in names or name in required]
+    return [column for name in names for column in available[name]]
+
+
+class InvalidIdsError(ValueError):
+    """Raised when an id list is not made of integers or is too long."""
+
+
+def parse_ids(ids: str, limit: int) -> list:
+    """
+    Parse a comma-separated id list, e.g. the ids of a multi-get.
+
+    :param ids: The ids, e.g. "3,1,2".
+    :param limit: The most ids accepted.
+
+    :return: The ids, in the given order.
+    """
+    try:
+        values = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError as e:
+        raise InvalidIdsError("Invalid Ids: expected comma-separated integers") from e
+    if len(values) > limit:
+        raise InvalidIdsError(f"Invalid Ids: at most {limit} per request")
+    return values
@@ -0,0 +1,163 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Tuple
+from pydantic import ValidationError
+
+# Content types accepted by the streaming import endpoints, by format
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+class ImportFormatError(ValueError):
+    """Raised when the import body cannot be parsed as a whole (e.g. a missing CSV header)."""
+
+
+def detect_import_format(content_type: str, requested: str = None) -> str:
+    """
+    Work out the import format from an explicit choice or the request Content-Type.
+
+    :param content_type: The Content-Type header of the request.
+    :param requested: The format requested explicitly, if any.
+
+    :return: "csv" or "ndjson", or None when the format is not supported.
+    """
+    if requested:
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return IMPORT_CONTENT_TYPES.get(media_type)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Split a stream of UTF-8 byte chunks into lines without buffering the whole body.
+
+    :param chunks: The request body stream.
+
+    :return: An async iterator of lines, without line endings.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_records(chunks: AsyncIterator[bytes], import_format: str) -> AsyncIterator[Tuple[int, object]]:
+    """
+    Parse a streamed CSV or NDJSON body into records, one at a time.
+
+    A record that cannot be parsed is yielded as a ValueError instead of a
+    dict, so one bad line is reported without aborting the import.
+
+    :param chunks: The request body stream.
+    :param import_format: "csv" (with a header row) or "ndjson".
+
+    :return: An async iterator of (row number, dict or ValueError) tuples.
+    """
+    row = 0
+    if import_format == "ndjson":
+        async for line in iter_lines(chunks):
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Row must be a JSON object")
+                yield row, record
+            except ValueError as e:
+                yield row, ValueError(str(e))
+        return
+
+    header = None
+    buffered = ""
+    async for line in iter_lines(chunks):
+        # A quoted field may span lines: keep reading until quotes balance
+        buffered = f"{buffered}\n{line}" if buffered else line
+        if buffered.count('"') % 2:
+            continue
+        text, buffered = buffered, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        # Empty cells are missing values, so optional fields fall back to their defaults
+        yield row, {name: value for name, value in zip(header, values) if value != ""}
+    if buffered:
+        row += 1
+        yield row, ValueError("Unterminated quoted field")
+    if header is None:
+        raise ImportFormatError("CSV header row is missing")
+
+
+async def import_records(records, validate, write_batch, batch_size: int, max_errors: int) -> dict:
+    """
+    Validate streamed records in batches and hand each full batch to a writer.
+
+    Only one batch is held in memory at a time, and at most max_errors row
+    errors are kept in the report; the counters always cover every row.
+
+    :param records: Async iterator from iter_records.
+    :param validate: Callable turning a record dict into a schema object, raising pydantic.ValidationError.
+    :param write_batch: Async callable taking a list of (row, object) and returning
+        {"inserted": int, "updated": int, "errors": [(row, field, message)]}.
+    :param batch_size: Rows per batch, which is also the size of each transaction.
+    :param max_errors: Maximum number of row errors to include in the report.
+
+    :return: The import report, shaped like the ImportReport schema.
+    """
+    report = {"received": 0, "inserted": 0, "updated": 0,
+              "failed": 0, "errors": [], "errors_truncated": False}
+
+    def add_errors(row, errors):
+        report["failed"] += 1
+        for field, message in errors:
+            if len(report["errors"]) >= max_errors:
+                report["errors_truncated"] = True
+                return
+            report["errors"].append({"row": row, "field": field, "error": message})
+
+    async def flush(batch):
+        result = await write_batch(batch)
+        report["inserted"] += result["inserted"]
+        report["updated"] += result["updated"]
+        failed_rows = {}
+        for row, field, message in result["errors"]:
+            failed_rows.setdefault(row, []).append((field, message))
+        for row, errors in failed_rows.items():
+            add_errors(row, errors)
+
+    batch = []
+    async for row, record in records:
+        report["received"] += 1
+        if isinstance(record, ValueError):
+            add_errors(row, [(None, str(record))])
+            continue
+        try:
+            batch.append((row, validate(record)))
+        except ValidationError as e:
+            add_errors(row, [(".".join(str(loc) for loc in error["loc"]), error["msg"])
+                             for error in e.errors()])
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return report
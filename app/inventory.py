@@ -0,0 +1,327 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import DateTime, case, delete, func, insert, literal, select
+from app.etags import next_version, next_version_sql
+from app.models.category_inventory import UNCATEGORIZED, CategoryInventory
+from app.models.inventory_history import (
+    GRANULARITIES, CategoryInventoryRollup, ProductHistory, ProductInventoryRollup)
+from app.models.product import Product
+
+# Columns of the inventory rows written by the triggers and the rebuild
+INVENTORY_COLUMNS = (
+    "category_id", "product_count", "total_units", "stock_value", "out_of_stock_count", "version")
+HISTORY_COLUMNS = ("product_id", "category_id", "quantity", "price", "changed_at")
+PRODUCT_ROLLUP_COLUMNS = (
+    "granularity", "product_id", "bucket", "units", "price", "value", "low_units", "high_units",
+    "changes")
+CATEGORY_ROLLUP_COLUMNS = (
+    "granularity", "category_id", "bucket", "product_count", "units", "value",
+    "out_of_stock_count", "low_units", "high_units")
+
+# Next table-wide version of the inventory rows, per backend
+POSTGRESQL_INVENTORY_VERSION = next_version_sql("category_inventory", "postgresql")
+SQLITE_INVENTORY_VERSION = next_version_sql("category_inventory", "sqlite")
+
+# Adds the deltas in the inserted row onto the existing row of the category
+UPSERT_DELTA = """
+ON CONFLICT (category_id) DO UPDATE SET
+    product_count = category_inventory.product_count + excluded.product_count,
+    total_units = category_inventory.total_units + excluded.total_units,
+    stock_value = category_inventory.stock_value + excluded.stock_value,
+    out_of_stock_count = category_inventory.out_of_stock_count + excluded.out_of_stock_count,
+    version = excluded.version"""
+
+
+def upsert_level(table: str, key: str, columns: tuple, lowest: str, highest: str) -> str:
+    # Moves the closing level of a bucket to the inserted one, widening its low/high range
+    updates = [f"{column} = excluded.{column}" for column in columns
+               if column not in ("granularity", key, "bucket", "low_units", "high_units", "changes")]
+    updates += [f"low_units = {lowest}({table}.low_units, excluded.units)",
+                f"high_units = {highest}({table}.high_units, excluded.units)"]
+    if "changes" in columns:
+        updates.append(f"changes = {table}.changes + 1")
+    return f"""
+    ON CONFLICT (granularity, {key}, bucket) DO UPDATE SET
+        {", ".join(updates)}"""
+
+
+# One row per rollup granularity, to bucket every change once per granularity
+POSTGRESQL_GRANULARITIES = "(VALUES {}) AS g (granularity)".format(
+    ", ".join(f"('{granularity}')" for granularity in GRANULARITIES))
+
+
+def postgresql_delta(*sources: str) -> str:
+    # Sums the rows of the transition tables per category, +1 for new rows
+    # and -1 for old ones; categories whose totals did not move are skipped,
+    # so e.g. renames never touch the summary. The new totals of the changed
+    # categories close their current hour and day in the rollups
+    rows = " UNION ALL ".join(
+        f"SELECT category_id, price, quantity, {sign} AS sign FROM {table}"
+        for table, sign in sources)
+    return f"""
+    WITH inventory AS (
+        INSERT INTO category_inventory ({", ".join(INVENTORY_COLUMNS)})
+        SELECT category_id, sum(sign), sum(sign * units), sum(sign * value),
+               sum(CASE WHEN units <= 0 THEN sign ELSE 0 END), {POSTGRESQL_INVENTORY_VERSION}
+        FROM (
+            SELECT coalesce(category_id, {UNCATEGORIZED}) AS category_id,
+                   coalesce(quantity, 0) AS units,
+                   coalesce(price, 0) * coalesce(quantity, 0) AS value,
+                   sign
+            FROM ({rows}) AS changed
+        ) AS delta
+        GROUP BY category_id
+        HAVING sum(sign) <> 0 OR sum(sign * units) <> 0 OR sum(sign * value) <> 0
+            OR sum(CASE WHEN units <= 0 THEN sign ELSE 0 END) <> 0
+        -- Lock the summary rows in a fixed order, so concurrent writes cannot deadlock
+        ORDER BY category_id
+        {UPSERT_DELTA}
+        RETURNING category_id, product_count, total_units, stock_value, out_of_stock_count
+    )
+    INSERT INTO category_inventory_rollups ({", ".join(CATEGORY_ROLLUP_COLUMNS)})
+    SELECT g.granularity, category_id, date_trunc(g.granularity, now_utc), product_count,
+           total_units, stock_value, out_of_stock_count, total_units, total_units
+    FROM inventory CROSS JOIN {POSTGRESQL_GRANULARITIES}
+    ORDER BY category_id
+    {upsert_level("category_inventory_rollups", "category_id", CATEGORY_ROLLUP_COLUMNS,
+                  "least", "greatest")};"""
+
+
+def postgresql_history(changes: str) -> str:
+    # Appends the new state of the changed products to the history and
+    # closes their current hour and day in the rollups
+    return f"""
+    WITH history AS (
+        INSERT INTO product_history ({", ".join(HISTORY_COLUMNS)})
+        {changes}
+        RETURNING product_id, quantity, price, changed_at
+    )
+    INSERT INTO product_inventory_rollups ({", ".join(PRODUCT_ROLLUP_COLUMNS)})
+    SELECT g.granularity, product_id, date_trunc(g.granularity, changed_at), quantity, price,
+           coalesce(price, 0) * quantity, quantity, quantity, 1
+    FROM history CROSS JOIN {POSTGRESQL_GRANULARITIES}
+    ORDER BY product_id
+    {upsert_level("product_inventory_rollups", "product_id", PRODUCT_ROLLUP_COLUMNS,
+                  "least", "greatest")};"""
+
+
+# One statement-level function for the three triggers, reading the transition
+# tables. now_utc is read after the rows were written, and so locked, so
+# the closing levels of concurrent writes are recorded in commit order
+POSTGRESQL_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION apply_category_inventory_delta() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    now_utc timestamp := clock_timestamp() AT TIME ZONE 'UTC';
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {postgresql_delta(("new_rows", 1))}
+        {postgresql_history(
+            "SELECT id, category_id, coalesce(quantity, 0), price, now_utc FROM new_rows")}
+    ELSIF TG_OP = 'UPDATE' THEN
+        {postgresql_delta(("new_rows", 1), ("old_rows", -1))}
+        {postgresql_history(
+            "SELECT n.id, n.category_id, coalesce(n.quantity, 0), n.price, now_utc "
+            "FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id "
+            "WHERE (n.category_id, n.price, n.quantity) "
+            "IS DISTINCT FROM (o.category_id, o.price, o.quantity)")}
+    ELSE
+        {postgresql_delta(("old_rows", -1))}
+        {postgresql_history("SELECT id, category_id, 0, price, now_utc FROM old_rows")}
+    END IF;
+    RETURN NULL;
+END;
+$$"""
+
+POSTGRESQL_TRIGGERS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def sqlite_delta(row: str, sign: int) -> str:
+    # Adds (sign +1) or removes (sign -1) one product row from its category
+    units = f"coalesce({row}.quantity, 0)"
+    return f"""
+    INSERT INTO category_inventory ({", ".join(INVENTORY_COLUMNS)})
+    VALUES (coalesce({row}.category_id, {UNCATEGORIZED}), {sign}, {sign} * {units},
+            {sign} * coalesce({row}.price, 0) * {units},
+            CASE WHEN {units} <= 0 THEN {sign} ELSE 0 END, {SQLITE_INVENTORY_VERSION})
+    {UPSERT_DELTA};"""
+
+
+# Bucket starts and change times in the format SQLAlchemy stores DateTime in
+SQLITE_GRANULARITIES = "({}) AS g".format(" UNION ALL ".join(
+    f"SELECT '{granularity}' AS granularity, '{bucket}' AS format"
+    for granularity, bucket in zip(GRANULARITIES, (
+        "%Y-%m-%d %H:00:00.000000", "%Y-%m-%d 00:00:00.000000"))))
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+def sqlite_history(row: str, quantity: str) -> str:
+    # Appends the state of one product to the history and closes its
+    # current hour and day in the rollups
+    return f"""
+    INSERT INTO product_history ({", ".join(HISTORY_COLUMNS)})
+    VALUES ({row}.id, {row}.category_id, {quantity}, {row}.price, {SQLITE_NOW});
+    INSERT INTO product_inventory_rollups ({", ".join(PRODUCT_ROLLUP_COLUMNS)})
+    SELECT g.granularity, {row}.id, strftime(g.format, 'now'), {quantity}, {row}.price,
+           coalesce({row}.price, 0) * {quantity}, {quantity}, {quantity}, 1
+    FROM {SQLITE_GRANULARITIES} WHERE true
+    {upsert_level("product_inventory_rollups", "product_id", PRODUCT_ROLLUP_COLUMNS,
+                  "min", "max")};"""
+
+
+def sqlite_category_levels(*rows: str) -> str:
+    # Closes the current hour and day of the categories of the given rows
+    # with their totals, already updated by sqlite_delta
+    categories = ", ".join(f"coalesce({row}.category_id, {UNCATEGORIZED})" for row in rows)
+    return f"""
+    INSERT INTO category_inventory_rollups ({", ".join(CATEGORY_ROLLUP_COLUMNS)})
+    SELECT g.granularity, category_id, strftime(g.format, 'now'), product_count, total_units,
+           stock_value, out_of_stock_count, total_units, total_units
+    FROM category_inventory CROSS JOIN {SQLITE_GRANULARITIES}
+    WHERE category_id IN ({categories})
+    {upsert_level("category_inventory_rollups", "category_id", CATEGORY_ROLLUP_COLUMNS,
+                  "min", "max")};"""
+
+
+# SQLite only has row-level triggers
+SQLITE_TRIGGERS = {
+    "insert": (
+        f"AFTER INSERT ON products BEGIN {sqlite_delta('NEW', 1)} "
+        f"{sqlite_category_levels('NEW')} {sqlite_history('NEW', 'coalesce(NEW.quantity, 0)')} END"),
+    "update": (
+        "AFTER UPDATE OF category_id, price, quantity ON products "
+        "WHEN OLD.category_id IS NOT NEW.category_id OR OLD.price IS NOT NEW.price "
+        "OR OLD.quantity IS NOT NEW.quantity "
+        f"BEGIN {sqlite_delta('OLD', -1)} {sqlite_delta('NEW', 1)} "
+        f"{sqlite_category_levels('OLD', 'NEW')} "
+        f"{sqlite_history('NEW', 'coalesce(NEW.quantity, 0)')} END"),
+    "delete": (
+        f"AFTER DELETE ON products BEGIN {sqlite_delta('OLD', -1)} "
+        f"{sqlite_category_levels('OLD')} {sqlite_history('OLD', '0')} END"),
+}
+
+
+def install_inventory_triggers(connection):
+    """
+    Create the triggers keeping category_inventory, the product history and
+    the inventory rollups up to date with every product write.
+
+    The statements are idempotent, so this can run again to repair or
+    upgrade the triggers.
+
+    :param connection: A sync Connection, inside a transaction.
+    """
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        connection.exec_driver_sql(POSTGRESQL_FUNCTION)
+        for operation, referencing in POSTGRESQL_TRIGGERS.items():
+            name = f"products_inventory_{operation.lower()}"
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name} ON products")
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER {name} AFTER {operation} ON products {referencing} "
+                "FOR EACH STATEMENT EXECUTE FUNCTION apply_category_inventory_delta()")
+    elif dialect == "sqlite":
+        for operation, body in SQLITE_TRIGGERS.items():
+            name = f"products_inventory_{operation}"
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+            connection.exec_driver_sql(f"CREATE TRIGGER {name} {body}")
+    else:
+        raise NotImplementedError(f"No inventory triggers for '{dialect}'")
+
+
+def rebuild_inventory(connection) -> int:
+    """
+    Recompute category_inventory from the products table.
+
+    Product writes are blocked on PostgreSQL while the summary is rebuilt,
+    so none is lost or counted twice. The rows get a new version, so list
+    ETags covering them change.
+
+    :param connection: A sync Connection, inside a transaction.
+
+    :return: The number of summary rows written.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("LOCK TABLE products IN SHARE MODE")
+    inventory = CategoryInventory.__table__
+    products = Product.__table__
+    version = connection.scalar(select(next_version("category_inventory")))
+    connection.execute(delete(inventory))
+
+    category_id = func.coalesce(products.c.category_id, UNCATEGORIZED)
+    units = func.coalesce(products.c.quantity, 0)
+    totals = select(
+        category_id,
+        func.count(),
+        func.coalesce(func.sum(units), 0),
+        func.coalesce(func.sum(func.coalesce(products.c.price, 0) * units), 0),
+        func.coalesce(func.sum(case((units <= 0, 1), else_=0)), 0),
+        literal(version),
+    ).group_by(category_id)
+    return connection.execute(insert(inventory).from_select(INVENTORY_COLUMNS, totals)).rowcount
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """
+    Truncate a naive UTC time to the start of its rollup bucket.
+
+    :param moment: The time, naive in UTC.
+    :param granularity: "hour" or "day".
+
+    :return: The start of the hour or day holding moment.
+    """
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == "day" else moment
+
+
+def record_inventory_levels(connection) -> int:
+    """
+    Record the current state of every product and category in the history.
+
+    Seeds the history and the rollups of the current hour and day, so the
+    trends of a catalogue that predates the history start from its actual
+    levels instead of from zero.
+
+    :param connection: A sync Connection, inside a transaction.
+
+    :return: The number of products recorded.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    products = Product.__table__
+    inventory = CategoryInventory.__table__
+    units = func.coalesce(products.c.quantity, 0)
+    recorded = connection.execute(insert(ProductHistory).from_select(HISTORY_COLUMNS, select(
+        products.c.id, products.c.category_id, units, products.c.price,
+        literal(now, DateTime)))).rowcount
+    for granularity in GRANULARITIES:
+        bucket = literal(bucket_start(now, granularity), DateTime)
+        connection.execute(insert(ProductInventoryRollup).from_select(
+            PRODUCT_ROLLUP_COLUMNS, select(
+                literal(granularity), products.c.id, bucket, units, products.c.price,
+                func.coalesce(products.c.price, 0) * units, units, units, literal(1))))
+        connection.execute(insert(CategoryInventoryRollup).from_select(
+            CATEGORY_ROLLUP_COLUMNS, select(
+                literal(granularity), inventory.c.category_id, bucket, inventory.c.product_count,
+                inventory.c.total_units, inventory.c.stock_value, inventory.c.out_of_stock_count,
+                inventory.c.total_units, inventory.c.total_units)))
+    return recorded
+
+
+def prune_history(connection, days: int) -> int:
+    """
+    Delete the product history older than a number of days.
+
+    The rollups are kept, so the trends stay available; only the
+    individual changes behind them go.
+
+    :param connection: A sync Connection, inside a transaction.
+    :param days: Age in days of the oldest change kept.
+
+    :return: The number of history rows deleted.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    return connection.execute(
+        delete(ProductHistory).where(ProductHistory.changed_at < cutoff)).rowcount
@@ -1,21 +1,97 @@
+import time
+
+# Start of the import, for the import-to-ready time reported at startup
+IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from app.routes import product, category
-from app.database import Base, engine
+import asyncio
+import logging
+from starlette.concurrency import run_in_threadpool
+from app.routes import product, category, cache, events, inventory, metrics
+from app.database import (
+    engine, replicas, run_in_new_session, run_with_connection, warm_up_pool)
+from app.migrations import check_version, migrate, wait_for_database
 from fastapi.exceptions import RequestValidationError, HTTPException
 from app.utils import response_wrapper
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import Page, add_pagination, paginate
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.admission import AdmissionMiddleware, admission, overloaded_response
+from app.config import (
+    ADMISSION_RETRY_AFTER, CACHE_WARMUP_CATEGORIES, DB_AUTO_MIGRATE, DB_POOL_WARMUP, DB_STARTUP_TIMEOUT, METRICS_ENABLED,
+    SUGGEST_REFRESH_SECONDS)
+from app.metrics import MetricsMiddleware, startup_phases
+from app.replicas import ReadYourWritesMiddleware
+from app.suggest import refresh_periodically, suggestion_index
+from app.events import change_feed
+
+logger = logging.getLogger("app")
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Check the schema and warm up the pool and caches before serving.
+
+    The schema is managed by 'python -m app.cli migrate'; workers only read
+    its version, so they start without DDL and without racing each other.
+    """
+    started = time.perf_counter()
+    startup_phases["import"] = started - IMPORT_STARTED
+    if DB_AUTO_MIGRATE:
+        await wait_for_database(
+            lambda: run_in_threadpool(migrate, engine), DB_STARTUP_TIMEOUT)
+    await wait_for_database(
+        lambda: run_with_connection(check_version), DB_STARTUP_TIMEOUT)
+    checked = time.perf_counter()
+    startup_phases["schema_check"] = checked - started
+
+    # Open the pool's connections, load the categories and build the
+    # suggestion index ahead of the first requests
+    connections = await warm_up_pool(DB_POOL_WARMUP)
+    categories = await run_in_new_session(
+        category.category_service.warm_cache, CACHE_WARMUP_CATEGORIES)
+    names = 0
+    if suggestion_index is not None:
+        names = await run_in_new_session(suggestion_index.build)
+    ready = time.perf_counter()
+    startup_phases["warm_up"] = ready - checked
+    startup_phases["total"] = ready - IMPORT_STARTED
+    # Through uvicorn's logger, so the line shows next to its own startup messages
+    logging.getLogger("uvicorn.error").info(
+        "Ready in %.3fs (import %.3fs, schema check %.3fs, warm-up %.3fs: "
+        "%d connections, %d categories, %d names indexed)", ready - IMPORT_STARTED,
+        startup_phases["import"], startup_phases["schema_check"],
+        startup_phases["warm_up"], connections, categories, names)
+
+    refresher = None
+    if suggestion_index is not None and SUGGEST_REFRESH_SECONDS > 0:
+        refresher = asyncio.create_task(
+            refresh_periodically(suggestion_index, SUGGEST_REFRESH_SECONDS))
+    # Follow the change_events outbox for the /events streams
+    if change_feed is not None:
+        await change_feed.start()
+    yield
+    if change_feed is not None:
+        await change_feed.stop()
+    if refresher is not None:
+        refresher.cancel()
+
 
 # Create a FastAPI instance
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 add_pagination(app)
 
-# Creates all tables in database
-Base.metadata.create_all(bind=engine)
+# Queue requests by priority ahead of the pool, shedding them when overloaded;
+# added first so that shed responses still carry the CORS headers
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, routes=app.router.routes, controller=admission)
 
 # Allow requests from your React application's domain
 origins = [
@@ -27,10 +103,18 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
     allow_headers=["*"],
 )
 
+# Pin clients to the primary for a short while after they write
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Record per-route latency and database work, served on /metrics
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 
 # Handle Validation Error
 @app.exception_handler(RequestValidationError)
@@ -52,16 +136,29 @@ async def http_exception_handler(request, exc):
     return JSONResponse(status_code=exc.status_code, content=exc.detail)
 
 
+# Handle Pool Timeout, when no connection freed up within DB_POOL_TIMEOUT
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request, exc):
+    logger.warning("Connection pool exhausted on %s %s", request.method, request.url.path)
+    return overloaded_response(ADMISSION_RETRY_AFTER)
+
+
 # Handle Unpredicted Error
 @app.exception_handler(Exception)
 async def generic_exception_handler(request, exc):
-    print(exc)
+    logger.error("Unhandled error on %s %s", request.method,
+                 request.url.path, exc_info=exc)
     return JSONResponse(status_code=500, content=exc.detail)
 
 
 # Include your API routers here
 app.include_router(product.router, prefix="")
 app.include_router(category.router, prefix="")
+app.include_router(inventory.router, prefix="")
+app.include_router(cache.router, prefix="")
+app.include_router(events.router, prefix="")
+if METRICS_ENABLED:
+    app.include_router(metrics.router, prefix="")
 
 
 if __name__ == "__main__":
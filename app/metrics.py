@@ -0,0 +1,312 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from app.config import SLOW_QUERY_MS
+
+logger = logging.getLogger("app.sql")
+
+# Bucket upper bounds, in seconds or queries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter per label set, in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram per label set, in the Prometheus text format.
+
+    An observation is one bisect and three increments under a lock, cheap
+    enough to record on every request and statement.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    le = format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a callback when the metrics are scraped."""
+
+    def __init__(self, name: str, documentation: str, labels: tuple, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for label_values, value in self.collect():
+            lines.append(
+                f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template.",
+    ("method", "route", "status")))
+REQUEST_QUERIES = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per request.",
+    ("method", "route"), QUERY_COUNT_BUCKETS))
+REQUEST_SQL_TIME = registry.register(Histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL per request.",
+    ("method", "route")))
+REQUEST_POOL_WAIT = registry.register(Histogram(
+    "db_pool_wait_per_request_seconds",
+    "Time the sessions of a request waited for pooled connections.",
+    ("method", "route"), POOL_WAIT_BUCKETS))
+SQL_STATEMENTS = registry.register(Counter(
+    "db_statements_total", "SQL statements executed.", ("engine",)))
+SLOW_QUERIES = registry.register(Counter(
+    "db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS.", ("engine",)))
+POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time waited for a pooled connection on checkout.",
+    ("engine",), POOL_WAIT_BUCKETS))
+
+# Pools of the instrumented engines, by engine name
+pools = {}
+
+
+def collect_pools(read):
+    def collect():
+        # Only queue pools keep a size; SQLite's NullPool has nothing to report
+        return [((name,), read(engine.pool)) for name, engine in pools.items()
+                if isinstance(engine.pool, QueuePool)]
+    return collect
+
+
+registry.register(Gauge("db_pool_size", "Configured size of the connection pool.",
+                        ("engine",), collect_pools(lambda pool: pool.size())))
+registry.register(Gauge("db_pool_checked_out", "Connections currently in use.",
+                        ("engine",), collect_pools(lambda pool: pool.checkedout())))
+registry.register(Gauge("db_pool_overflow", "Connections open beyond the pool size.",
+                        ("engine",), collect_pools(lambda pool: max(pool.overflow(), 0))))
+registry.register(Gauge("db_pool_checked_in", "Idle connections in the pool.",
+                        ("engine",), collect_pools(lambda pool: pool.checkedin())))
+
+
+# Seconds spent in each startup phase of this process, filled in by the lifespan
+startup_phases = {}
+
+registry.register(Gauge("app_startup_seconds", "Time spent in each phase from import to ready.",
+                        ("phase",), lambda: [((phase,), seconds)
+                                             for phase, seconds in startup_phases.items()]))
+
+class RequestStats:
+    """Database work done on behalf of the current request."""
+
+    __slots__ = ("queries", "sql_time", "pool_wait")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.pool_wait = 0.0
+
+
+# Set by MetricsMiddleware; copied into threadpool workers and run_sync greenlets
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+class PoolWaitMixin:
+    """
+    Records the time every checkout spends waiting for (or opening) a connection.
+
+    The wait of the latest checkout is also kept in the connection's info
+    as "pool_wait", where the session dependency picks it up.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        record = None
+        try:
+            record = super()._do_get()
+            return record
+        finally:
+            elapsed = time.perf_counter() - started
+            POOL_CHECKOUT_WAIT.observe(elapsed, self.logging_name or "primary")
+            if record is not None:
+                record.info["pool_wait"] = elapsed
+
+
+class TimedQueuePool(PoolWaitMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(PoolWaitMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedNullPool(PoolWaitMixin, NullPool):
+    pass
+
+
+def record_pool_wait(seconds: float):
+    """
+    Add the pool wait of a session to the current request's statistics.
+
+    :param seconds: Total time the session waited for its connections.
+    """
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+def instrument_engine(engine, name: str = "primary"):
+    """
+    Count and time the statements of an engine, and expose its pool on /metrics.
+
+    :param engine: The sync Engine (for an AsyncEngine, its sync_engine).
+    :param name: Label of the engine in the metrics, e.g. "primary".
+    """
+    pools[name] = engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # A connection runs one statement at a time
+        conn.info["query_started"] = time.perf_counter()
+
+    def record_statement(conn, statement, parameters):
+        started = conn.info.pop("query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        SQL_STATEMENTS.inc(name)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_time += elapsed
+        if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+            SLOW_QUERIES.inc(name)
+            logger.warning("Slow query on %s (%.1f ms): %s; parameters: %.1000r",
+                           name, elapsed * 1000, statement, parameters)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_statement(conn, statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Failed statements are counted and timed too, e.g. those cancelled
+        # by statement_timeout; errors outside a statement have no start
+        if context.connection is not None:
+            record_statement(context.connection, context.statement, context.parameters)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and database work per route template.
+
+    Routes are labelled by their path template (e.g. /products/{product_id}),
+    so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request_stats.reset(token)
+            route = getattr(scope.get("route"), "path_format", "<unmatched>")
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.observe(elapsed, method, route, status)
+            REQUEST_QUERIES.observe(stats.queries, method, route)
+            REQUEST_SQL_TIME.observe(stats.sql_time, method, route)
+            REQUEST_POOL_WAIT.observe(stats.pool_wait, method, route)
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from sqlalchemy import delete, func, inspect, insert, select, text
+from sqlalchemy.exc import OperationalError
+from app.database import Base
+from app.etags import install_version_counters
+from app.inventory import install_inventory_triggers, rebuild_inventory, record_inventory_levels
+from app.outbox import install_outbox_triggers
+from app.search import create_search_index
+# Imported so that Base.metadata holds every table
+from app.models.category import Category
+from app.models.change_event import ChangeEvent
+from app.models.category_inventory import CategoryInventory
+from app.models.inventory_history import (
+    CategoryInventoryRollup, ProductHistory, ProductInventoryRollup)
+from app.models.product import Product
+from app.models.schema_version import SchemaVersion
+from app.models.stock_movement import StockMovement
+
+logger = logging.getLogger("app.migrations")
+
+# Arbitrary key of the advisory lock serializing concurrent migrations on PostgreSQL
+MIGRATION_LOCK_KEY = 7262539
+
+
+class SchemaVersionError(RuntimeError):
+    """Raised at startup when the database schema is not at the version the code expects."""
+
+
+class MigrationError(RuntimeError):
+    """Raised when the data in the database prevents a migration from being applied."""
+
+
+# Columns added to the tables of databases created by create_all before
+# versioning: (table, column, definition)
+ADOPTED_COLUMNS = [
+    ("products", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("categories", "version", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+
+def create_schema(connection):
+    # Creates the missing tables and their indexes, then brings the tables
+    # that already existed up to date
+    Base.metadata.create_all(bind=connection)
+    adopt_existing_tables(connection)
+
+
+def adopt_existing_tables(connection):
+    # create_all never alters an existing table, so a database it created
+    # before versioning lacks the columns and indexes added since. Every later
+    # migration reads the versions, so this runs as part of the first one
+    inspector = inspect(connection)
+    for table, column, definition in ADOPTED_COLUMNS:
+        if column not in {found["name"] for found in inspector.get_columns(table)}:
+            logger.info("Adding %s.%s", table, column)
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    for table in (Product.__table__, Category.__table__):
+        # An existing non-unique ix_products_name is made unique by migration 6
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+        create_search_index(connection, table)
+
+
+# Ordered schema migrations: (version, description, upgrade taking a connection).
+# A new database runs them all after create_schema has created the current
+# tables, so every upgrade must skip objects that already exist
+def add_inventory_summary(connection):
+    CategoryInventory.__table__.create(bind=connection, checkfirst=True)
+    # The triggers and the rebuild stamp the summary rows from the counters
+    install_version_counters(connection)
+    install_inventory_triggers(connection)
+    rebuild_inventory(connection)
+
+
+def add_inventory_history(connection):
+    for model in (ProductHistory, ProductInventoryRollup, CategoryInventoryRollup):
+        model.__table__.create(bind=connection, checkfirst=True)
+    install_inventory_triggers(connection)
+    record_inventory_levels(connection)
+
+
+def add_change_events(connection):
+    ChangeEvent.__table__.create(bind=connection, checkfirst=True)
+    install_outbox_triggers(connection)
+
+
+def add_product_sort_indexes(connection):
+    for index in Product.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def add_unique_product_names(connection):
+    duplicates = connection.execute(
+        select(Product.name).group_by(Product.name).having(func.count() > 1)
+        .order_by(Product.name).limit(10)).scalars().all()
+    if duplicates:
+        raise MigrationError(
+            "Product names must be unique; rename the products sharing these names "
+            f"and migrate again: {', '.join(map(repr, duplicates))}")
+    (index,) = (index for index in Product.__table__.indexes if index.name == "ix_products_name")
+    existing = {found["name"]: found for found in inspect(connection).get_indexes("products")}
+    if existing.get(index.name, {}).get("unique"):
+        return
+    if index.name in existing:
+        connection.execute(text(f"DROP INDEX {index.name}"))
+    index.create(bind=connection)
+
+
+def add_version_counters(connection):
+    install_version_counters(connection)
+
+
+MIGRATIONS = [
+    (1, "Initial schema", create_schema),
+    (2, "Inventory summary per category, maintained by triggers", add_inventory_summary),
+    (3, "Product history and hourly and daily inventory rollups", add_inventory_history),
+    (4, "Outbox of product and category changes, written by triggers", add_change_events),
+    (5, "Composite product indexes for sorting and range filters", add_product_sort_indexes),
+    (6, "Unique product names, the natural key of imports", add_unique_product_names),
+    (7, "Version sequences, replacing max(version) + 1", add_version_counters),
+]
+
+# Version the code expects the database to be at
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection) -> int:
+    """
+    Read the schema version of a database.
+
+    :param connection: A sync Connection.
+
+    :return: The version, or None if the database was never migrated.
+    """
+    if not inspect(connection).has_table(SchemaVersion.__tablename__):
+        return None
+    return connection.scalar(select(SchemaVersion.version))
+
+
+def check_version(connection) -> int:
+    """
+    Check that the database schema is at SCHEMA_VERSION.
+
+    :param connection: A sync Connection.
+
+    :return: The version.
+    """
+    version = current_version(connection)
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, expected {SCHEMA_VERSION}; "
+            "run 'python -m app.cli migrate'")
+    return version
+
+
+def migrate(engine) -> tuple:
+    """
+    Apply the pending migrations in one transaction.
+
+    On PostgreSQL an advisory lock serializes concurrent runs, so several
+    deployments or workers migrating at once apply every step only once.
+
+    :param engine: The sync Engine of the primary database.
+
+    :return: The versions before and after, e.g. (None, 1) for a new database.
+    """
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"),
+                               {"key": MIGRATION_LOCK_KEY})
+        before = current_version(connection)
+        for version, description, upgrade in MIGRATIONS:
+            if before is None or version > before:
+                logger.info("Migrating schema to version %d: %s", version, description)
+                upgrade(connection)
+        if before != SCHEMA_VERSION:
+            connection.execute(delete(SchemaVersion))
+            connection.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+    return before, SCHEMA_VERSION
+
+
+async def wait_for_database(check, timeout: float, interval: float = 0.5):
+    """
+    Run a startup check, retrying while the database does not accept connections.
+
+    :param check: Async callable raising OperationalError while the database is unreachable.
+    :param timeout: Seconds to keep retrying before letting the error through.
+    :param interval: Initial delay between attempts, doubled up to 5 seconds.
+
+    :return: Whatever check returns.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await check()
+        except OperationalError:
+            if time.monotonic() + interval > deadline:
+                raise
+            logger.warning("Database not reachable, retrying in %.1fs", interval)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, 5.0)
@@ -1,14 +1,30 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
+from app.search import register_search_index
+from app.etags import next_version
 
 
 class Category(Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        # Serves cursor pagination ordered by name
+        Index("ix_categories_name_id", "name", "id"),
+        # Serves the max(version) lookups behind list ETags
+        Index("ix_categories_version", "version"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     description = Column(String)
 
+    # Table-wide revision stamped on every insert and update, used for ETags
+    version = Column(Integer, nullable=False, default=next_version(
+        "categories"), onupdate=next_version("categories"))
+
     # Establish a one-to-many relationship with Product
     products = relationship("Product", back_populates="category")
+
+
+# Full-text index serving search_term on PostgreSQL
+register_search_index(Category.__table__, "name", "description")
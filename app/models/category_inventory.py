@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Float, Integer, Index
+from app.database import Base
+
+# Key of the row summarizing the products without a category
+UNCATEGORIZED = 0
+
+
+class CategoryInventory(Base):
+    __tablename__ = "category_inventory"
+    __table_args__ = (
+        # Serves the max(version) lookups behind the list ETags
+        Index("ix_category_inventory_version", "version"),
+    )
+
+    # No foreign key: products left without a category are summed under
+    # UNCATEGORIZED, and rows are maintained by triggers on products
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    product_count = Column(Integer, nullable=False, default=0)
+    # Sum of quantity, missing quantities counting as 0
+    total_units = Column(Integer, nullable=False, default=0)
+    # Sum of price * quantity
+    stock_value = Column(Float, nullable=False, default=0)
+    # Products with no units left
+    out_of_stock_count = Column(Integer, nullable=False, default=0)
+
+    # Table-wide revision stamped on every change, used for list ETags
+    version = Column(Integer, nullable=False, default=1)
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from app.database import Base
+
+# Entities and actions recorded in the change feed
+CHANGE_ENTITIES = ("product", "category")
+CHANGE_ACTIONS = ("created", "updated", "stock", "deleted")
+
+
+class ChangeEvent(Base):
+    """
+    Transactional outbox of product and category writes, served by GET /events.
+
+    Rows are written by triggers in the transaction of the write itself (see
+    app.outbox), so an event exists if and only if its write committed.
+    """
+
+    __tablename__ = "change_events"
+    # Ids are never reused on SQLite either, even once the newest events are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # Position in the feed, sent as the SSE event id
+    id = Column(Integer, primary_key=True)
+
+    # No foreign keys: events outlive deleted products and categories
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    # The written row as a JSON object; the row before deletion for deletes
+    data = Column(Text, nullable=False)
+    # UTC, like the inventory history
+    created_at = Column(DateTime, nullable=False)
@@ -0,0 +1,67 @@
+from sqlalchemy import Column, DateTime, Float, Integer, String, Index
+from app.database import Base
+
+# Rollup granularities, named after the date_trunc fields bucketing them
+GRANULARITIES = ("hour", "day")
+
+
+class ProductHistory(Base):
+    __tablename__ = "product_history"
+    __table_args__ = (
+        # Serves the changes of one product in time order
+        Index("ix_product_history_product_id_changed_at", "product_id", "changed_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    # No foreign keys: the history outlives deleted products and categories.
+    # Each row is the state of a product after a change to its stock, price
+    # or category; a deleted product is recorded with no units left
+    product_id = Column(Integer, nullable=False)
+    category_id = Column(Integer)
+    quantity = Column(Integer, nullable=False)
+    price = Column(Float)
+    # UTC, like the rollup buckets
+    changed_at = Column(DateTime, nullable=False)
+
+
+class ProductInventoryRollup(Base):
+    """Stock level of a product at the end of an hour or day in which it changed."""
+
+    __tablename__ = "product_inventory_rollups"
+
+    granularity = Column(String, primary_key=True)
+    product_id = Column(Integer, primary_key=True, autoincrement=False)
+    # Start of the bucket, in UTC
+    bucket = Column(DateTime, primary_key=True)
+    # Closing units, price and value (price * units) of the bucket
+    units = Column(Integer, nullable=False)
+    price = Column(Float)
+    value = Column(Float, nullable=False)
+    # Lowest and highest units reached within the bucket
+    low_units = Column(Integer, nullable=False)
+    high_units = Column(Integer, nullable=False)
+    # Writes recorded in the bucket
+    changes = Column(Integer, nullable=False)
+
+
+class CategoryInventoryRollup(Base):
+    """
+    Inventory totals of a category at the end of an hour or day in which they changed.
+
+    Written once per write statement on PostgreSQL and once per product row
+    on SQLite, so unlike products no count of changes is kept.
+    """
+
+    __tablename__ = "category_inventory_rollups"
+
+    granularity = Column(String, primary_key=True)
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    bucket = Column(DateTime, primary_key=True)
+    # Closing totals of the bucket, as in category_inventory
+    product_count = Column(Integer, nullable=False)
+    units = Column(Integer, nullable=False)
+    value = Column(Float, nullable=False)
+    out_of_stock_count = Column(Integer, nullable=False)
+    low_units = Column(Integer, nullable=False)
+    high_units = Column(Integer, nullable=False)
@@ -1,19 +1,47 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
+from app.search import register_search_index
+from app.etags import next_version
 
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Serve each sort key with the id as tie-breaker, in either
+        # direction, and the price and quantity ranges; the id is the
+        # primary key's. Stored ascending with NULLs last, which scanned
+        # backwards is descending with NULLs first, as keyset_order sorts
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_quantity_id", "quantity", "id"),
+        # The same within a category, so a category's page is read from
+        # the index instead of sorting all its products
+        Index("ix_products_category_id_id", "category_id", "id"),
+        Index("ix_products_category_id_name_id", "category_id", "name", "id"),
+        Index("ix_products_category_id_price_id", "category_id", "price", "id"),
+        Index("ix_products_category_id_quantity_id", "category_id", "quantity", "id"),
+        # Serves the max(version) lookups behind list ETags
+        Index("ix_products_version", "version"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
+    # Natural key of bulk imports, which upsert on it
+    name = Column(String, index=True, unique=True)
     description = Column(String)
     price = Column(Float)
     quantity = Column(Integer)
 
+    # Table-wide revision stamped on every insert and update, used for ETags
+    version = Column(Integer, nullable=False, default=next_version(
+        "products"), onupdate=next_version("products"))
+
     # Define a foreign key relationship with Category
     category_id = Column(Integer, ForeignKey("categories.id"))
 
     # Establish a many-to-one relationship with Category
     category = relationship("Category", back_populates="products")
+
+
+# Full-text index serving search_term on PostgreSQL
+register_search_index(Product.__table__, "name", "description")
@@ -0,0 +1,9 @@
+from sqlalchemy import Column, Integer
+from app.database import Base
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    # Single row holding the version of the last migration applied
+    version = Column(Integer, primary_key=True)
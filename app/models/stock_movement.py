@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Integer, String, Index, func
+from app.database import Base
+
+
+class StockMovement(Base):
+    __tablename__ = "stock_movements"
+    __table_args__ = (
+        # Serves the movement history of one product in id order
+        Index("ix_stock_movements_product_id_id", "product_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    # No foreign key: the ledger is append-only and outlives deleted products
+    product_id = Column(Integer, nullable=False)
+    delta = Column(Integer, nullable=False)
+    quantity_after = Column(Integer, nullable=False)
+    reason = Column(String)
+    created_at = Column(DateTime(timezone=True),
+                        nullable=False, server_default=func.now())
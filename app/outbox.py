@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from app.inventory import SQLITE_NOW
+from app.models.change_event import ChangeEvent
+
+# Channel the PostgreSQL triggers notify when their transaction commits
+CHANGE_CHANNEL = "change_events"
+
+OUTBOX_COLUMNS = ("entity", "entity_id", "action", "data", "created_at")
+
+# Tables feeding the outbox: the entity they record and the columns sent as its data
+OUTBOX_TABLES = {
+    "products": ("product", (
+        "id", "name", "description", "price", "quantity", "category_id", "version")),
+    "categories": ("category", ("id", "name", "description", "version")),
+}
+
+# Columns whose change alone makes an update a "stock" event instead of "updated"
+STOCK_COLUMNS = {"products": ("quantity",)}
+
+
+def update_action(table: str, new: str, old: str, distinct: str, same: str) -> str:
+    # "stock" when only the stock columns (and the version) moved
+    stock = STOCK_COLUMNS.get(table)
+    if not stock:
+        return "'updated'"
+    columns = [column for column in OUTBOX_TABLES[table][1]
+               if column not in ("id", "version") + stock]
+    unchanged = " AND ".join(f"{new}.{column} {same} {old}.{column}" for column in columns)
+    changed = " OR ".join(f"{new}.{column} {distinct} {old}.{column}" for column in stock)
+    return f"CASE WHEN {unchanged} AND ({changed}) THEN 'stock' ELSE 'updated' END"
+
+
+def postgresql_function(table: str) -> str:
+    # One statement-level function per table, reading the transition tables;
+    # rows are recorded in id order and the listening feeds are notified
+    # once per statement that recorded any
+    entity, columns = OUTBOX_TABLES[table]
+
+    def record(action: str, source: str, row: str) -> str:
+        data = "json_build_object({})::text".format(
+            ", ".join(f"'{column}', {row}.{column}" for column in columns))
+        return f"""
+        INSERT INTO change_events ({", ".join(OUTBOX_COLUMNS)})
+        SELECT '{entity}', {row}.id, {action}, {data}, now_utc
+        FROM {source}
+        ORDER BY {row}.id;"""
+
+    return f"""
+CREATE OR REPLACE FUNCTION record_{table}_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    now_utc timestamp := clock_timestamp() AT TIME ZONE 'UTC';
+    recorded integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {record("'created'", "new_rows AS n", "n")}
+    ELSIF TG_OP = 'UPDATE' THEN
+        {record(update_action(table, "n", "o", "IS DISTINCT FROM", "IS NOT DISTINCT FROM"),
+                "new_rows AS n JOIN old_rows AS o ON o.id = n.id", "n")}
+    ELSE
+        {record("'deleted'", "old_rows AS o", "o")}
+    END IF;
+    GET DIAGNOSTICS recorded = ROW_COUNT;
+    IF recorded > 0 THEN
+        PERFORM pg_notify('{CHANGE_CHANNEL}', '');
+    END IF;
+    RETURN NULL;
+END;
+$$"""
+
+
+POSTGRESQL_TRIGGERS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def sqlite_triggers(table: str) -> dict:
+    # Row-level triggers recording one event each
+    entity, columns = OUTBOX_TABLES[table]
+
+    def record(action: str, row: str) -> str:
+        data = "json_object({})".format(", ".join(f"'{column}', {row}.{column}" for column in columns))
+        return (f"INSERT INTO change_events ({', '.join(OUTBOX_COLUMNS)}) "
+                f"VALUES ('{entity}', {row}.id, {action}, {data}, {SQLITE_NOW});")
+
+    return {
+        "insert": f"AFTER INSERT ON {table} BEGIN {record(repr('created'), 'NEW')} END",
+        "update": (f"AFTER UPDATE ON {table} BEGIN "
+                   f"{record(update_action(table, 'NEW', 'OLD', 'IS NOT', 'IS'), 'NEW')} END"),
+        "delete": f"AFTER DELETE ON {table} BEGIN {record(repr('deleted'), 'OLD')} END",
+    }
+
+
+def install_outbox_triggers(connection):
+    """
+    Create the triggers recording every product and category write in change_events.
+
+    The statements are idempotent, so this can run again to repair or
+    upgrade the triggers.
+
+    :param connection: A sync Connection, inside a transaction.
+    """
+    dialect = connection.dialect.name
+    for table in OUTBOX_TABLES:
+        if dialect == "postgresql":
+            connection.exec_driver_sql(postgresql_function(table))
+            for operation, referencing in POSTGRESQL_TRIGGERS.items():
+                name = f"{table}_outbox_{operation.lower()}"
+                connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+                connection.exec_driver_sql(
+                    f"CREATE TRIGGER {name} AFTER {operation} ON {table} {referencing} "
+                    f"FOR EACH STATEMENT EXECUTE FUNCTION record_{table}_changes()")
+        elif dialect == "sqlite":
+            for operation, body in sqlite_triggers(table).items():
+                name = f"{table}_outbox_{operation}"
+                connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+                connection.exec_driver_sql(f"CREATE TRIGGER {name} {body}")
+        else:
+            raise NotImplementedError(f"No outbox triggers for '{dialect}'")
+
+
+def prune_events(connection, days: int) -> int:
+    """
+    Delete the change events older than a number of days.
+
+    Clients resuming from a pruned event are told to reload instead.
+
+    :param connection: A sync Connection, inside a transaction.
+    :param days: Age in days of the oldest event kept.
+
+    :return: The number of events deleted.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    return connection.execute(
+        delete(ChangeEvent).where(ChangeEvent.created_at < cutoff)).rowcount
@@ -0,0 +1,170 @@
+import base64
+import json
+import operator
+from typing import Generic, List, Optional, TypeVar
+from pydantic import BaseModel, Field
+from fastapi_pagination import Params
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+# Define a generic type variable
+T = TypeVar("T")
+
+
+# Largest page size accepted by the list endpoints
+MAX_PAGE_SIZE = 1000
+
+
+class PageParams(Params):
+    # fastapi-pagination caps pages at 100 items; the admin lists ask for more
+    size: int = Field(50, ge=1, le=MAX_PAGE_SIZE)
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a cursor cannot be decoded or was issued for another ordering."""
+
+
+# Page returned by keyset (cursor) pagination; next_cursor is always present
+# (null on the last page) so the envelope is never mistaken for a Page
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    size: int
+    next_cursor: Optional[str]
+    total: Optional[int] = None
+
+
+def encode_cursor(sort_by: str, sort_value, row_id: int) -> str:
+    """
+    Encode the position after a row as an opaque, URL-safe cursor.
+
+    :param sort_by: The name of the sort key the page was ordered by.
+    :param sort_value: The sort key value of the last row on the page.
+    :param row_id: The ID of the last row on the page.
+
+    :return: The encoded cursor.
+    """
+    payload = json.dumps([sort_by, sort_value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    :param cursor: The encoded cursor.
+    :param sort_by: The sort key the caller is paginating by.
+
+    :return: A (sort_value, row_id) tuple.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort_by, sort_value, row_id = json.loads(
+            base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("Malformed cursor") from e
+    if cursor_sort_by != sort_by or not isinstance(row_id, int):
+        raise InvalidCursorError("Cursor does not match the requested ordering")
+    return sort_value, row_id
+
+
+def keyset_order(sort_column, id_column, descending: bool = False) -> tuple:
+    """
+    Order by a sort key with the id as tie-breaker, so pages are deterministic.
+
+    Both go in the same direction, so one (sort key, id) index serves the
+    ordering either way, scanned backwards for descending. Rows without a
+    sort key come last, or first when descending, on every backend: the
+    order a default PostgreSQL index is stored in.
+
+    :param sort_column: The column to order by.
+    :param id_column: The primary key column.
+    :param descending: Whether to order from the highest value.
+
+    :return: The ORDER BY clauses.
+    """
+    if sort_column is id_column:
+        return (id_column.desc(),) if descending else (id_column,)
+    if descending:
+        return sort_column.desc().nulls_first(), id_column.desc()
+    return sort_column.asc().nulls_last(), id_column
+
+
+def keyset_paginate(
+    db: Session,
+    query,
+    sort_column,
+    id_column,
+    sort_by: str,
+    size: int,
+    cursor: str = None,
+    include_total: bool = False,
+    transformer=None,
+    descending: bool = False
+) -> CursorPage:
+    """
+    Paginate a select() statement by seeking past the last seen (sort key, id).
+
+    Unlike LIMIT/OFFSET the database never reads the skipped rows, so every
+    page costs the same regardless of depth when (sort key, id) is indexed.
+    Rows whose sort key is NULL are ordered as in keyset_order; the page
+    crossing from them to the others, or back, takes a second query.
+
+    :param db: Database session.
+    :param query: The filtered select() statement, without ordering.
+    :param sort_column: The column to order by.
+    :param id_column: The primary key column, used as the tie-breaker.
+    :param sort_by: The public name of the sort key, embedded in cursors.
+    :param size: The page size.
+    :param cursor: Cursor returned with the previous page, None for the first page.
+    :param include_total: Whether to also count the whole filtered set.
+    :param transformer: Optional callable mapping the page's items, e.g. row tuples to dicts.
+    :param descending: Whether to page from the highest sort key down.
+
+    :return: The page of items with the cursor for the next page.
+    """
+    total = None
+    if include_total:
+        total = db.scalar(select(func.count()).select_from(
+            query.order_by(None).subquery()))
+
+    # Cursors carry the direction, so one is never replayed against the other
+    if descending:
+        sort_by = f"-{sort_by}"
+    seeks = [query]
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor, sort_by)
+        beyond = operator.lt if descending else operator.gt
+        if sort_column is id_column:
+            seeks = [query.where(beyond(id_column, row_id))]
+        elif sort_value is None:
+            # Within the NULLs, in id order; when descending the values follow
+            seeks = [query.where(sort_column.is_(None), beyond(id_column, row_id))]
+            if descending:
+                seeks.append(query.where(sort_column.isnot(None)))
+        else:
+            # A row comparison skips the NULLs, which follow when ascending
+            seeks = [query.where(beyond(
+                tuple_(sort_column, id_column), tuple_(sort_value, row_id)))]
+            if not descending:
+                seeks.append(query.where(sort_column.is_(None)))
+
+    # Fetch one extra row to find out whether a next page exists
+    order = keyset_order(sort_column, id_column, descending)
+    rows = []
+    for seek in seeks:
+        # Entities come back as one-element rows; column selections stay row tuples
+        rows.extend(row[0] if len(row) == 1 else row for row in db.execute(
+            seek.order_by(*order).limit(size + 1 - len(rows))).unique().all())
+        if len(rows) > size:
+            break
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            sort_by, getattr(last, sort_column.key), getattr(last, id_column.key))
+
+    if transformer is not None:
+        rows = transformer(rows)
+    return CursorPage(items=rows, size=size, next_cursor=next_cursor, total=total)
@@ -0,0 +1,145 @@
+import functools
+import itertools
+import math
+import threading
+import time
+from http.cookies import SimpleCookie
+from sqlalchemy import event
+from app.config import DB_READ_YOUR_WRITES_SECONDS
+
+# Cookie pinning a client to the primary after one of its writes; the value
+# is the unix time the pin expires at
+PRIMARY_COOKIE = "read_primary_until"
+
+# Methods that never write, so never pin the client
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# POST routes that only read, taking a body because their input does not fit a URL
+READ_ONLY_POSTS = {"/products/lookup", "/categories/lookup"}
+
+
+def is_read(method: str, path: str) -> bool:
+    """Whether a request only reads, so it may use a replica and never pins the client."""
+    return method in SAFE_METHODS or (method == "POST" and path in READ_ONLY_POSTS)
+
+
+class ReplicaSet:
+    """
+    Read replica engines and the policy choosing one per session.
+
+    "round_robin" cycles through the replicas; "least_busy" picks the one
+    with the fewest connections checked out, counted through pool events.
+    """
+
+    def __init__(self, engines: list, selection: str = "round_robin"):
+        if selection not in ("round_robin", "least_busy"):
+            raise ValueError(f"Unknown replica selection '{selection}'")
+        self.engines = engines
+        self.selection = selection
+        self.busy = {id(engine): 0 for engine in engines}
+        self.last_write = None
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "checkout", functools.partial(self._checkout, id(engine)))
+            event.listen(engine, "checkin", functools.partial(self._checkin, id(engine)))
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def _checkout(self, key, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.busy[key] += 1
+
+    def _checkin(self, key, dbapi_connection, connection_record):
+        with self._lock:
+            self.busy[key] -= 1
+
+    def choose(self):
+        """
+        Pick the replica engine a session reads from.
+
+        :return: The sync Engine of the replica.
+        """
+        turn = next(self._turn)
+        if self.selection == "least_busy":
+            # Rotate the starting point so ties are spread evenly
+            count = len(self.engines)
+            candidates = [self.engines[(turn + n) % count] for n in range(count)]
+            return min(candidates, key=lambda engine: self.busy[id(engine)])
+        return self.engines[turn % len(self.engines)]
+
+    def record_write(self):
+        """Note that a session of this process just committed."""
+        self.last_write = time.monotonic()
+
+    def settled(self) -> bool:
+        """Whether the replicas may be assumed to have caught up with this process' writes."""
+        return self.last_write is None or (
+            time.monotonic() - self.last_write >= DB_READ_YOUR_WRITES_SECONDS)
+
+
+def pinned_to_primary(cookie_header: str) -> bool:
+    """
+    Check whether a client wrote recently enough to read from the primary.
+
+    :param cookie_header: The request's Cookie header, if any.
+
+    :return: True while the client's read-your-writes window is open.
+    """
+    if not cookie_header:
+        return False
+    morsel = SimpleCookie(cookie_header).get(PRIMARY_COOKIE)
+    try:
+        return morsel is not None and float(morsel.value) > time.time()
+    except ValueError:
+        return False
+
+
+def replica_read(method):
+    """
+    Let a service read method run on a replica, when the session allows it.
+
+    The session dependency allows replica reads for requests of clients
+    outside their read-your-writes window; anything else, and everything
+    flushed, stays on the primary.
+    """
+    @functools.wraps(method)
+    def wrapper(self, db, *args, **kwargs):
+        if not db.info.get("replica_allowed"):
+            return method(self, db, *args, **kwargs)
+        previous = db.info.get("replica_reads", False)
+        db.info["replica_reads"] = True
+        try:
+            return method(self, db, *args, **kwargs)
+        finally:
+            db.info["replica_reads"] = previous
+    return wrapper
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware pinning a client to the primary for a while after it writes.
+
+    Every successful non-GET response sets a short-lived cookie; the session
+    dependency keeps the reads of requests carrying it on the primary, so a
+    client sees its own writes even while the replicas lag behind.
+    """
+
+    def __init__(self, app, window: float = DB_READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or is_read(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = "{}={:.3f}; Max-Age={}; Path=/; HttpOnly; SameSite=Lax".format(
+                    PRIMARY_COOKIE, time.time() + self.window, math.ceil(self.window))
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
@@ -0,0 +1,109 @@
+import functools
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import BaseModel
+from app.config import FAST_RESPONSES
+
+
+def load_orjson():
+    try:
+        import orjson
+    except ImportError as e:
+        raise ImportError(
+            "FAST_RESPONSES is set but the 'orjson' package is not installed") from e
+    return orjson
+
+
+# Imported at startup so a missing package fails fast instead of on the first request
+orjson = load_orjson() if FAST_RESPONSES else None
+
+
+def encode_default(value):
+    # orjson handles dicts, lists, scalars and datetimes natively; schemas
+    # (cached entities, pages) are dumped to plain Python first
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson, without any model validation."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=encode_default)
+
+
+def unvalidated_response(payload: dict, response: Response = None) -> Response:
+    """
+    Send a response envelope as it is, bypassing the route's response model.
+
+    :param payload: The envelope from response_wrapper, holding dicts, rows shaped as dicts or schemas.
+    :param response: The injected response whose headers (e.g. ETag) are carried over.
+
+    :return: A FastJSONResponse in fast mode, a JSONResponse otherwise.
+    """
+    headers = dict(response.headers) if response is not None else None
+    if FAST_RESPONSES:
+        return FastJSONResponse(payload, headers=headers)
+    return JSONResponse(jsonable_encoder(payload), headers=headers)
+
+
+def send_response(payload: dict, response: Response = None):
+    """
+    Return a success envelope through the fast path when FAST_RESPONSES is on.
+
+    The route's response model still documents the envelope in the OpenAPI
+    schema; in fast mode it is just not re-validated on the way out.
+
+    :param payload: The envelope from response_wrapper.
+    :param response: The injected response whose headers are carried over.
+
+    :return: The payload itself for FastAPI to validate and encode, or a FastJSONResponse.
+    """
+    if not FAST_RESPONSES:
+        return payload
+    return unvalidated_response(payload, response)
+
+
+@functools.lru_cache(maxsize=None)
+def response_field(model):
+    # The field FastAPI builds for a route's response model
+    return create_response_field(name="Response", type_=model, mode="serialization")
+
+
+async def encode_response(payload: dict, model=None) -> bytes:
+    """
+    Encode a response envelope to JSON the way its route would send it.
+
+    Used where one encoded body is shared by several responses, e.g. by
+    coalesced list reads: the payload goes through the same response model
+    validation (or the same fast path) as send_response or
+    unvalidated_response, once.
+
+    :param payload: The envelope from response_wrapper.
+    :param model: The route's response model; None for payloads sent unvalidated.
+
+    :return: The JSON body.
+    """
+    if FAST_RESPONSES:
+        return FastJSONResponse(payload).body
+    if model is not None:
+        payload = await serialize_response(field=response_field(model), response_content=payload)
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def json_response(body: bytes, headers: dict = None) -> Response:
+    """
+    Send a JSON body encoded by encode_response.
+
+    :param body: The encoded JSON.
+    :param headers: Headers to send with it, e.g. the ETag.
+
+    :return: The response.
+    """
+    return Response(body, media_type="application/json", headers=headers)
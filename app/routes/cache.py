@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from app.cache import entity_cache
+from app.utils import response_wrapper, GenericResponse
+
+router = APIRouter()
+
+
+# Get entity cache counters
+@router.get("/cache/stats", response_model=GenericResponse[dict], tags=["Cache"])
+async def read_cache_stats():
+    """
+    Retrieve the hit, miss and eviction counters of the entity cache.
+
+    :return: The counters per cache tier, or null when caching is disabled.
+    """
+    stats = entity_cache.stats() if entity_cache is not None else None
+    return response_wrapper("success", "Cache Stats Retrieved", stats)
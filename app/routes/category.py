@@ -1,32 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
+from app.cache import entity_cache
+from app.coalesce import coalesced
+from app.database import get_session, run_in_session
 from app.services.category_service import CategoryService
+from app.services.inventory_service import InvalidRangeError, InventoryService
+from app.suggest import suggestion_index
 from app.models.category import Category
 from app.schemas import category as category_schema
+from app.schemas import inventory as inventory_schema
 from app.utils import response_wrapper, GenericResponse
-from typing import List
+from app.responses import encode_response, json_response, send_response
+from typing import List, Literal, Union
+from datetime import datetime
 from fastapi_pagination import Page
+from app.pagination import MAX_PAGE_SIZE, CursorPage, InvalidCursorError
+from app.schemas.lookup import MAX_LOOKUP_IDS, Lookup, LookupResult
+from app.etags import (
+    PreconditionFailedError, category_etag, content_etag, etag_matches, parse_version)
+from app.fields import InvalidIdsError, parse_ids
 
 router = APIRouter()
-category_service = CategoryService()
-
-
-# Dependency to get a database session
-def get_db():
-    """
-    Dependency to get a database session.
-    """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Response model of the category list, also used to encode coalesced pages
+CATEGORIES_RESPONSE = GenericResponse[Union[CursorPage[category_schema.Category], Page[category_schema.Category], LookupResult[category_schema.Category]]]
+category_service = CategoryService(cache=entity_cache, suggestions=suggestion_index)
+inventory_service = InventoryService()
 
 
 # Create a new category
 @router.post("/categories/", response_model=GenericResponse[category_schema.CategoryCreate], tags=["Categories"])
-def create_category(category: category_schema.CategoryCreate, db: Session = Depends(get_db)):
+async def create_category(category: category_schema.CategoryCreate, db: Session = Depends(get_session)):
     """
     Create a new category.
 
@@ -36,7 +39,8 @@ def create_category(category: category_schema.CategoryCreate, db: Session = Depe
     :return: The created category.
     """
     try:
-        created_category = category_service.create_category(db, category)
+        created_category = await run_in_session(
+            db, category_service.create_category, category)
         return response_wrapper("success", "Category Created", created_category)
     except Exception as e:
         if not hasattr(e, 'detail'):
@@ -46,23 +50,32 @@ def create_category(category: category_schema.CategoryCreate, db: Session = Depe
 
 # Update a category by ID
 @router.put("/categories/{category_id}", response_model=GenericResponse[category_schema.CategoryUpdate], tags=["Categories"])
-def update_category(category_id: int, category: category_schema.CategoryUpdate, db: Session = Depends(get_db)):
+async def update_category(category_id: int, category: category_schema.CategoryUpdate, if_match: str = Header(None), db: Session = Depends(get_session)):
     """
     Update a category by its ID.
 
     :param category_id: The ID of the category to update.
     :param category: The details of the category to update.
+    :param if_match: Optional ETag from a previous read; the update is rejected with 412 if the category has changed since.
     :param db: Database session dependency.
 
     :return: The updated category.
     """
     try:
-        category = category_service.update_category(
-            db, category_id, category)
+        expected_version = None
+        if if_match is not None and if_match.strip() != "*":
+            expected_version = parse_version(if_match, "c")
+            if expected_version is None:
+                raise PreconditionFailedError(if_match)
+        category = await run_in_session(
+            db, category_service.update_category, category_id, category, expected_version)
         if category:
             return response_wrapper("success", "Category Updated", category)
         raise HTTPException(404, response_wrapper(
             "error", "Category Not Found"))
+    except PreconditionFailedError:
+        raise HTTPException(412, response_wrapper(
+            "error", "Precondition Failed"))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -71,7 +84,7 @@ def update_category(category_id: int, category: category_schema.CategoryUpdate,
 
 # Delete a category by ID
 @router.delete("/categories/{category_id}", response_model=GenericResponse[category_schema.Category], tags=["Categories"])
-def delete_category(category_id: int, db: Session = Depends(get_db)):
+async def delete_category(category_id: int, db: Session = Depends(get_session)):
     """
     Delete a category by its ID.
 
@@ -81,7 +94,8 @@ def delete_category(category_id: int, db: Session = Depends(get_db)):
     :return: The deleted category.
     """
     try:
-        category = category_service.delete_category(db, category_id)
+        category = await run_in_session(
+            db, category_service.delete_category, category_id)
         if category:
             return response_wrapper("success", "Category Deleted", category)
         raise HTTPException(404, response_wrapper(
@@ -94,21 +108,126 @@ def delete_category(category_id: int, db: Session = Depends(get_db)):
 
 # Get a category by ID
 @router.get("/categories/{category_id}", response_model=GenericResponse[category_schema.Category], tags=["Categories"])
-def read_category(category_id: int, db: Session = Depends(get_db)):
+async def read_category(category_id: int, response: Response, if_none_match: str = Header(None), db: Session = Depends(get_session)):
     """
     Retrieve a category by its ID.
 
+    The response carries an ETag; a request whose If-None-Match matches the
+    current one gets an empty 304 Not Modified instead.
+
     :param category_id: The ID of the category to retrieve.
+    :param response: The response, used to set the ETag header.
+    :param if_none_match: Optional ETag(s) of a cached representation.
     :param db: Database session dependency.
 
     :return: The retrieved category.
     """
     try:
-        category = category_service.get_category(db, category_id)
+        if if_none_match is not None:
+            etag = await run_in_session(
+                db, category_service.get_category_etag, category_id)
+            if etag is not None and etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+        category = await run_in_session(
+            db, category_service.get_category, category_id)
         if category is None:
             raise HTTPException(404, response_wrapper(
                 "error", "Category Not Found"))
-        return response_wrapper("success", "Category Retrieved", category)
+        response.headers["ETag"] = category_etag(category.version)
+        return send_response(response_wrapper(
+            "success", "Category Retrieved", category), response)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Get the inventory figures of a category
+@router.get("/categories/{category_id}/stats", response_model=GenericResponse[inventory_schema.CategoryStats], tags=["Categories"])
+async def read_category_stats(category_id: int, db: Session = Depends(get_session)):
+    """
+    Retrieve the product count, units in stock and stock value of a category.
+
+    Served from the inventory summary, in constant time whatever the
+    number of products.
+
+    :param category_id: The ID of the category.
+    :param db: Database session dependency.
+
+    :return: The inventory figures of the category.
+    """
+    try:
+        stats = await run_in_session(
+            db, inventory_service.get_category_stats, category_id)
+        if stats is None:
+            raise HTTPException(404, response_wrapper(
+                "error", "Category Not Found"))
+        return send_response(response_wrapper(
+            "success", "Category Stats Retrieved", stats))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Get the inventory trend of a category
+@router.get("/categories/{category_id}/history", response_model=GenericResponse[inventory_schema.CategoryTrend], tags=["Categories"])
+async def read_category_history(
+    category_id: int,
+    granularity: Literal["hour", "day"] = "hour",
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_session)
+):
+    """
+    Retrieve the units in stock and stock value of a category over time.
+
+    Served from the hourly or daily inventory rollups, so a range costs
+    the same whatever the number of products and writes in it.
+
+    :param category_id: The ID of the category.
+    :param granularity: Bucket size, "hour" (default) or "day".
+    :param start: Start of the range (default: a day or 30 days before end); times without an offset are UTC.
+    :param end: End of the range, exclusive (default: now).
+    :param db: Database session dependency.
+
+    :return: The closing level of every bucket with changes, and a summary of the range.
+    """
+    try:
+        trend = await run_in_session(
+            db, inventory_service.get_category_trend, category_id, granularity, start, end)
+        if trend is None:
+            raise HTTPException(404, response_wrapper(
+                "error", "Category Not Found"))
+        return send_response(response_wrapper(
+            "success", "Category History Retrieved", trend))
+    except InvalidRangeError:
+        raise HTTPException(400, response_wrapper("error", "Invalid Range"))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Get many categories by ID at once
+@router.post("/categories/lookup", response_model=GenericResponse[LookupResult[category_schema.Category]], tags=["Categories"])
+async def lookup_categories(lookup: Lookup, db: Session = Depends(get_session)):
+    """
+    Retrieve the categories of a list of IDs, like GET /categories/?ids= for lists too long for a URL.
+
+    Cached categories are served from the entity cache and the others are
+    read in one query.
+
+    :param lookup: The IDs, at most 1000.
+    :param db: Database session dependency.
+
+    :return: The categories found, in the order of their IDs, and the IDs not found.
+    """
+    try:
+        categories = await run_in_session(
+            db, category_service.get_categories_by_ids, lookup.ids)
+        return send_response(response_wrapper(
+            "success", "Categories Retrieved", categories))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -116,12 +235,19 @@ def read_category(category_id: int, db: Session = Depends(get_db)):
 
 
 # Get all categories with pagination and search
-@router.get("/categories/", response_model=GenericResponse[Page[category_schema.Category]], tags=["Categories"])
-def read_categories(
+@router.get("/categories/", response_model=CATEGORIES_RESPONSE, tags=["Categories"])
+async def read_categories(
     page_number: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1),
+    page_size: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
     search_term: str = None,
-    db: Session = Depends(get_db)
+    ids: str = None,
+    pagination: Literal["page", "cursor"] = "page",
+    cursor: str = None,
+    sort_by: Literal["id", "name"] = "id",
+    include_total: bool = False,
+    include_counts: bool = False,
+    if_none_match: str = Header(None),
+    db: Session = Depends(get_session)
 ):
     """
     Retrieve all categories with pagination and optional search filtering.
@@ -129,14 +255,69 @@ def read_categories(
     :param page_number: The page number for pagination (default: 1).
     :param page_size: The page size for pagination (default: 10).
     :param search_term: Optional search term to filter categories by name or description.
+    :param ids: Optional comma-separated category IDs to fetch instead of a page, e.g. "4,1"; see POST /categories/lookup.
+    :param pagination: "page" for page-number pagination (default) or "cursor" for keyset pagination.
+    :param cursor: Cursor mode only: the next_cursor of the previous page, omitted for the first page.
+    :param sort_by: Cursor mode only: the sort key, "id" (default) or "name".
+    :param include_total: Cursor mode only: whether to count the whole filtered set (default: False).
+    :param include_counts: Whether to add the product_count of each category, read from the inventory summary (default: False).
+    :param if_none_match: Optional ETag(s) of a cached representation.
     :param db: Database session dependency.
 
-    :return: Paginated list of categories.
+    :return: Paginated list of categories, or the categories of ids.
     """
     try:
-        categories = category_service.get_categories(
-            db, page_number=page_number, page_size=page_size, search_term=search_term)
-        return response_wrapper("success", "Categories Retrieved", categories)
+        if ids is not None:
+            categories = await run_in_session(
+                db, category_service.get_categories_by_ids, parse_ids(ids, MAX_LOOKUP_IDS))
+            return send_response(response_wrapper(
+                "success", "Categories Retrieved", categories))
+        # In page mode, the ETag covers the whole filtered set, so it changes
+        # whenever any page of it could; identical concurrent requests share
+        # its query. A cursor page is not worth a scan of the set: its ETag
+        # is derived from the page itself, after the read
+        etag = None
+        if pagination == "page":
+            async def load_etag(session):
+                return await run_in_session(
+                    session, category_service.get_categories_etag, search_term=search_term,
+                    include_counts=include_counts)
+            etag = await coalesced(
+                db, ("categories_etag", search_term, include_counts), load_etag)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+
+        # The page is read and encoded once for identical concurrent requests
+        async def load_page(session):
+            if pagination == "cursor":
+                categories = await run_in_session(
+                    session, category_service.get_categories_by_cursor,
+                    cursor=cursor, page_size=page_size, search_term=search_term,
+                    sort_by=sort_by, include_total=include_total, include_counts=include_counts)
+            else:
+                categories = await run_in_session(
+                    session, category_service.get_categories,
+                    page_number=page_number, page_size=page_size, search_term=search_term,
+                    include_counts=include_counts)
+            # The product counts are not part of the response model: they are sent as they are
+            return await encode_response(response_wrapper(
+                "success", "Categories Retrieved", categories),
+                None if include_counts else CATEGORIES_RESPONSE)
+        if pagination == "cursor":
+            key = ("categories", pagination, cursor, sort_by, include_total)
+        else:
+            key = ("categories", etag, pagination, page_number)
+        body = await coalesced(
+            db, (*key, page_size, search_term, include_counts), load_page)
+        if etag is None:
+            etag = content_etag("c", body)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+        return json_response(body, {"ETag": etag})
+    except InvalidCursorError:
+        raise HTTPException(400, response_wrapper("error", "Invalid Cursor"))
+    except InvalidIdsError as e:
+        raise HTTPException(400, response_wrapper("error", str(e)))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
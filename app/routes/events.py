@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Literal
+from app.config import EVENTS_HEARTBEAT_SECONDS, EVENTS_STREAM_SECONDS
+from app.events import change_feed
+from app.utils import response_wrapper
+
+router = APIRouter()
+
+
+# Stream product and category changes as Server-Sent Events
+@router.get("/events", response_class=StreamingResponse, tags=["Events"])
+async def stream_events(
+    entity: List[Literal["product", "category"]] = Query(None),
+    last_event_id: int = Header(None, ge=0),
+    resume_from: int = Query(None, alias="last_event_id", ge=0)
+):
+    """
+    Stream every product and category created, updated, restocked or deleted, as it commits.
+
+    Each event carries its outbox id; a client reconnecting with the
+    Last-Event-ID header (sent by browsers' EventSource on their own) gets
+    every event it missed, in order. When those events were already pruned,
+    a "reset" event tells it to reload instead.
+
+    :param entity: Only stream the events of these entities, e.g. ?entity=product.
+    :param last_event_id: Id of the last event received, from the Last-Event-ID header.
+    :param resume_from: The same as a query parameter, for clients that cannot set headers.
+
+    :return: The text/event-stream of the events.
+    """
+    try:
+        if change_feed is None:
+            raise HTTPException(503, response_wrapper(
+                "error", "Events Disabled"))
+        stream = change_feed.stream(
+            last_event_id if last_event_id is not None else resume_from,
+            set(entity) if entity else None,
+            EVENTS_HEARTBEAT_SECONDS, EVENTS_STREAM_SECONDS)
+        return StreamingResponse(
+            stream,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
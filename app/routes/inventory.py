@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from app.database import get_session, run_in_session
+from app.services.inventory_service import InventoryService
+from app.schemas import inventory as inventory_schema
+from app.utils import response_wrapper, GenericResponse
+from app.responses import send_response
+
+router = APIRouter()
+inventory_service = InventoryService()
+
+
+# Get the inventory totals of the whole catalogue
+@router.get("/inventory/summary", response_model=GenericResponse[inventory_schema.InventorySummary], tags=["Inventory"])
+async def read_inventory_summary(db: Session = Depends(get_session)):
+    """
+    Retrieve the product count, units in stock and stock value of the whole catalogue.
+
+    Summed over the per-category inventory summary, so the cost grows with
+    the number of categories, not of products.
+
+    :param db: Database session dependency.
+
+    :return: The inventory totals.
+    """
+    try:
+        summary = await run_in_session(db, inventory_service.get_summary)
+        return send_response(response_wrapper(
+            "success", "Inventory Summary Retrieved", summary))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.metrics import registry
+
+router = APIRouter()
+
+
+# Expose the metrics in the Prometheus text format
+@router.get("/metrics", response_class=PlainTextResponse, tags=["Metrics"])
+async def read_metrics():
+    """
+    Retrieve request latency, SQL and connection pool metrics for Prometheus.
+
+    :return: The metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
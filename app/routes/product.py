@@ -1,32 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, Request
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.services.product_service import ProductService
+from app.cache import entity_cache
+from app.coalesce import coalesced, normalize_fields
+from app.database import get_session, run_in_session, stream_partitions
+from app.services.product_service import (
+    CategoryNotFoundError, DuplicateNameError, ProductService, PRODUCT_EXPORT_COLUMNS)
 from app.models.product import Product
 from app.schemas import product as product_schema
+from app.schemas import stock as stock_schema
+from app.schemas import inventory as inventory_schema
+from app.schemas import suggest as suggest_schema
+from app.services.inventory_service import InvalidRangeError, InventoryService
+from app.suggest import suggestion_index
 from app.utils import response_wrapper, GenericResponse
-from typing import List
+from app.responses import encode_response, json_response, send_response
+from typing import List, Literal, Union
+from datetime import datetime
 from fastapi_pagination import Page
+from app.pagination import MAX_PAGE_SIZE, CursorPage, InvalidCursorError
+from app.schemas.lookup import MAX_LOOKUP_IDS, Lookup, LookupResult
+from app.fields import InvalidIdsError, UnknownFieldError, parse_ids
+from app.etags import (
+    PreconditionFailedError, content_etag, etag_matches, parse_version, product_etag)
+from app.imports import ImportFormatError, detect_import_format, import_records, iter_records
+from app.exports import EXPORT_MEDIA_TYPES, iter_export
+from fastapi.responses import StreamingResponse
 
 router = APIRouter()
-product_service = ProductService()
-
-
-# Dependency to get a database session
-def get_db():
-    """
-    Dependency to get a database session.
-    """
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Response model of the product list, also used to encode coalesced pages
+PRODUCTS_RESPONSE = GenericResponse[Union[CursorPage[product_schema.Product], Page[product_schema.Product], LookupResult[product_schema.Product]]]
+product_service = ProductService(cache=entity_cache, suggestions=suggestion_index)
+inventory_service = InventoryService()
 
 
 # Create a new product
 @router.post("/products/", response_model=GenericResponse[product_schema.ProductCreate])
-def create_product(product: product_schema.ProductCreate, db: Session = Depends(get_db)):
+async def create_product(product: product_schema.ProductCreate, db: Session = Depends(get_session)):
     """
     Create a new product.
 
@@ -36,8 +45,254 @@ def create_product(product: product_schema.ProductCreate, db: Session = Depends(
     :return: The created product.
     """
     try:
-        product = product_service.create_product(db, product)
+        product = await run_in_session(
+            db, product_service.create_product, product)
         return response_wrapper("success", "Product Created", product)
+    except DuplicateNameError:
+        raise HTTPException(409, response_wrapper(
+            "error", "Product Name Already Exists"))
+    except CategoryNotFoundError:
+        raise HTTPException(404, response_wrapper(
+            "error", "Category Not Found"))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Bulk import products from a streamed CSV or NDJSON body
+@router.post("/products/import", response_model=GenericResponse[product_schema.ImportReport])
+async def import_products(
+    request: Request,
+    format: Literal["csv", "ndjson"] = None,
+    upsert_on: Literal["name"] = None,
+    batch_size: int = Query(1000, ge=1, le=10000),
+    max_errors: int = Query(1000, ge=0),
+    db: Session = Depends(get_session)
+):
+    """
+    Bulk import products from a CSV (with header row) or NDJSON request body.
+
+    The body is streamed and validated against ProductCreate in batches; each
+    batch is written with bulk statements in its own transaction.
+
+    :param request: The request whose body is streamed.
+    :param format: "csv" or "ndjson"; detected from the Content-Type when omitted.
+    :param upsert_on: Optional natural key ("name"); rows matching an existing product replace its fields instead of being rejected as duplicates.
+    :param batch_size: Rows per batch and transaction (default: 1000).
+    :param max_errors: Maximum number of row errors to return (default: 1000).
+    :param db: Database session dependency.
+
+    :return: The import report with counters and per-row errors.
+    """
+    try:
+        import_format = detect_import_format(
+            request.headers.get("content-type"), format)
+        if import_format is None:
+            raise HTTPException(415, response_wrapper(
+                "error", "Unsupported Import Format"))
+
+        async def write_batch(batch):
+            return await run_in_session(
+                db, product_service.import_products, batch, upsert_on=upsert_on)
+
+        report = await import_records(
+            iter_records(request.stream(), import_format),
+            product_schema.ProductCreate.model_validate,
+            write_batch,
+            batch_size=batch_size,
+            max_errors=max_errors)
+        return response_wrapper("success", "Products Imported", report)
+    except ImportFormatError as e:
+        raise HTTPException(400, response_wrapper("error", str(e)))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Update many products in one transaction
+@router.patch("/products/batch", response_model=GenericResponse[product_schema.BatchReport])
+async def update_products(batch: product_schema.ProductBatchUpdate, db: Session = Depends(get_session)):
+    """
+    Update many products at once, with per-id partial updates and/or one set-based operation.
+
+    The operation applies price_factor, price_delta, quantity_delta and the
+    fields in set to every product matching its ids and/or category_id, e.g.
+    raising prices by 5% in a category or moving products to another one.
+
+    :param batch: The per-id updates and the optional operation.
+    :param db: Database session dependency.
+
+    :return: The batch report with counters and per-id outcomes.
+    """
+    try:
+        operation = batch.operation
+        if operation is not None:
+            if operation.ids is None and operation.category_id is None:
+                raise HTTPException(400, response_wrapper(
+                    "error", "Batch Operation Needs ids Or category_id"))
+            if (operation.price_factor is None and operation.price_delta is None
+                    and operation.quantity_delta is None
+                    and not (operation.set and operation.set.model_fields_set)):
+                raise HTTPException(400, response_wrapper(
+                    "error", "Batch Operation Has No Changes"))
+        report = await run_in_session(
+            db, product_service.update_products, batch.items, operation)
+        return response_wrapper("success", "Products Updated", report)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Delete many products in one statement
+@router.delete("/products/batch", response_model=GenericResponse[product_schema.BatchReport])
+async def delete_products(batch: product_schema.ProductBatchDelete, db: Session = Depends(get_session)):
+    """
+    Delete many products by their IDs.
+
+    :param batch: The IDs of the products to delete.
+    :param db: Database session dependency.
+
+    :return: The batch report with counters and per-id outcomes.
+    """
+    try:
+        report = await run_in_session(
+            db, product_service.delete_products, batch.ids)
+        return response_wrapper("success", "Products Deleted", report)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Adjust the stock of many products at once
+@router.post("/products/stock", response_model=GenericResponse[stock_schema.StockBatchReport])
+async def adjust_stock_batch(batch: stock_schema.StockBatch, db: Session = Depends(get_session)):
+    """
+    Apply relative stock adjustments to many products, e.g. the lines of one sale.
+
+    All adjustments run as one conditional UPDATE that never takes a product
+    below zero, and each applied one is recorded in the stock movement ledger.
+
+    :param batch: The (product_id, delta) items, a reason and whether the batch is atomic.
+    :param db: Database session dependency.
+
+    :return: The batch report; 409 with the report when an atomic batch was rolled back.
+    """
+    try:
+        report = await run_in_session(
+            db, product_service.adjust_stock,
+            [(item.product_id, item.delta) for item in batch.items],
+            reason=batch.reason, atomic=batch.atomic)
+        if not report["committed"]:
+            raise HTTPException(409, response_wrapper(
+                "error", "Stock Not Adjusted", report))
+        return response_wrapper("success", "Stock Adjusted", report)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Adjust the stock of a product by a relative delta
+@router.post("/products/{product_id}/stock", response_model=GenericResponse[stock_schema.StockLevel])
+async def adjust_stock(product_id: int, adjustment: stock_schema.StockAdjustment, db: Session = Depends(get_session)):
+    """
+    Add to or remove from the stock of a product.
+
+    The delta is applied atomically in the database, so concurrent adjustments
+    never overwrite each other; a removal larger than the stock is rejected.
+
+    :param product_id: The ID of the product.
+    :param adjustment: The delta and an optional reason.
+    :param db: Database session dependency.
+
+    :return: The new stock level.
+    """
+    try:
+        report = await run_in_session(
+            db, product_service.adjust_stock, [(product_id, adjustment.delta)],
+            reason=adjustment.reason)
+        level = report["results"][0]
+        if level["status"] == "not_found":
+            raise HTTPException(404, response_wrapper(
+                "error", "Product Not Found"))
+        if level["status"] == "insufficient_stock":
+            raise HTTPException(409, response_wrapper(
+                "error", "Insufficient Stock"))
+        return response_wrapper("success", "Stock Adjusted", level)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Get the stock movement ledger of a product
+@router.get("/products/{product_id}/stock/movements", response_model=GenericResponse[CursorPage[stock_schema.StockMovement]])
+async def read_stock_movements(
+    product_id: int,
+    cursor: str = None,
+    page_size: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_session)
+):
+    """
+    Retrieve the stock movements of a product, oldest first.
+
+    :param product_id: The ID of the product.
+    :param cursor: The next_cursor of the previous page, omitted for the first page.
+    :param page_size: The page size (default: 10).
+    :param db: Database session dependency.
+
+    :return: A page of stock movements.
+    """
+    try:
+        movements = await run_in_session(
+            db, product_service.get_stock_movements, product_id,
+            cursor=cursor, page_size=page_size)
+        return response_wrapper("success", "Stock Movements Retrieved", movements)
+    except InvalidCursorError:
+        raise HTTPException(400, response_wrapper("error", "Invalid Cursor"))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Get the inventory trend of a product
+@router.get("/products/{product_id}/history", response_model=GenericResponse[inventory_schema.ProductTrend])
+async def read_product_history(
+    product_id: int,
+    granularity: Literal["hour", "day"] = "hour",
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_session)
+):
+    """
+    Retrieve the stock level, price and stock value of a product over time.
+
+    Served from the hourly or daily inventory rollups; deleted products
+    keep their history.
+
+    :param product_id: The ID of the product.
+    :param granularity: Bucket size, "hour" (default) or "day".
+    :param start: Start of the range (default: a day or 30 days before end); times without an offset are UTC.
+    :param end: End of the range, exclusive (default: now).
+    :param db: Database session dependency.
+
+    :return: The closing level of every bucket with changes, and a summary of the range.
+    """
+    try:
+        trend = await run_in_session(
+            db, inventory_service.get_product_trend, product_id, granularity, start, end)
+        if trend is None:
+            raise HTTPException(404, response_wrapper(
+                "error", "Product Not Found"))
+        return send_response(response_wrapper(
+            "success", "Product History Retrieved", trend))
+    except InvalidRangeError:
+        raise HTTPException(400, response_wrapper("error", "Invalid Range"))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -46,24 +301,40 @@ def create_product(product: product_schema.ProductCreate, db: Session = Depends(
 
 # Update a product by ID
 @router.put("/products/{product_id}", response_model=GenericResponse[product_schema.ProductUpdate])
-def update_product(product_id: int, product: product_schema.ProductUpdate, db: Session = Depends(get_db)):
+async def update_product(product_id: int, product: product_schema.ProductUpdate, if_match: str = Header(None), db: Session = Depends(get_session)):
     """
     Update a product by its ID.
 
     :param product_id: The ID of the product to update.
     :param product: The details of the product to update.
+    :param if_match: Optional ETag from a previous read; the update is rejected with 412 if the product has changed since.
     :param db: Database session dependency.
 
     :return: The updated product.
     """
     try:
-        product = product_service.update_product(db, product_id, product)
+        expected_version = None
+        if if_match is not None and if_match.strip() != "*":
+            expected_version = parse_version(if_match, "p")
+            if expected_version is None:
+                raise PreconditionFailedError(if_match)
+        product = await run_in_session(
+            db, product_service.update_product, product_id, product, expected_version)
         if product:
             return response_wrapper("success", "Product Updated", product)
         raise HTTPException(404, response_wrapper(
             "error", "Product Not Found"))
         return response_wrapper("error", "Product Not Found")
 
+    except PreconditionFailedError:
+        raise HTTPException(412, response_wrapper(
+            "error", "Precondition Failed"))
+    except DuplicateNameError:
+        raise HTTPException(409, response_wrapper(
+            "error", "Product Name Already Exists"))
+    except CategoryNotFoundError:
+        raise HTTPException(404, response_wrapper(
+            "error", "Category Not Found"))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -72,7 +343,7 @@ def update_product(product_id: int, product: product_schema.ProductUpdate, db: S
 
 # Delete a product by ID
 @router.delete("/products/{product_id}", response_model=GenericResponse[product_schema.Product])
-def delete_product(product_id: int, db: Session = Depends(get_db)):
+async def delete_product(product_id: int, db: Session = Depends(get_session)):
     """
     Delete a product by its ID.
 
@@ -82,7 +353,8 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     :return: The deleted product.
     """
     try:
-        product = product_service.delete_product(db, product_id)
+        product = await run_in_session(
+            db, product_service.delete_product, product_id)
         if product:
             return response_wrapper("success", "Product Deleted", product)
         raise HTTPException(404, response_wrapper(
@@ -93,23 +365,136 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
         raise e
 
 
+# Get many products by ID at once
+@router.post("/products/lookup", response_model=GenericResponse[LookupResult[product_schema.Product]])
+async def lookup_products(lookup: Lookup, db: Session = Depends(get_session)):
+    """
+    Retrieve the products of a list of IDs, like GET /products/?ids= for lists too long for a URL.
+
+    Cached products are served from the entity cache and the others are
+    read in one query, with their categories.
+
+    :param lookup: The IDs, at most 1000.
+    :param db: Database session dependency.
+
+    :return: The products found, in the order of their IDs, and the IDs not found.
+    """
+    try:
+        products = await run_in_session(
+            db, product_service.get_products_by_ids, lookup.ids)
+        return send_response(response_wrapper(
+            "success", "Products Retrieved", products))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Stream the product catalogue as NDJSON or CSV
+@router.get("/products/export", response_class=StreamingResponse)
+async def export_products(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    search_term: str = None,
+    category_id: int = None,
+    batch_size: int = Query(1000, ge=1, le=10000)
+):
+    """
+    Stream all products matching the filters, in ID order.
+
+    Rows are read from a server-side cursor batch_size at a time and written
+    straight to the response, so memory stays constant for any catalogue size.
+
+    :param format: "ndjson" (default) or "csv" (with a header row).
+    :param gzip: Whether to gzip the body (sent with Content-Encoding: gzip).
+    :param search_term: Optional search term to filter products by name or description.
+    :param category_id: Optional category ID to filter products by category.
+    :param batch_size: Rows fetched per round trip (default: 1000).
+
+    :return: The streamed export.
+    """
+    try:
+        columns = [column.key for column in PRODUCT_EXPORT_COLUMNS]
+        partitions = stream_partitions(
+            lambda db: product_service.export_products_query(
+                db, search_term=search_term, category_id=category_id),
+            batch_size)
+        headers = {
+            "Content-Disposition": f'attachment; filename="products.{format}"'}
+        if gzip:
+            headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(
+            iter_export(partitions, columns, format, compress=gzip),
+            media_type=EXPORT_MEDIA_TYPES[format],
+            headers=headers)
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
+# Suggest products and categories for the text typed so far
+@router.get("/products/suggest", response_model=GenericResponse[suggest_schema.Suggestions])
+async def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    category_id: int = None,
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Suggest products and categories whose names have words starting with every word of q.
+
+    Served from the in-memory suggestion index, without a database round
+    trip, for pickers calling it on every keystroke.
+
+    :param q: The text typed so far, e.g. "choc cro".
+    :param category_id: Only suggest products of this category, and no categories.
+    :param limit: The most suggestions of each kind (default: 10).
+
+    :return: The matching products and categories, in alphabetical order of the matched word.
+    """
+    try:
+        if suggestion_index is None:
+            raise HTTPException(503, response_wrapper(
+                "error", "Suggestions Disabled"))
+        suggestions = suggestion_index.suggest(q, category_id, limit)
+        return send_response(response_wrapper(
+            "success", "Suggestions Retrieved", suggestions))
+    except Exception as e:
+        if not hasattr(e, 'detail'):
+            e.detail = response_wrapper("error", "Internal Server Error")
+        raise e
+
+
 # Get a product by ID
 @router.get("/products/{product_id}", response_model=GenericResponse[product_schema.Product])
-def read_product(product_id: int, db: Session = Depends(get_db)):
+async def read_product(product_id: int, response: Response, if_none_match: str = Header(None), db: Session = Depends(get_session)):
     """
     Retrieve a product by its ID.
 
+    The response carries an ETag; a request whose If-None-Match matches the
+    current one gets an empty 304 Not Modified instead.
+
     :param product_id: The ID of the product to retrieve.
+    :param response: The response, used to set the ETag header.
+    :param if_none_match: Optional ETag(s) of a cached representation.
     :param db: Database session dependency.
 
     :return: The retrieved product.
     """
     try:
-        product = product_service.get_product(db, product_id)
+        if if_none_match is not None:
+            etag = await run_in_session(
+                db, product_service.get_product_etag, product_id)
+            if etag is not None and etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+        product = await run_in_session(
+            db, product_service.get_product, product_id)
         if product is None:
             raise HTTPException(404, response_wrapper(
                 "error", "Product Not Found"))
-        return response_wrapper("success", "Product Retrieved", product)
+        response.headers["ETag"] = product_etag(product.version, product.category.version)
+        return send_response(response_wrapper(
+            "success", "Product Retrieved", product), response)
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -117,33 +502,125 @@ def read_product(product_id: int, db: Session = Depends(get_db)):
 
 
 # Get all products with pagination and search
-@router.get("/products/", response_model=GenericResponse[Page[product_schema.Product]])
-def read_products(
+@router.get("/products/", response_model=PRODUCTS_RESPONSE)
+async def read_products(
     page_number: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1),
+    page_size: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
     search_term: str = None,
     category_id: int = None,
-    db: Session = Depends(get_db)
+    ids: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    min_quantity: int = None,
+    max_quantity: int = None,
+    sort_by: Literal["id", "name", "price", "quantity"] = None,
+    sort_order: Literal["asc", "desc"] = "asc",
+    pagination: Literal["page", "cursor"] = "page",
+    cursor: str = None,
+    include_total: bool = False,
+    fields: str = None,
+    if_none_match: str = Header(None),
+    db: Session = Depends(get_session)
 ):
     """
-    Retrieve all products with pagination and optional search filtering.
+    Retrieve all products with pagination, optional filtering and sorting.
 
     :param page_number: The page number for pagination (default: 1).
     :param page_size: The page size for pagination (default: 10).
     :param search_term: Optional search term to filter products by name or description.
     :param category_id: Optional category ID to filter products by category.
+    :param ids: Optional comma-separated product IDs to fetch instead of a page, e.g. "7,3,12"; see POST /products/lookup.
+    :param min_price: Optional lowest price, inclusive.
+    :param max_price: Optional highest price, inclusive.
+    :param min_quantity: Optional lowest quantity, inclusive.
+    :param max_quantity: Optional highest quantity, inclusive.
+    :param sort_by: The sort key, "id", "name", "price" or "quantity"; by default the relevance when searching in page mode, the id otherwise. Ties are broken by id.
+    :param sort_order: "asc" (default) or "desc".
+    :param pagination: "page" for page-number pagination (default) or "cursor" for keyset pagination.
+    :param cursor: Cursor mode only: the next_cursor of the previous page, omitted for the first page.
+    :param include_total: Cursor mode only: whether to count the whole filtered set (default: False).
+    :param fields: Optional comma-separated product fields to return, e.g. "id,name,price" or "id,category"; the id (and the cursor sort key) is always included.
+    :param if_none_match: Optional ETag(s) of a cached representation.
     :param db: Database session dependency.
 
-    :return: Paginated list of products.
+    :return: Paginated list of products, or the products of ids.
     """
     try:
-        products = product_service.get_products(
-            db,
-            page_number=page_number,
-            page_size=page_size,
-            search_term=search_term,
-            category_id=category_id)
-        return response_wrapper("success", "Products Retrieved", products)
+        if ids is not None:
+            products = await run_in_session(
+                db, product_service.get_products_by_ids, parse_ids(ids, MAX_LOOKUP_IDS))
+            return send_response(response_wrapper(
+                "success", "Products Retrieved", products))
+        for low, high in ((min_price, max_price), (min_quantity, max_quantity)):
+            if low is not None and high is not None and low > high:
+                raise HTTPException(400, response_wrapper("error", "Invalid Range"))
+        ranges = dict(min_price=min_price, max_price=max_price,
+                      min_quantity=min_quantity, max_quantity=max_quantity)
+        descending = sort_order == "desc"
+
+        # In page mode, the ETag covers the whole filtered set, so it changes
+        # whenever any page of it could; identical concurrent requests share
+        # its query. A cursor page is not worth a scan of the set: its ETag
+        # is derived from the page itself, after the read
+        etag = None
+        if pagination == "page":
+            async def load_etag(session):
+                return await run_in_session(
+                    session, product_service.get_products_etag,
+                    search_term=search_term, category_id=category_id, **ranges)
+            etag = await coalesced(
+                db, ("products_etag", search_term, category_id, *ranges.values()), load_etag)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+
+        # The page is read and encoded once for identical concurrent requests;
+        # in page mode keyed on the ETag, so it follows the filtered set
+        async def load_page(session):
+            if pagination == "cursor":
+                products = await run_in_session(
+                    session,
+                    product_service.get_products_by_cursor,
+                    cursor=cursor,
+                    page_size=page_size,
+                    search_term=search_term,
+                    category_id=category_id,
+                    sort_by=sort_by or "id",
+                    include_total=include_total,
+                    fields=fields,
+                    descending=descending,
+                    **ranges)
+            else:
+                products = await run_in_session(
+                    session,
+                    product_service.get_products,
+                    page_number=page_number,
+                    page_size=page_size,
+                    search_term=search_term,
+                    category_id=category_id,
+                    fields=fields,
+                    sort_by=sort_by,
+                    descending=descending,
+                    **ranges)
+            # Partial products do not fit the response model: they are sent as they are
+            return await encode_response(response_wrapper(
+                "success", "Products Retrieved", products),
+                PRODUCTS_RESPONSE if fields is None else None)
+        if pagination == "cursor":
+            key = ("products", pagination, cursor, include_total)
+        else:
+            key = ("products", etag, pagination, page_number)
+        body = await coalesced(
+            db, (*key, page_size, search_term, category_id, *ranges.values(),
+                 sort_by, sort_order, normalize_fields(fields)), load_page)
+        if etag is None:
+            etag = content_etag("p", body)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+        return json_response(body, {"ETag": etag})
+    except InvalidCursorError:
+        raise HTTPException(400, response_wrapper("error", "Invalid Cursor"))
+    except (InvalidIdsError, UnknownFieldError) as e:
+        raise HTTPException(400, response_wrapper("error", str(e)))
     except Exception as e:
         if not hasattr(e, 'detail'):
             e.detail = response_wrapper("error", "Internal Server Error")
@@ -29,6 +29,7 @@ class CategoryUpdate(BaseModel):
 
 class Category(CategoryBase):
     id: int
+    version: int
 
     class Config:
         orm_mode = True
@@ -0,0 +1,72 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+
+
+class InventoryStats(BaseModel):
+    product_count: int = Field(..., description="Number of products")
+    total_units: int = Field(..., description="Units in stock, summed over the products")
+    stock_value: float = Field(..., description="Value of the stock, the sum of price * quantity")
+    out_of_stock_count: int = Field(..., description="Products with no units left")
+
+
+class CategoryStats(InventoryStats):
+    category_id: int
+    name: Optional[str] = None
+
+
+class InventorySummary(InventoryStats):
+    category_count: int = Field(..., description="Number of categories")
+    uncategorized_count: int = Field(..., description="Products without a category")
+
+
+class InventoryLevel(BaseModel):
+    bucket: datetime = Field(..., description="Start of the hour or day, in UTC")
+    units: int = Field(..., description="Units in stock at the end of the bucket")
+    value: float = Field(..., description="Stock value at the end of the bucket")
+    low_units: int = Field(..., description="Fewest units in stock during the bucket")
+    high_units: int = Field(..., description="Most units in stock during the bucket")
+
+
+class ProductLevel(InventoryLevel):
+    price: Optional[float] = Field(None, description="Price at the end of the bucket")
+    changes: int = Field(..., description="Changes to the stock, price or category during the bucket")
+
+
+class CategoryLevel(InventoryLevel):
+    product_count: int
+    out_of_stock_count: int
+
+
+class TrendSummary(BaseModel):
+    opening_units: int = Field(..., description="Units in stock at the start of the range")
+    closing_units: int = Field(..., description="Units in stock at the end of the range")
+    units_change: int
+    opening_value: float
+    closing_value: float
+    value_change: float
+    low_units: int = Field(..., description="Fewest units in stock over the range")
+    high_units: int = Field(..., description="Most units in stock over the range")
+
+
+class InventoryTrend(BaseModel):
+    granularity: str
+    start: datetime = Field(..., description="Start of the first bucket, in UTC")
+    end: datetime = Field(..., description="End of the range, exclusive, in UTC")
+    summary: TrendSummary
+
+
+class ProductTrend(InventoryTrend):
+    product_id: int
+    opening: Optional[ProductLevel] = Field(
+        None, description="Last bucket before the range, holding the level at its start")
+    points: List[ProductLevel] = Field(
+        ..., description="Buckets with changes; a bucket without changes keeps the previous level")
+
+
+class CategoryTrend(InventoryTrend):
+    category_id: int
+    opening: Optional[CategoryLevel] = Field(
+        None, description="Last bucket before the range, holding the level at its start")
+    points: List[CategoryLevel] = Field(
+        ..., description="Buckets with changes; a bucket without changes keeps the previous level")
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Generic, List, TypeVar
+
+T = TypeVar("T")
+
+# Most ids fetched by one lookup
+MAX_LOOKUP_IDS = 1000
+
+
+class Lookup(BaseModel):
+    ids: List[int] = Field(..., max_length=MAX_LOOKUP_IDS,
+                           description="The IDs to fetch, in the order to return them")
+
+
+class LookupResult(BaseModel, Generic[T]):
+    # The entities found, in the order their ids were first requested
+    items: List[T]
+    # Requested ids without an entity, in the same order
+    missing: List[int]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from .category import Category  # Assuming Category model is defined in category.py
 
 
@@ -37,7 +37,64 @@ class ProductUpdate(BaseModel):
 
 class Product(ProductBase):
     id: int
+    version: int
     category: Category  # Include Category object
 
     class Config:
         orm_mode = True
+
+
+class ImportRowError(BaseModel):
+    row: int = Field(..., title="Row",
+                     description="The 1-based data row number in the import body")
+    field: Optional[str] = None
+    error: str
+
+
+class ImportReport(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+
+
+class ProductBatchItem(ProductUpdate):
+    id: int = Field(..., title="ID", description="The ID of the product to update")
+
+
+class ProductBatchOperation(BaseModel):
+    # Products the operation applies to; at least one filter is required
+    ids: Optional[List[int]] = None
+    category_id: Optional[int] = None
+    # Changes applied to every matched product
+    price_factor: Optional[float] = Field(
+        None, gt=0, description="Multiply the price, e.g. 1.05 for +5%")
+    price_delta: Optional[float] = Field(None, description="Add to the price")
+    quantity_delta: Optional[int] = Field(None, description="Add to the quantity")
+    set: Optional[ProductUpdate] = Field(
+        None, description="Fields to set, e.g. category_id to reassign products")
+
+
+class ProductBatchUpdate(BaseModel):
+    items: List[ProductBatchItem] = []
+    operation: Optional[ProductBatchOperation] = None
+
+
+class ProductBatchDelete(BaseModel):
+    ids: List[int]
+
+
+class BatchItemResult(BaseModel):
+    id: int
+    status: str = Field(..., description='"updated", "deleted", "not_found" or "error"')
+    error: Optional[str] = None
+
+
+class BatchReport(BaseModel):
+    updated: int = 0
+    deleted: int = 0
+    not_found: int = 0
+    failed: int = 0
+    results: List[BatchItemResult] = []
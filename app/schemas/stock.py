@@ -0,0 +1,49 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from datetime import datetime
+
+
+class StockAdjustment(BaseModel):
+    delta: int = Field(..., title="Delta",
+                       description="Quantity to add (positive) or remove (negative)")
+    reason: Optional[str] = Field(
+        None, title="Reason", description="Why the stock changed, e.g. sale or delivery")
+
+
+class StockBatchItem(BaseModel):
+    product_id: int
+    delta: int
+
+
+class StockBatch(BaseModel):
+    items: List[StockBatchItem]
+    reason: Optional[str] = None
+    atomic: bool = Field(
+        True, description="Apply all adjustments or none; otherwise apply those that fit")
+
+
+class StockLevel(BaseModel):
+    product_id: int
+    delta: int
+    quantity: Optional[int] = None
+    status: str = Field(
+        "adjusted", description='"adjusted", "rolled_back", "not_found" or "insufficient_stock"')
+
+
+class StockBatchReport(BaseModel):
+    committed: bool
+    adjusted: int = 0
+    failed: int = 0
+    results: List[StockLevel] = []
+
+
+class StockMovement(BaseModel):
+    id: int
+    product_id: int
+    delta: int
+    quantity_after: int
+    reason: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class ProductSuggestion(BaseModel):
+    id: int
+    name: str
+    category_id: Optional[int] = None
+
+
+class CategorySuggestion(BaseModel):
+    id: int
+    name: str
+
+
+class Suggestions(BaseModel):
+    products: List[ProductSuggestion] = []
+    categories: List[CategorySuggestion] = []
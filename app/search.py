@@ -0,0 +1,108 @@
+import re
+from sqlalchemy import DDL, event, func, literal_column, or_
+from sqlalchemy.orm import Session
+
+# Text search configuration; "simple" skips stemming and stop words, so
+# product names match by prefix exactly as they are typed
+SEARCH_CONFIG = "simple"
+
+
+def search_tokens(search_term: str) -> list:
+    """
+    Split a search term into lowercase word tokens, dropping any tsquery syntax.
+
+    :param search_term: The raw search term.
+
+    :return: The list of word tokens.
+    """
+    return re.findall(r"\w+", search_term.lower())
+
+
+def search_document(*columns):
+    """
+    Build the tsvector expression over the given text columns.
+
+    The expression is rendered with literals only, so that it matches the
+    expression index created by register_search_index on every driver.
+
+    :param columns: The columns to index, e.g. name and description.
+
+    :return: A to_tsvector(...) SQL expression.
+    """
+    document = func.coalesce(columns[0], literal_column("''"))
+    for column in columns[1:]:
+        document = document.op("||")(literal_column("' '")).op("||")(
+            func.coalesce(column, literal_column("''")))
+    return func.to_tsvector(literal_column(f"'{SEARCH_CONFIG}'"), document)
+
+
+def search_query(tokens: list):
+    """
+    Build a tsquery matching every token as a word prefix.
+
+    :param tokens: Tokens from search_tokens.
+
+    :return: A to_tsquery(...) SQL expression.
+    """
+    return func.to_tsquery(
+        literal_column(f"'{SEARCH_CONFIG}'"), " & ".join(f"{token}:*" for token in tokens))
+
+
+def apply_search(db: Session, query, search_term: str, columns: tuple, rank: bool = False):
+    """
+    Filter a select() statement by a search term over text columns.
+
+    On PostgreSQL this is a prefix full-text match served by the GIN index,
+    optionally ordered by relevance. Other backends (SQLite in tests) fall
+    back to a case-insensitive substring match.
+
+    :param db: Database session, used to detect the backend.
+    :param query: The select() statement to filter.
+    :param search_term: The raw search term.
+    :param columns: The text columns to search, in index order.
+    :param rank: Whether to order the results by relevance.
+
+    :return: The filtered statement.
+    """
+    tokens = search_tokens(search_term)
+    if db.get_bind().dialect.name == "postgresql" and tokens:
+        document = search_document(*columns)
+        ts_query = search_query(tokens)
+        query = query.where(document.op("@@")(ts_query))
+        if rank:
+            query = query.order_by(func.ts_rank(document, ts_query).desc())
+        return query
+
+    search_expr = f"%{search_term}%"
+    return query.where(or_(*(column.ilike(search_expr) for column in columns)))
+
+
+def register_search_index(table, *column_names: str):
+    """
+    Create the GIN full-text index for a table whenever the table is created on PostgreSQL.
+
+    The DDL is idempotent, so it can also be run by hand against existing databases.
+
+    :param table: The SQLAlchemy Table.
+    :param column_names: The text columns, in the same order as passed to apply_search.
+    """
+    document = " || ' ' || ".join(
+        f"coalesce({name}, '')" for name in column_names)
+    ddl = DDL(
+        f"CREATE INDEX IF NOT EXISTS ix_{table.name}_search ON {table.name} "
+        f"USING gin (to_tsvector('{SEARCH_CONFIG}', {document}))")
+    # Kept for create_search_index, as the event only fires for new tables
+    table.info["search_index"] = ddl
+    event.listen(table, "after_create", ddl.execute_if(dialect="postgresql"))
+
+
+def create_search_index(connection, table):
+    """
+    Create the full-text index registered for an existing table, on PostgreSQL.
+
+    :param connection: A sync Connection.
+    :param table: The SQLAlchemy Table, passed to register_search_index before.
+    """
+    ddl = table.info.get("search_index")
+    if ddl is not None and connection.dialect.name == "postgresql":
+        connection.execute(ddl)
@@ -1,76 +1,260 @@
 from sqlalchemy.orm import Session
 from app.models.category import Category
+from app.models.product import Product
+from app.models.category_inventory import CategoryInventory
 from app.schemas import category as category_schema
-from sqlalchemy import select, or_
+from sqlalchemy import delete, func, insert, select, update
 from fastapi_pagination.ext.sqlalchemy import paginate
-from fastapi_pagination import Page, Params
+from fastapi_pagination import Page
+from app.pagination import CursorPage, PageParams, keyset_paginate
+from app.search import apply_search
+from app.cache import EntityCache
+from app.suggest import SuggestionIndex
+from app.database import cacheable, execute_returning
+from app.replicas import replica_read
+from app.etags import PreconditionFailedError, category_etag, list_etag
+
+# Columns categories can be ordered by in cursor pagination
+CATEGORY_SORT_COLUMNS = {
+    "id": Category.id,
+    "name": Category.name,
+}
+
+
+def category_dicts(rows) -> list:
+    """
+    Items transformer turning category column rows into dicts.
+
+    :param rows: Rows of the categories table columns.
+
+    :return: The categories as dicts, shaped like the category schema.
+    """
+    return [dict(row._mapping) for row in rows]
 
 
 class CategoryService:
-    def create_category(self, db: Session, category: category_schema.CategoryCreate) -> Category:
-        # Convert Pydantic CategoryCreate model to SQLAlchemy Category model
-        db_category = Category(
-            name=category.name,
-            description=category.description,
-        )
-        # Add the SQLAlchemy Category model to the session
-        db.add(db_category)
+    def __init__(self, cache: EntityCache = None, suggestions: SuggestionIndex = None):
+        # Optional read-through cache for get_category
+        self.cache = cache
+        # Optional name index serving product suggestions, updated by the write paths
+        self.suggestions = suggestions
+
+    def create_category(self, db: Session, category: category_schema.CategoryCreate) -> category_schema.Category:
+        # insert the category and read it back in one round trip
+        rows = execute_returning(
+            db, insert(Category.__table__).values(category.dict()), select)
+        category = category_schema.Category.model_validate(rows[0], from_attributes=True)
         # Commit the transaction to save changes to the database
         db.commit()
-        # Refresh the SQLAlchemy Category model to update its state from the database
-        db.refresh(db_category)
-        # Return the SQLAlchemy Category model
-        return db_category
-
-    def update_category(self, db: Session, category_id: int, category_update: category_schema.CategoryUpdate) -> Category:
-        # get the category by id
-        db_category = self.get_category(db, category_id)
-        if db_category:
-            # Prepare a dictionary with the fields to update
-            update_data = category_update.dict(exclude_unset=True)
-            # Update the category in the database
-            db.query(Category).filter(Category.id ==
-                                      category_id).update(update_data)
-            # Commit the changes to the database
-            db.commit()
-            # Refresh the db_category object to reflect the changes from the database
-            db.refresh(db_category)
-            return db_category
-        return None
-
-    def delete_category(self, db: Session, category_id: int) -> Category:
-        # get the category by id
-        category = self.get_category(db, category_id)
-        if category:
-            # delete the category if exists
-            db.delete(category)
-            db.commit()
-            return category
-        return None
-
-    def get_category(self, db: Session, category_id: int) -> Category:
-        # filter by category id
-        return db.query(Category).filter(Category.id == category_id).first()
+        if self.suggestions is not None:
+            self.suggestions.set_category(category.id, category.name)
+        return category
+
+    def update_category(self, db: Session, category_id: int, category_update: category_schema.CategoryUpdate, expected_version: int = None) -> category_schema.Category:
+        # Prepare a dictionary with the fields to update
+        update_data = category_update.dict(exclude_unset=True)
+        # update the category, only if it is still at the expected version when
+        # one is given (If-Match), and read it back in the same round trip
+        statement = update(Category.__table__).where(
+            Category.id == category_id).values(update_data)
+        if expected_version is not None:
+            statement = statement.where(Category.version == expected_version)
+        rows = execute_returning(db, statement, select)
+        if not rows:
+            db.rollback()
+            if expected_version is not None and self.category_exists(db, category_id):
+                raise PreconditionFailedError(
+                    f"Category {category_id} is no longer at version {expected_version}")
+            return None
+        category = category_schema.Category.model_validate(rows[0], from_attributes=True)
+        # Commit the changes to the database
+        db.commit()
+        self.invalidate_category(category_id)
+        if self.suggestions is not None:
+            self.suggestions.set_category(category.id, category.name)
+        return category
+
+    def delete_category(self, db: Session, category_id: int) -> category_schema.Category:
+        # products of the category are detached from it, as the ORM cascade
+        # used to do; on backends with RETURNING this rides along in the
+        # same statement as a CTE
+        products = Product.__table__
+        detach = update(products).where(
+            products.c.category_id == category_id).values(category_id=None)
+        statement = delete(Category.__table__).where(Category.id == category_id)
+        if db.get_bind().dialect.full_returning:
+            statement = statement.add_cte(detach.cte("detached"))
+        else:
+            db.execute(detach)
+        rows = execute_returning(db, statement, select)
+        if not rows:
+            db.rollback()
+            return None
+        category = category_schema.Category.model_validate(rows[0], from_attributes=True)
+        db.commit()
+        self.invalidate_category(category_id)
+        if self.suggestions is not None:
+            self.suggestions.remove_category(category_id)
+        return category
+
+    def category_exists(self, db: Session, category_id: int) -> bool:
+        return db.execute(select(Category.id).where(
+            Category.id == category_id)).first() is not None
+
+    def load_category(self, db: Session, category_id: int) -> category_schema.Category:
+        # filter by category id, bypassing the cache
+        row = db.execute(select(*Category.__table__.c).where(
+            Category.id == category_id)).first()
+        return category_schema.Category.model_validate(row, from_attributes=True) if row is not None else None
+
+    @replica_read
+    def get_category(self, db: Session, category_id: int) -> category_schema.Category:
+        if self.cache is None:
+            return self.load_category(db, category_id)
+        # serve from the cache, loading and caching the category on a miss
+        key = f"category:{category_id}"
+        category = self.cache.get(key, category_schema.Category)
+        if category is None:
+            generation = self.cache.generation()
+            category = self.load_category(db, category_id)
+            if category is None:
+                return None
+            if cacheable(db):
+                self.cache.set(key, category, generation=generation)
+        return category
+
+    @replica_read
+    def get_categories_by_ids(self, db: Session, category_ids: list) -> dict:
+        """
+        Fetch several categories at once, from the cache and one IN query for the rest.
+
+        :param db: Database session.
+        :param category_ids: The IDs; repeated ones are returned once.
 
+        :return: {"items": the categories in the order requested, "missing": the IDs without one}.
+        """
+        category_ids = list(dict.fromkeys(category_ids))
+        categories = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(
+                [f"category:{category_id}" for category_id in category_ids], category_schema.Category)
+            categories = {category.id: category for category in cached.values()}
+        misses = [category_id for category_id in category_ids if category_id not in categories]
+        if misses:
+            generation = self.cache.generation() if self.cache is not None else None
+            rows = db.execute(select(*Category.__table__.c).where(Category.id.in_(misses))).all()
+            loaded = [category_schema.Category.model_validate(row, from_attributes=True)
+                      for row in rows]
+            categories.update((category.id, category) for category in loaded)
+            if self.cache is not None and cacheable(db):
+                self.cache.set_many([
+                    (f"category:{category.id}", category, ()) for category in loaded],
+                    generation=generation)
+        return {
+            "items": [categories[category_id] for category_id in category_ids
+                      if category_id in categories],
+            "missing": [category_id for category_id in category_ids
+                        if category_id not in categories],
+        }
+
+    def warm_cache(self, db: Session, limit: int) -> int:
+        # Load the first categories into the cache in one query; they are few
+        # and embedded in every product, so most requests need one
+        if self.cache is None or limit <= 0:
+            return 0
+        generation = self.cache.generation()
+        rows = db.execute(select(*Category.__table__.c).order_by(
+            Category.id).limit(limit)).all()
+        for row in rows:
+            self.cache.set(f"category:{row.id}", category_schema.Category.model_validate(
+                row, from_attributes=True), generation=generation)
+        return len(rows)
+
+    @replica_read
+    def get_category_etag(self, db: Session, category_id: int) -> str:
+        # answer from a cached entry when there is one, otherwise read only the version
+        if self.cache is not None:
+            category = self.cache.get(
+                f"category:{category_id}", category_schema.Category)
+            if category is not None:
+                return category_etag(category.version)
+        version = db.execute(select(Category.version).where(
+            Category.id == category_id)).scalar()
+        return category_etag(version) if version is not None else None
+
+    def invalidate_category(self, category_id: int):
+        # drop the cached category and every cached product embedding it
+        if self.cache is not None:
+            self.cache.invalidate(f"category:{category_id}")
+            self.cache.invalidate_tags(f"category:{category_id}")
+
+    def filter_categories(self, db: Session, search_term: str = None, rank: bool = False, include_counts: bool = False):
+        # query to get all, as plain column rows
+        query = select(*Category.__table__.c)
+        if include_counts:
+            # one summary row per category at most, so this cannot multiply rows
+            query = query.outerjoin(
+                CategoryInventory, CategoryInventory.category_id == Category.id).add_columns(
+                func.coalesce(CategoryInventory.product_count, 0).label("product_count"))
+        if search_term:
+            # if search_term exists -> filter by name or description
+            query = apply_search(
+                db, query, search_term, (Category.name, Category.description), rank=rank)
+        return query
+
+    @replica_read
     def get_categories(
         self,
         db: Session,
         page_number: int = 1,
         page_size: int = 10,
-        search_term: str = None
-    ) -> Page[Category]:
-        # query to get all
-        query = db.query(Category)
-        if search_term:
-            search_expr = f"%{search_term}%"
-            # if search_term exists -> filter by name or description
-            query = query.filter(
-                or_(
-                    Category.name.ilike(search_expr),
-                    Category.description.ilike(search_expr)
-                )
-            )
+        search_term: str = None,
+        include_counts: bool = False
+    ) -> Page:
+        # rank search results by relevance
+        query = self.filter_categories(
+            db, search_term, rank=True, include_counts=include_counts)
         # apply pagination
         paginated_categories = paginate(
-            query, params=Params(size=page_size, page=page_number))
+            db, query, params=PageParams(size=page_size, page=page_number),
+            transformer=category_dicts)
         return paginated_categories
+
+    @replica_read
+    def get_categories_etag(self, db: Session, search_term: str = None, include_counts: bool = False) -> str:
+        # size and max version of the filtered set, plus the version of the
+        # inventory summary when the product counts are included
+        query = self.filter_categories(db, search_term)
+        if include_counts:
+            count, max_version, inventory_version = db.execute(query.with_only_columns(
+                func.count(), func.max(Category.version),
+                select(func.max(CategoryInventory.version)).scalar_subquery())).one()
+            return list_etag("c", count, max_version, inventory_version)
+        count, max_version = db.execute(query.with_only_columns(
+            func.count(), func.max(Category.version))).one()
+        return list_etag("c", count, max_version)
+
+    @replica_read
+    def get_categories_by_cursor(
+        self,
+        db: Session,
+        cursor: str = None,
+        page_size: int = 10,
+        search_term: str = None,
+        sort_by: str = "id",
+        include_total: bool = False,
+        include_counts: bool = False
+    ) -> CursorPage:
+        query = self.filter_categories(
+            db, search_term, include_counts=include_counts)
+        # seek past the cursor on (sort key, id) instead of using an OFFSET
+        return keyset_paginate(
+            db,
+            query,
+            sort_column=CATEGORY_SORT_COLUMNS[sort_by],
+            id_column=Category.id,
+            sort_by=sort_by,
+            size=page_size,
+            cursor=cursor,
+            include_total=include_total,
+            transformer=category_dicts)
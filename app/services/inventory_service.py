@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import case, func, select
+from app.inventory import bucket_start
+from app.models.category import Category
+from app.models.category_inventory import UNCATEGORIZED, CategoryInventory
+from app.models.inventory_history import (
+    GRANULARITIES, CategoryInventoryRollup, ProductInventoryRollup)
+from app.schemas import inventory as inventory_schema
+from app.replicas import replica_read
+
+# Summary columns, missing rows (categories without products) reading as zero
+CATEGORY_STATS_COLUMNS = (
+    func.coalesce(CategoryInventory.product_count, 0).label("product_count"),
+    func.coalesce(CategoryInventory.total_units, 0).label("total_units"),
+    func.coalesce(CategoryInventory.stock_value, 0).label("stock_value"),
+    func.coalesce(CategoryInventory.out_of_stock_count, 0).label("out_of_stock_count"),
+)
+
+# Range of a trend when no start is given, per granularity
+DEFAULT_TREND_SPANS = {"hour": timedelta(days=1), "day": timedelta(days=30)}
+# Longest range served, in buckets: a month of hours or two years of days
+MAX_TREND_BUCKETS = 31 * 24
+
+PRODUCT_LEVEL_COLUMNS = tuple(
+    getattr(ProductInventoryRollup, name) for name in inventory_schema.ProductLevel.model_fields)
+CATEGORY_LEVEL_COLUMNS = tuple(
+    getattr(CategoryInventoryRollup, name) for name in inventory_schema.CategoryLevel.model_fields)
+
+
+class InvalidRangeError(ValueError):
+    """Raised when a trend range is empty, too long or has an unknown granularity."""
+
+
+def utc(moment: datetime) -> datetime:
+    # Rollup buckets are naive UTC; naive times given by clients are taken as UTC
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class InventoryService:
+    """
+    Reads of the per-category inventory summary.
+
+    The category_inventory rows are kept up to date by triggers on the
+    products table (see app.inventory), so these reads cost the same
+    whatever the size of the catalogue.
+    """
+
+    @replica_read
+    def get_category_stats(self, db: Session, category_id: int) -> inventory_schema.CategoryStats:
+        # one summary row, joined to its category to tell a missing category
+        # from one without products
+        row = db.execute(
+            select(Category.id.label("category_id"), Category.name, *CATEGORY_STATS_COLUMNS)
+            .outerjoin(CategoryInventory, CategoryInventory.category_id == Category.id)
+            .where(Category.id == category_id)).first()
+        if row is None:
+            return None
+        stats = dict(row._mapping, stock_value=round(row.stock_value, 2))
+        return inventory_schema.CategoryStats.model_validate(stats)
+
+    @replica_read
+    def get_summary(self, db: Session) -> inventory_schema.InventorySummary:
+        # totals over the summary rows, one per category with products
+        inventory = CategoryInventory
+        row = db.execute(select(
+            func.coalesce(func.sum(inventory.product_count), 0).label("product_count"),
+            func.coalesce(func.sum(inventory.total_units), 0).label("total_units"),
+            func.coalesce(func.sum(inventory.stock_value), 0).label("stock_value"),
+            func.coalesce(func.sum(inventory.out_of_stock_count), 0).label("out_of_stock_count"),
+            func.coalesce(func.sum(case(
+                (inventory.category_id == UNCATEGORIZED, inventory.product_count), else_=0)), 0
+            ).label("uncategorized_count"),
+            select(func.count()).select_from(Category).scalar_subquery().label("category_count"),
+        )).one()
+        summary = dict(row._mapping, stock_value=round(row.stock_value, 2))
+        return inventory_schema.InventorySummary.model_validate(summary)
+
+    def get_trend(self, db: Session, rollup, key_filter, columns: tuple,
+                  granularity: str, start: datetime, end: datetime) -> dict:
+        """
+        Read the rollups of one product or category over a time range.
+
+        Two index range scans over the rollup primary key: the last bucket
+        before the range, giving the level at its start, and the buckets in
+        the range, with the low and high over the range computed alongside.
+
+        :param rollup: ProductInventoryRollup or CategoryInventoryRollup.
+        :param key_filter: Condition selecting the product or category.
+        :param columns: Rollup columns of one point.
+        :param granularity: "hour" or "day".
+        :param start: Start of the range, naive or aware; defaults to a span before end.
+        :param end: End of the range, exclusive; defaults to now.
+
+        :return: The trend fields shared by products and categories.
+        """
+        if granularity not in GRANULARITIES:
+            raise InvalidRangeError(f"Unknown granularity '{granularity}'")
+        end = utc(end) or datetime.now(timezone.utc).replace(tzinfo=None)
+        start = bucket_start(utc(start) or end - DEFAULT_TREND_SPANS[granularity], granularity)
+        span = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+        if end <= start or (end - start) / span > MAX_TREND_BUCKETS:
+            raise InvalidRangeError("The range must end after it starts and span at most "
+                                    f"{MAX_TREND_BUCKETS} buckets")
+
+        in_scope = (rollup.granularity == granularity, key_filter)
+        opening = db.execute(
+            select(*columns).where(*in_scope, rollup.bucket < start)
+            .order_by(rollup.bucket.desc()).limit(1)).first()
+        rows = db.execute(
+            select(*columns,
+                   func.min(rollup.low_units).over().label("range_low"),
+                   func.max(rollup.high_units).over().label("range_high"))
+            .where(*in_scope, rollup.bucket >= start, rollup.bucket < end)
+            .order_by(rollup.bucket)).all()
+
+        # The level at the start of the range is the closing level of the
+        # last bucket before it, or nothing before the first change
+        opening_units = opening.units if opening is not None else 0
+        opening_value = opening.value if opening is not None else 0.0
+        closing = rows[-1] if rows else opening
+        closing_units = closing.units if closing is not None else 0
+        closing_value = closing.value if closing is not None else 0.0
+        low = min(rows[0].range_low, opening_units) if rows else opening_units
+        high = max(rows[0].range_high, opening_units) if rows else opening_units
+        return {
+            "granularity": granularity,
+            "start": start,
+            "end": end,
+            "opening": opening._mapping if opening is not None else None,
+            "points": [row._mapping for row in rows],
+            "summary": {
+                "opening_units": opening_units,
+                "closing_units": closing_units,
+                "units_change": closing_units - opening_units,
+                "opening_value": round(opening_value, 2),
+                "closing_value": round(closing_value, 2),
+                "value_change": round(closing_value - opening_value, 2),
+                "low_units": low,
+                "high_units": high,
+            },
+        }
+
+    @replica_read
+    def get_product_trend(self, db: Session, product_id: int, granularity: str = "hour",
+                          start: datetime = None, end: datetime = None) -> inventory_schema.ProductTrend:
+        rollup = ProductInventoryRollup
+        trend = self.get_trend(db, rollup, rollup.product_id == product_id,
+                               PRODUCT_LEVEL_COLUMNS, granularity, start, end)
+        # Every product, deleted ones included, has rollups from its creation
+        # on (or from the history migration), so none at all means unknown
+        if trend["opening"] is None and not trend["points"] and db.execute(
+                select(rollup.product_id).where(rollup.product_id == product_id).limit(1)).first() is None:
+            return None
+        return inventory_schema.ProductTrend.model_validate(dict(trend, product_id=product_id))
+
+    @replica_read
+    def get_category_trend(self, db: Session, category_id: int, granularity: str = "hour",
+                           start: datetime = None, end: datetime = None) -> inventory_schema.CategoryTrend:
+        rollup = CategoryInventoryRollup
+        trend = self.get_trend(db, rollup, rollup.category_id == category_id,
+                               CATEGORY_LEVEL_COLUMNS, granularity, start, end)
+        # Categories that never held a product have no rollups
+        if trend["opening"] is None and not trend["points"] and db.execute(
+                select(Category.id).where(Category.id == category_id)).first() is None:
+            return None
+        return inventory_schema.CategoryTrend.model_validate(dict(trend, category_id=category_id))
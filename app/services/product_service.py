@@ -1,94 +1,705 @@
-from sqlalchemy.orm import Session, selectinload
+import logging
+from sqlalchemy.orm import Session
 from app.models.product import Product
 from app.models.category import Category
+from app.models.stock_movement import StockMovement
 from app.schemas import product as product_schema
-from sqlalchemy import select, or_
+from sqlalchemy import String, bindparam, case, delete, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from fastapi_pagination.ext.sqlalchemy import paginate
-from fastapi_pagination import Page, Params
+from fastapi_pagination import Page
+from app.pagination import CursorPage, PageParams, keyset_order, keyset_paginate
+from app.search import apply_search
+from app.fields import parse_fields
+from app.cache import EntityCache
+from app.suggest import SuggestionIndex
+from app.database import cacheable, execute_returning, upsert
+from app.replicas import replica_read
+from app.etags import PreconditionFailedError, list_etag, product_etag
+
+logger = logging.getLogger("app.products")
+
+
+class DuplicateNameError(ValueError):
+    """Raised when a product is given the name of another product."""
+
+
+class CategoryNotFoundError(LookupError):
+    """Raised when a product is given a category that does not exist."""
+
+
+# Natural keys products can be upserted by in bulk imports
+PRODUCT_IMPORT_KEYS = {
+    "name": Product.__table__.c.name,
+}
+
+# Columns written by the catalogue export, in output order
+PRODUCT_EXPORT_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.description,
+    Product.price,
+    Product.quantity,
+    Product.category_id,
+    Category.name.label("category_name"),
+)
+
+# Columns products can be ordered by, each served by a (column, id) index
+# and, within a category, by a (category_id, column, id) one
+PRODUCT_SORT_COLUMNS = {
+    "id": Product.id,
+    "name": Product.name,
+    "price": Product.price,
+    "quantity": Product.quantity,
+}
+
+# Category columns embedded in the product rows returned by writes
+PRODUCT_CATEGORY_COLUMNS = tuple(
+    column.label(f"category__{column.key}") for column in Category.__table__.c)
+
+
+# Columns behind each product field, in output order, for sparse fieldsets
+PRODUCT_FIELDS = dict(
+    {column.key: (column,) for column in Product.__table__.c},
+    category=PRODUCT_CATEGORY_COLUMNS,
+)
+
+
+def category_exists(category_id: int):
+    # Condition holding when the category exists, to guard product writes with
+    return select(Category.id).where(Category.id == category_id).exists()
+
+
+def product_dict(mapping) -> dict:
+    """
+    Shape product columns, optionally with the PRODUCT_CATEGORY_COLUMNS, like the product schema.
+
+    :param mapping: Column values by key, for any subset of the PRODUCT_FIELDS columns.
+
+    :return: The product fields, with the category nested when it was selected.
+    """
+    values = {}
+    category = {}
+    for key, value in mapping.items():
+        if key.startswith("category__"):
+            category[key[len("category__"):]] = value
+        else:
+            values[key] = value
+    if category:
+        values["category"] = category if category["id"] is not None else None
+    return values
+
+
+def product_dicts(columns: list):
+    """
+    Items transformer turning the rows of a column selection into product dicts.
+
+    :param columns: The selected columns; a single one comes back unwrapped from pagination.
+
+    :return: A callable mapping a list of rows to a list of dicts.
+    """
+    keys = [column.key for column in columns]
+    if len(keys) == 1:
+        return lambda rows: [product_dict({keys[0]: value}) for value in rows]
+    return lambda rows: [product_dict(dict(zip(keys, row))) for row in rows]
+
+
+def product_from_row(row) -> product_schema.Product:
+    """
+    Build the product schema from a row selected by ProductService.written_products.
+
+    :param row: Product columns followed by the PRODUCT_CATEGORY_COLUMNS.
+
+    :return: The product with its category embedded.
+    """
+    return product_schema.Product.model_validate(product_dict(row._mapping))
 
 
 class ProductService:
-    def create_product(self, db: Session, product: product_schema.ProductCreate) -> Product:
-        # Convert Pydantic ProductCreate model to SQLAlchemy Product model
-        db_product = Product(
-            name=product.name,
-            description=product.description,
-            quantity=product.quantity,
-            price=product.price,
-            category_id=product.category_id
-        )
-        # Add the SQLAlchemy Product model to the session
-        db.add(db_product)
+    def __init__(self, cache: EntityCache = None, suggestions: SuggestionIndex = None):
+        # Optional read-through cache for get_product
+        self.cache = cache
+        # Optional name index serving suggest(), updated by the write paths
+        self.suggestions = suggestions
+
+    def create_product(self, db: Session, product: product_schema.ProductCreate) -> product_schema.Product:
+        values = product.dict()
+        table = Product.__table__
+        # Insert the product only if its category exists, and read it back
+        # with its category, in one round trip
+        statement = insert(table).from_select(list(values), select(
+            *(literal(value, table.c[name].type) for name, value in values.items())
+        ).where(category_exists(values["category_id"])))
+        try:
+            rows = execute_returning(db, statement, self.written_products)
+        except IntegrityError:
+            db.rollback()
+            self.check_name_free(db, product.name)
+            raise
+        if not rows:
+            db.rollback()
+            raise CategoryNotFoundError(f"Category {values['category_id']} does not exist")
+        product = product_from_row(rows[0])
         # Commit the transaction to save changes to the database
         db.commit()
-        # Refresh the SQLAlchemy Product model to update its state from the database
-        db.refresh(db_product)
-        # Return the SQLAlchemy Product model
-        return db_product
-
-    def update_product(self, db: Session, product_id: int, product_update: product_schema.ProductUpdate) -> Product:
-        # get the product by id
-        db_product = self.get_product(db, product_id)
-        if db_product:
-            # Prepare a dictionary with the fields to update
-            update_data = product_update.dict(exclude_unset=True)
-            # Update the product in the database
-            db.query(Product).filter(Product.id ==
-                                     product_id).update(update_data)
-            # Commit the changes to the database
+        self.index_product(product)
+        return product
+
+    def import_products(self, db: Session, products: list, upsert_on: str = None) -> dict:
+        # products is one batch of (row number, ProductCreate); the whole
+        # batch is written in a single transaction with executemany statements
+        table = Product.__table__
+        rows = [(row, product.dict()) for row, product in products]
+        errors = []
+
+        # Reject rows pointing at a missing category up front, so that one
+        # bad row does not roll back the rest of the batch
+        category_ids = {values["category_id"] for _, values in rows}
+        known_categories = set(db.execute(
+            select(Category.id).where(Category.id.in_(category_ids))).scalars())
+        for row, values in rows:
+            if values["category_id"] not in known_categories:
+                errors.append((row, "category_id", "Category Not Found"))
+        rows = [(row, values) for row, values in rows
+                if values["category_id"] in known_categories]
+
+        inserted = 0
+        updated = 0
+        written = []
+        try:
+            if upsert_on:
+                key = PRODUCT_IMPORT_KEYS[upsert_on]
+                # Group the batch by key; the last row for a key wins, as
+                # one statement cannot write the same row twice
+                by_key = {}
+                for row, values in rows:
+                    by_key.setdefault(values[key.name], []).append((row, values))
+                if by_key:
+                    existing = set(db.execute(select(key).where(key.in_(by_key))).scalars())
+                    # The database matches the keys itself, so a row inserted
+                    # by a concurrent import is updated instead of duplicated;
+                    # the counters are as of the read above
+                    db.execute(upsert(db, table, key, rows[0][1]),
+                               [group[-1][1] for group in by_key.values()])
+                    written = db.execute(
+                        select(table.c.id).where(key.in_(by_key))).scalars().all()
+                    inserted = len(by_key) - len(existing)
+                    # Earlier rows for a key are applied as updates of the final row
+                    updated = len(rows) - inserted
+            else:
+                # Reject rows whose name is taken, in the table or earlier in
+                # the batch, rather than failing the whole batch on the index
+                names = {values["name"] for _, values in rows}
+                taken = set(db.execute(
+                    select(table.c.name).where(table.c.name.in_(names))).scalars()) if names else set()
+                accepted = []
+                for row, values in rows:
+                    if values["name"] in taken:
+                        errors.append((row, "name", "Name Already Exists"))
+                    else:
+                        taken.add(values["name"])
+                        accepted.append((row, values))
+                if accepted:
+                    db.execute(insert(table), [values for _, values in accepted])
+                inserted = len(accepted)
             db.commit()
-            # Refresh the db_product object to reflect the changes from the database
-            db.refresh(db_product)
-            return db_product
-        return None
-
-    def delete_product(self, db: Session, product_id: int) -> Product:
-        # get the product by id
-        product = self.get_product(db, product_id)
-        if product:
-            # delete if product exists
-            db.delete(product)
+        except SQLAlchemyError as e:
+            db.rollback()
+            # The batch is all or nothing: report every remaining row as failed
+            message = f"Database Error: {getattr(e, 'orig', None) or e}"
+            failed_rows = {row for row, _, _ in errors}
+            errors.extend((row, None, message) for row, _ in products
+                          if row not in failed_rows)
+            return {"inserted": 0, "updated": 0, "errors": errors}
+
+        # The batch is saved whatever happens next; a failure here only leaves
+        # the cache and the suggestions to catch up by their TTL and refresh
+        try:
+            self.invalidate_product(*written)
+            # The inserted ids are not returned by executemany; pick the new
+            # rows up by their versions
+            if self.suggestions is not None:
+                self.suggestions.refresh(db)
+        except Exception:
+            db.rollback()
+            logger.exception("Refreshing the cache and suggestions after an import failed")
+        return {"inserted": inserted, "updated": updated, "errors": errors}
+
+    def update_product(self, db: Session, product_id: int, product_update: product_schema.ProductUpdate, expected_version: int = None) -> product_schema.Product:
+        # Prepare a dictionary with the fields to update
+        update_data = product_update.dict(exclude_unset=True)
+        # Update the product, only if it is still at the expected version when
+        # one is given (If-Match) and its new category exists, and read it
+        # back in the same round trip
+        statement = update(Product.__table__).where(
+            Product.id == product_id).values(update_data)
+        if expected_version is not None:
+            statement = statement.where(Product.version == expected_version)
+        if "category_id" in update_data:
+            statement = statement.where(category_exists(update_data["category_id"]))
+        try:
+            rows = execute_returning(db, statement, self.written_products)
+        except IntegrityError:
+            db.rollback()
+            self.check_name_free(db, update_data.get("name"), product_id)
+            raise
+        if not rows:
+            db.rollback()
+            if not self.product_exists(db, product_id):
+                return None
+            if "category_id" in update_data and not db.execute(
+                    select(category_exists(update_data["category_id"]))).scalar():
+                raise CategoryNotFoundError(
+                    f"Category {update_data['category_id']} does not exist")
+            raise PreconditionFailedError(
+                f"Product {product_id} is no longer at version {expected_version}")
+        product = product_from_row(rows[0])
+        # Commit the changes to the database
+        db.commit()
+        self.invalidate_product(product_id)
+        self.index_product(product)
+        return product
+
+    def delete_product(self, db: Session, product_id: int) -> product_schema.Product:
+        # Delete the product and return it with its category in one round trip
+        rows = execute_returning(
+            db, delete(Product.__table__).where(Product.id == product_id), self.written_products)
+        if not rows:
+            return None
+        product = product_from_row(rows[0])
+        db.commit()
+        self.invalidate_product(product_id)
+        if self.suggestions is not None:
+            self.suggestions.remove_product(product_id)
+        return product
+
+    def update_products(self, db: Session, items: list, operation: product_schema.ProductBatchOperation = None) -> dict:
+        # items are per-id partial updates and operation is one set-based
+        # change; everything is written in a single transaction
+        table = Product.__table__
+        results = {}
+        items = list({item.id: item for item in items}.values())
+
+        # Look up the requested products and categories once, up front
+        changes = [item.dict(exclude_unset=True, exclude={"id"}) for item in items]
+        target_category = operation.set.category_id if operation and operation.set else None
+        category_ids = {values["category_id"] for values in changes if "category_id" in values}
+        if target_category is not None:
+            category_ids.add(target_category)
+        known_categories = set(db.execute(select(Category.id).where(
+            Category.id.in_(category_ids))).scalars()) if category_ids else set()
+        existing = set(db.execute(select(table.c.id).where(
+            table.c.id.in_([item.id for item in items]))).scalars()) if items else set()
+
+        # Group the valid items by the fields they set, one executemany per group
+        groups = {}
+        for item, values in zip(items, changes):
+            if item.id not in existing:
+                results[item.id] = ("not_found", None)
+            elif "category_id" in values and values["category_id"] not in known_categories:
+                results[item.id] = ("error", "Category Not Found")
+            else:
+                results[item.id] = ("updated", None)
+                if values:
+                    groups.setdefault(tuple(sorted(values)), []).append(
+                        dict({f"v_{name}": value for name, value in values.items()}, k_id=item.id))
+
+        operation_ids = set()
+        try:
+            for fields, parameters in groups.items():
+                db.execute(
+                    update(table).where(table.c.id == bindparam("k_id")).values(
+                        {name: bindparam(f"v_{name}") for name in fields}),
+                    parameters)
+
+            if operation is not None:
+                statement = update(table)
+                if operation.ids is not None:
+                    statement = statement.where(table.c.id.in_(operation.ids))
+                if operation.category_id is not None:
+                    statement = statement.where(
+                        table.c.category_id == operation.category_id)
+                values = operation.set.dict(exclude_unset=True) if operation.set else {}
+                if operation.price_factor is not None:
+                    values["price"] = table.c.price * operation.price_factor
+                if operation.price_delta is not None:
+                    values["price"] = values.get(
+                        "price", table.c.price) + operation.price_delta
+                if operation.quantity_delta is not None:
+                    values["quantity"] = table.c.quantity + operation.quantity_delta
+
+                if target_category is not None and target_category not in known_categories:
+                    matched = db.execute(
+                        select(table.c.id).where(statement.whereclause)).scalars()
+                    results.update((product_id, ("error", "Category Not Found"))
+                                   for product_id in matched)
+                else:
+                    rows = execute_returning(
+                        db, statement.values(values), lambda written: select(written.c.id))
+                    operation_ids = {row.id for row in rows}
+                    results.update((product_id, ("updated", None))
+                                   for product_id in sorted(operation_ids))
+                for product_id in operation.ids or ():
+                    results.setdefault(product_id, ("not_found", None))
             db.commit()
-            return product
-        return None
+        except SQLAlchemyError as e:
+            db.rollback()
+            # The batch is all or nothing: report every product as failed
+            message = f"Database Error: {getattr(e, 'orig', None) or e}"
+            results = {product_id: ("error", message) for product_id in results}
 
-    def get_product(self, db: Session, product_id: int) -> Product:
-        # filter by product id
-        return db.query(Product).filter(Product.id == product_id).first()
+        updated = [product_id for product_id, (status, _) in results.items()
+                   if status == "updated"]
+        self.invalidate_product(*updated)
+        if self.suggestions is not None:
+            # Fields written per item, then by the operation, which ran last
+            written = {item.id: dict(values) for item, values in zip(items, changes)}
+            if operation is not None and operation.set is not None:
+                operation_values = operation.set.dict(exclude_unset=True)
+                for product_id in operation_ids:
+                    written.setdefault(product_id, {}).update(operation_values)
+            for product_id in updated:
+                self.suggestions.update_product(product_id, written.get(product_id, {}))
+        return self.batch_report(results)
 
-    def get_products(
+    def delete_products(self, db: Session, product_ids: list) -> dict:
+        # Delete every listed product in one statement, reporting the missing ones
+        rows = execute_returning(
+            db, delete(Product.__table__).where(Product.id.in_(product_ids)),
+            lambda written: select(written.c.id))
+        db.commit()
+        deleted = {row.id for row in rows}
+        self.invalidate_product(*deleted)
+        if self.suggestions is not None:
+            self.suggestions.remove_product(*deleted)
+        return self.batch_report({
+            product_id: ("deleted" if product_id in deleted else "not_found", None)
+            for product_id in product_ids})
+
+    def batch_report(self, results: dict) -> dict:
+        # Shape per-id (status, error) outcomes like the BatchReport schema
+        report = {"updated": 0, "deleted": 0, "not_found": 0, "failed": 0, "results": []}
+        for product_id, (status, error) in results.items():
+            report["failed" if status == "error" else status] += 1
+            report["results"].append(
+                {"id": product_id, "status": status, "error": error})
+        return report
+
+    def adjust_stock(self, db: Session, adjustments: list, reason: str = None, atomic: bool = True) -> dict:
+        # adjustments is a list of (product_id, delta); deltas of the same
+        # product are summed so each product is updated once
+        deltas = {}
+        for product_id, delta in adjustments:
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+        products = Product.__table__
+        movements = StockMovement.__table__
+
+        # One conditional UPDATE for every product: a concurrent adjustment of
+        # the same row waits for its lock and re-checks the condition against
+        # the committed quantity, so no update is lost and stock never goes
+        # negative, without any application-level locking
+        quantity = func.coalesce(products.c.quantity, 0)
+        delta = case(deltas, value=products.c.id)
+        statement = update(products).where(products.c.id.in_(deltas)).where(
+            quantity + delta >= 0).values(quantity=quantity + delta)
+        if len(deltas) > 1:
+            # Lock the rows in id order first, so two baskets sharing products
+            # cannot deadlock by locking them in opposite orders
+            locked = select(products.c.id).where(products.c.id.in_(deltas)).order_by(
+                products.c.id).with_for_update().cte("locked")
+            statement = statement.where(products.c.id.in_(select(locked.c.id)))
+        if db.get_bind().dialect.full_returning:
+            # Record the ledger rows from the UPDATE's RETURNING in the same statement
+            adjusted = statement.returning(
+                products.c.id, products.c.quantity).cte("adjusted")
+            rows = db.execute(insert(movements).from_select(
+                ["product_id", "delta", "quantity_after", "reason"],
+                select(adjusted.c.id, case(deltas, value=adjusted.c.id),
+                       adjusted.c.quantity, literal(reason, String))
+            ).returning(movements.c.product_id, movements.c.quantity_after)).all()
+        else:
+            rows = execute_returning(db, statement, lambda written: select(
+                written.c.id.label("product_id"), written.c.quantity.label("quantity_after")))
+            if rows:
+                db.execute(insert(movements), [
+                    {"product_id": row.product_id, "delta": deltas[row.product_id],
+                     "quantity_after": row.quantity_after, "reason": reason}
+                    for row in rows])
+
+        quantities = {row.product_id: row.quantity_after for row in rows}
+        failed = [product_id for product_id in deltas if product_id not in quantities]
+        existing = set(db.execute(select(products.c.id).where(
+            products.c.id.in_(failed))).scalars()) if failed else set()
+        committed = not (failed and atomic)
+        if committed:
+            db.commit()
+            self.invalidate_product(*quantities)
+        else:
+            db.rollback()
+
+        results = []
+        for product_id, delta in deltas.items():
+            if product_id in quantities:
+                status = "adjusted" if committed else "rolled_back"
+            else:
+                status = "insufficient_stock" if product_id in existing else "not_found"
+            results.append({"product_id": product_id, "delta": delta, "status": status,
+                            "quantity": quantities.get(product_id) if committed else None})
+        return {"committed": committed, "adjusted": len(quantities) if committed else 0,
+                "failed": len(failed), "results": results}
+
+    def get_stock_movements(self, db: Session, product_id: int, cursor: str = None, page_size: int = 10) -> CursorPage:
+        # Ledger of one product, oldest first
+        return keyset_paginate(
+            db,
+            select(StockMovement).where(StockMovement.product_id == product_id),
+            sort_column=StockMovement.id,
+            id_column=StockMovement.id,
+            sort_by="id",
+            size=page_size,
+            cursor=cursor)
+
+    def written_products(self, source):
+        # Rows written by execute_returning, with the category columns embedded
+        return select(source, *PRODUCT_CATEGORY_COLUMNS).outerjoin(
+            Category.__table__, source.c.category_id == Category.__table__.c.id)
+
+    def check_name_free(self, db: Session, name: str, product_id: int = None):
+        # Tell a write rejected by the unique name index from other integrity errors
+        if name is None:
+            return
+        query = select(Product.id).where(Product.name == name)
+        if product_id is not None:
+            query = query.where(Product.id != product_id)
+        if db.execute(query.limit(1)).first() is not None:
+            raise DuplicateNameError(f"A product named {name!r} already exists")
+
+    def product_exists(self, db: Session, product_id: int) -> bool:
+        return db.execute(select(Product.id).where(
+            Product.id == product_id)).first() is not None
+
+    def load_product(self, db: Session, product_id: int) -> product_schema.Product:
+        # filter by product id, selecting the category columns in the same
+        # query and bypassing the cache
+        row = db.execute(self.filter_products(db).with_only_columns(
+            *parse_fields(None, PRODUCT_FIELDS)).where(Product.id == product_id)).first()
+        return product_from_row(row) if row is not None else None
+
+    @replica_read
+    def get_product(self, db: Session, product_id: int) -> product_schema.Product:
+        if self.cache is None:
+            return self.load_product(db, product_id)
+        # Serve from the cache, loading and caching the product on a miss; the
+        # entry is tagged with its category so category writes can drop it
+        key = f"product:{product_id}"
+        product = self.cache.get(key, product_schema.Product)
+        if product is None:
+            generation = self.cache.generation()
+            product = self.load_product(db, product_id)
+            if product is None:
+                return None
+            if cacheable(db):
+                self.cache.set(key, product, tags=(
+                    f"category:{product.category_id}",), generation=generation)
+        return product
+
+    @replica_read
+    def get_products_by_ids(self, db: Session, product_ids: list) -> dict:
+        """
+        Fetch several products at once, from the cache and one IN query for the rest.
+
+        :param db: Database session.
+        :param product_ids: The IDs; repeated ones are returned once.
+
+        :return: {"items": the products in the order requested, "missing": the IDs without one}.
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        products = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(
+                [f"product:{product_id}" for product_id in product_ids], product_schema.Product)
+            products = {product.id: product for product in cached.values()}
+        misses = [product_id for product_id in product_ids if product_id not in products]
+        if misses:
+            generation = self.cache.generation() if self.cache is not None else None
+            rows = db.execute(self.filter_products(db).with_only_columns(
+                *parse_fields(None, PRODUCT_FIELDS)).where(Product.id.in_(misses))).all()
+            loaded = [product_from_row(row) for row in rows]
+            products.update((product.id, product) for product in loaded)
+            if self.cache is not None and cacheable(db):
+                self.cache.set_many([
+                    (f"product:{product.id}", product, (f"category:{product.category_id}",))
+                    for product in loaded], generation=generation)
+        return {
+            "items": [products[product_id] for product_id in product_ids if product_id in products],
+            "missing": [product_id for product_id in product_ids if product_id not in products],
+        }
+
+    @replica_read
+    def get_product_etag(self, db: Session, product_id: int) -> str:
+        # Answer from a cached entry when there is one, otherwise read only
+        # the two version columns instead of the whole product
+        if self.cache is not None:
+            product = self.cache.get(
+                f"product:{product_id}", product_schema.Product)
+            if product is not None:
+                return product_etag(product.version, product.category.version)
+        versions = db.execute(
+            select(Product.version, Category.version)
+            .join(Category, Product.category_id == Category.id)
+            .where(Product.id == product_id)).first()
+        return product_etag(*versions) if versions else None
+
+    def index_product(self, product: product_schema.Product):
+        # Keep the suggestion index in step with a written product
+        if self.suggestions is not None:
+            self.suggestions.set_product(product.id, product.name, product.category_id)
+
+    def invalidate_product(self, *product_ids: int):
+        # Drop cached entries of products that were written
+        if self.cache is not None and product_ids:
+            self.cache.invalidate(
+                *(f"product:{product_id}" for product_id in product_ids))
+
+    def filter_products(
         self,
         db: Session,
-        page_number: int = 1,
-        page_size: int = 10,
         search_term: str = None,
-        category_id: int = None
-    ) -> Page[Product]:
-        # Start with a base query
-        query = db.query(Product)
+        category_id: int = None,
+        rank: bool = False,
+        min_price: float = None,
+        max_price: float = None,
+        min_quantity: int = None,
+        max_quantity: int = None
+    ):
+        # Start with a base query; a select() statement keeps loader options
+        # added by the callers when it is executed through Session.execute()
+        query = select(Product)
 
         # Include the Category table and select the name field as category_name
         query = query.join(Category, Product.category_id == Category.id)
 
-        # Apply eager loading for the Category relationship
-        query = query.options(selectinload(Product.category))
-
         # Apply search filter if search_term provided
         if search_term:
-            search_expr = f"%{search_term}%"
-            query = query.filter(
-                or_(
-                    Product.name.ilike(search_expr),
-                    Product.description.ilike(search_expr)
-                )
-            )
+            query = apply_search(
+                db, query, search_term, (Product.name, Product.description), rank=rank)
 
         # Apply category filter if category_id provided
         if category_id is not None:
-            query = query.filter(Product.category_id == category_id)
+            query = query.where(Product.category_id == category_id)
+
+        # Apply the inclusive price and quantity ranges, open on a missing bound
+        for column, low, high in (
+                (Product.price, min_price, max_price),
+                (Product.quantity, min_quantity, max_quantity)):
+            if low is not None:
+                query = query.where(column >= low)
+            if high is not None:
+                query = query.where(column <= high)
 
-        # Apply pagination
+        return query
+
+    @replica_read
+    def get_products(
+        self,
+        db: Session,
+        page_number: int = 1,
+        page_size: int = 10,
+        search_term: str = None,
+        category_id: int = None,
+        fields: str = None,
+        sort_by: str = None,
+        descending: bool = False,
+        min_price: float = None,
+        max_price: float = None,
+        min_quantity: int = None,
+        max_quantity: int = None
+    ) -> Page:
+        # Rank search results by relevance unless a sort key was asked for
+        query = self.filter_products(
+            db, search_term, category_id, rank=sort_by is None,
+            min_price=min_price, max_price=max_price,
+            min_quantity=min_quantity, max_quantity=max_quantity)
+
+        # Select plain columns, the category's from the join already there,
+        # and shape the rows into dicts without hydrating ORM objects
+        columns = parse_fields(fields, PRODUCT_FIELDS)
+        query = query.with_only_columns(*columns)
+
+        # Order by the sort key and the id, so that pages neither overlap
+        # nor skip rows; after the relevance, when searching
+        sort_column = PRODUCT_SORT_COLUMNS[sort_by or "id"]
+        query = query.order_by(*keyset_order(sort_column, Product.id, descending))
+
+        # Apply pagination, counting over the same join without a subquery
         paginated_products = paginate(
-            db, query, params=Params(size=page_size, page=page_number))
+            db, query, params=PageParams(size=page_size, page=page_number),
+            subquery_count=False, transformer=product_dicts(columns))
 
         return paginated_products
+
+    @replica_read
+    def get_products_etag(
+        self,
+        db: Session,
+        search_term: str = None,
+        category_id: int = None,
+        min_price: float = None,
+        max_price: float = None,
+        min_quantity: int = None,
+        max_quantity: int = None
+    ) -> str:
+        # Size and max versions of the filtered set; any insert, update or
+        # delete within it (or of an embedded category) changes the result
+        query = self.filter_products(
+            db, search_term, category_id,
+            min_price=min_price, max_price=max_price,
+            min_quantity=min_quantity, max_quantity=max_quantity)
+        count, max_version, max_category_version = db.execute(query.with_only_columns(
+            func.count(), func.max(Product.version), func.max(Category.version))).one()
+        return list_etag("p", count, max_version, max_category_version)
+
+    @replica_read
+    def get_products_by_cursor(
+        self,
+        db: Session,
+        cursor: str = None,
+        page_size: int = 10,
+        search_term: str = None,
+        category_id: int = None,
+        sort_by: str = "id",
+        include_total: bool = False,
+        fields: str = None,
+        descending: bool = False,
+        min_price: float = None,
+        max_price: float = None,
+        min_quantity: int = None,
+        max_quantity: int = None
+    ) -> CursorPage:
+        query = self.filter_products(
+            db, search_term, category_id,
+            min_price=min_price, max_price=max_price,
+            min_quantity=min_quantity, max_quantity=max_quantity)
+        # The sort key is needed to build the next cursor
+        columns = parse_fields(
+            fields, PRODUCT_FIELDS, required=("id", sort_by))
+        query = query.with_only_columns(*columns)
+
+        # Seek past the cursor on (sort key, id) instead of using an OFFSET
+        return keyset_paginate(
+            db,
+            query,
+            sort_column=PRODUCT_SORT_COLUMNS[sort_by],
+            id_column=Product.id,
+            sort_by=sort_by,
+            size=page_size,
+            cursor=cursor,
+            include_total=include_total,
+            transformer=product_dicts(columns),
+            descending=descending)
+
+    def export_products_query(self, db: Session, search_term: str = None, category_id: int = None):
+        # Plain column rows in id order: nothing is hydrated or eager-loaded
+        # per row, so the result can be streamed from a server-side cursor
+        query = self.filter_products(db, search_term, category_id)
+        return query.with_only_columns(*PRODUCT_EXPORT_COLUMNS).order_by(Product.id)
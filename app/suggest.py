@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.config import SUGGEST_ENABLED, SUGGEST_REFRESH_OVERLAP
+from app.database import run_in_new_session
+from app.models.category import Category
+from app.models.product import Product
+from app.search import search_tokens
+
+logger = logging.getLogger("app.suggest")
+
+# Rows fetched per round trip while building the index
+BUILD_BATCH = 10000
+# Candidates of a multi-word lookup checked one by one before switching to
+# intersecting the ids of every word, cheaper when few candidates match
+VERIFIED_CANDIDATES = 100
+# Versions re-read below the highest one seen by a refresh. A write draws
+# its version from the table's sequence before it commits, so a write can
+# commit a version lower than one a refresh already saw. It is still read as
+# long as fewer than this many versions of its table are drawn between its
+# write and its commit; an import draws one per row. SQLite commits one
+# write at a time, so there versions always commit in order
+REFRESH_OVERLAP = SUGGEST_REFRESH_OVERLAP
+
+
+class PrefixIndex:
+    """
+    Sorted (token, id) pairs, answering prefix lookups with bisects.
+
+    The pairs are split into blocks of at most 2 * BLOCK_SIZE, each two
+    parallel arrays ordered by token, then id, as in sortedcontainers: an
+    insert or removal shifts one block instead of the whole index, so it
+    stays in the microseconds with millions of entries.
+    """
+
+    BLOCK_SIZE = 1000
+
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs)
+        self.blocks = []
+        # Last pair of each block, to find the block holding a pair
+        self.maxes = []
+        for start in range(0, len(pairs), self.BLOCK_SIZE):
+            chunk = pairs[start:start + self.BLOCK_SIZE]
+            self.blocks.append(([token for token, _ in chunk],
+                                array("q", (entity_id for _, entity_id in chunk))))
+            self.maxes.append(chunk[-1])
+        self.size = len(pairs)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _locate(self, token: str, entity_id: int) -> tuple:
+        # Block and position within it where the pair is or would go
+        block = min(bisect_left(self.maxes, (token, entity_id)), len(self.blocks) - 1)
+        tokens, ids = self.blocks[block]
+        lo = bisect_left(tokens, token)
+        hi = bisect_right(tokens, token, lo)
+        return block, bisect_left(ids, entity_id, lo, hi)
+
+    def add(self, token: str, entity_id: int):
+        if not self.blocks:
+            self.blocks.append(([token], array("q", [entity_id])))
+            self.maxes.append((token, entity_id))
+            self.size = 1
+            return
+        block, index = self._locate(token, entity_id)
+        tokens, ids = self.blocks[block]
+        if index < len(tokens) and tokens[index] == token and ids[index] == entity_id:
+            return
+        tokens.insert(index, token)
+        ids.insert(index, entity_id)
+        self.maxes[block] = (tokens[-1], ids[-1])
+        self.size += 1
+        if len(tokens) > 2 * self.BLOCK_SIZE:
+            # Split the block in two halves
+            half = self.BLOCK_SIZE
+            self.blocks[block:block + 1] = [(tokens[:half], ids[:half]), (tokens[half:], ids[half:])]
+            self.maxes[block:block + 1] = [(tokens[half - 1], ids[half - 1]), (tokens[-1], ids[-1])]
+
+    def remove(self, token: str, entity_id: int):
+        if not self.blocks:
+            return
+        block, index = self._locate(token, entity_id)
+        tokens, ids = self.blocks[block]
+        if index >= len(tokens) or tokens[index] != token or ids[index] != entity_id:
+            return
+        del tokens[index]
+        del ids[index]
+        self.size -= 1
+        if tokens:
+            self.maxes[block] = (tokens[-1], ids[-1])
+        else:
+            del self.blocks[block]
+            del self.maxes[block]
+
+    def _ranges(self, prefix: str):
+        # (block, start, stop) of the tokens starting with prefix, all of
+        # which sort below prefix + U+10FFFF
+        end = prefix + "\U0010ffff"
+        first = bisect_left(self.maxes, (prefix,))
+        last = min(bisect_left(self.maxes, (end,)), len(self.blocks) - 1)
+        for block in range(first, last + 1):
+            tokens = self.blocks[block][0]
+            start = bisect_left(tokens, prefix) if block == first else 0
+            yield block, start, bisect_left(tokens, end, start)
+
+    def count(self, prefix: str) -> int:
+        """Count the tokens starting with prefix, from the bisect positions of the range ends."""
+        return sum(stop - start for _, start, stop in self._ranges(prefix))
+
+    def ids_with(self, prefix: str) -> set:
+        """Collect the ids of the tokens starting with prefix, slicing whole ranges at once."""
+        found = set()
+        for block, start, stop in self._ranges(prefix):
+            found.update(self.blocks[block][1][start:stop])
+        return found
+
+    def ids_of(self):
+        """Yield every id, in token order; an id may repeat."""
+        for _, ids in self.blocks:
+            yield from ids
+
+    def search(self, prefix: str):
+        """Yield the ids of the tokens starting with prefix, in token order; an id may repeat."""
+        # (prefix,) sorts before every pair whose token is prefix or longer
+        for block in range(bisect_left(self.maxes, (prefix,)), len(self.blocks)):
+            tokens, ids = self.blocks[block]
+            for index in range(bisect_left(tokens, prefix), len(tokens)):
+                if not tokens[index].startswith(prefix):
+                    return
+                yield ids[index]
+
+
+def name_tokens(name: str) -> tuple:
+    # Distinct words of a name, interned so that equal words of different
+    # names share one string
+    return tuple(sorted({sys.intern(token) for token in search_tokens(name or "")}))
+
+
+class SuggestionIndex:
+    """
+    In-memory prefix index over product and category names, for typeahead.
+
+    Every word of a name is indexed, so "cro" suggests "Almond Croissant".
+    Products are indexed once for the whole catalogue and once for their
+    category, so a lookup scoped to a category never skips other categories'
+    products. The service write paths update the index after they commit;
+    refresh() catches up with writes made by other processes.
+    """
+
+    def __init__(self):
+        # id -> (name, category_id) and id -> name
+        self.products = {}
+        self.categories = {}
+        self.product_tokens = {None: PrefixIndex()}
+        self.category_tokens = PrefixIndex()
+        self.version = {"products": 0, "categories": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.products) + len(self.categories)
+
+    def build(self, db: Session) -> int:
+        """
+        Load every product and category name, replacing the index contents.
+
+        :param db: Database session.
+
+        :return: The number of names indexed.
+        """
+        products = {}
+        categories = {}
+        version = {"products": 0, "categories": 0}
+        # Pairs of every scope, sorted once each instead of inserted one by one
+        scopes = {None: []}
+        category_pairs = []
+        for row in db.execute(select(Category.id, Category.name, Category.version)):
+            categories[row.id] = row.name
+            category_pairs.extend((token, row.id) for token in name_tokens(row.name))
+            version["categories"] = max(version["categories"], row.version)
+        result = db.execute(
+            select(Product.id, Product.name, Product.category_id, Product.version)
+            .execution_options(yield_per=BUILD_BATCH))
+        everything = scopes[None]
+        for product_id, name, category_id, product_version in result:
+            products[product_id] = (name, category_id)
+            pairs = [(token, product_id) for token in name_tokens(name)]
+            everything.extend(pairs)
+            if category_id is not None:
+                scopes.setdefault(category_id, []).extend(pairs)
+            if product_version > version["products"]:
+                version["products"] = product_version
+        product_tokens = {scope: PrefixIndex(pairs) for scope, pairs in scopes.items()}
+        category_tokens = PrefixIndex(category_pairs)
+
+        with self._lock:
+            self.products = products
+            self.categories = categories
+            self.product_tokens = product_tokens
+            self.category_tokens = category_tokens
+            self.version = version
+        return len(products) + len(categories)
+
+    def refresh(self, db: Session) -> int:
+        """
+        Index the products and categories written since the last build or refresh.
+
+        Reads the rows whose version is above the highest seen, less
+        REFRESH_OVERLAP, through the version indexes; rows already indexed
+        as they are cost a dict lookup. A write that commits after more than
+        REFRESH_OVERLAP later versions of its table is missed until the next
+        build, as are deletes made by other processes.
+
+        :param db: Database session.
+
+        :return: The number of rows read.
+        """
+        with self._lock:
+            since = dict(self.version)
+        categories = db.execute(
+            select(Category.id, Category.name, Category.version)
+            .where(Category.version > since["categories"] - REFRESH_OVERLAP)).all()
+        products = db.execute(
+            select(Product.id, Product.name, Product.category_id, Product.version)
+            .where(Product.version > since["products"] - REFRESH_OVERLAP)).all()
+        with self._lock:
+            for row in categories:
+                self._set_category(row.id, row.name)
+                self.version["categories"] = max(self.version["categories"], row.version)
+            for row in products:
+                self._set_product(row.id, row.name, row.category_id)
+                self.version["products"] = max(self.version["products"], row.version)
+        return len(categories) + len(products)
+
+    def set_product(self, product_id: int, name: str, category_id: int):
+        """Index a created or updated product under its current name and category."""
+        with self._lock:
+            self._set_product(product_id, name, category_id)
+
+    def update_product(self, product_id: int, values: dict):
+        """Apply a partial update to an indexed product, e.g. {"category_id": 2}."""
+        with self._lock:
+            current = self.products.get(product_id)
+            if current is None:
+                return
+            self._set_product(product_id, values.get("name", current[0]),
+                              values.get("category_id", current[1]))
+
+    def remove_product(self, *product_ids: int):
+        with self._lock:
+            for product_id in product_ids:
+                self._remove_product(product_id)
+
+    def set_category(self, category_id: int, name: str):
+        with self._lock:
+            self._set_category(category_id, name)
+
+    def remove_category(self, category_id: int):
+        """Drop a deleted category; its products stay indexed, without a category."""
+        with self._lock:
+            name = self.categories.pop(category_id, None)
+            if name is not None:
+                for token in name_tokens(name):
+                    self.category_tokens.remove(token, category_id)
+            scope = self.product_tokens.pop(category_id, None)
+            if scope is not None:
+                for product_id in set(scope.ids_of()):
+                    self.products[product_id] = (self.products[product_id][0], None)
+
+    def suggest(self, query: str, category_id: int = None, limit: int = 10) -> dict:
+        """
+        Find the products and categories with words starting with every word of a query.
+
+        :param query: The text typed so far, e.g. "choc cro".
+        :param category_id: Only suggest products of this category, and no categories.
+        :param limit: Most suggestions of each kind.
+
+        :return: {"products": [...], "categories": [...]}, in alphabetical order of the matched word.
+        """
+        tokens = search_tokens(query)
+        if not tokens:
+            return {"products": [], "categories": []}
+        with self._lock:
+            scope = self.product_tokens.get(category_id)
+            products = [] if scope is None else [
+                {"id": product_id, "name": self.products[product_id][0],
+                 "category_id": self.products[product_id][1]}
+                for product_id in self._matches(
+                    scope, lambda product_id: self.products[product_id][0], tokens, limit)]
+            categories = [] if category_id is not None else [
+                {"id": match, "name": self.categories[match]}
+                for match in self._matches(
+                    self.category_tokens, self.categories.get, tokens, limit)]
+        return {"products": products, "categories": categories}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "products": len(self.products),
+                "categories": len(self.categories),
+                "product_tokens": len(self.product_tokens[None]),
+                "category_tokens": len(self.category_tokens),
+            }
+
+    def _matches(self, index: PrefixIndex, name_of, tokens: list, limit: int) -> list:
+        # Caller holds the lock. Scans the word with the fewest matches, in
+        # order, keeping the ids whose names match every other word too
+        others = None
+        if len(tokens) > 1:
+            tokens = sorted(tokens, key=index.count)
+            others = tokens[1:]
+        allowed = None
+        found = []
+        seen = set()
+        for entity_id in index.search(tokens[0]):
+            if entity_id in seen:
+                continue
+            seen.add(entity_id)
+            if others is not None:
+                if allowed is None and len(seen) > VERIFIED_CANDIDATES:
+                    # Sparse matches: intersect the ids of every word once
+                    # instead of checking the words of each remaining candidate
+                    allowed = set.intersection(*(index.ids_with(token) for token in tokens))
+                    if not allowed:
+                        break
+                if allowed is not None:
+                    if entity_id not in allowed:
+                        continue
+                else:
+                    words = name_tokens(name_of(entity_id))
+                    if not all(any(word.startswith(token) for word in words) for token in others):
+                        continue
+            found.append(entity_id)
+            if len(found) == limit or (allowed is not None and len(found) == len(allowed)):
+                break
+        return found
+
+    def _set_product(self, product_id: int, name: str, category_id: int):
+        if self.products.get(product_id) == (name, category_id):
+            return
+        self._remove_product(product_id)
+        self.products[product_id] = (name, category_id)
+        scopes = [self.product_tokens[None]]
+        if category_id is not None:
+            scopes.append(self.product_tokens.setdefault(category_id, PrefixIndex()))
+        for token in name_tokens(name):
+            for scope in scopes:
+                scope.add(token, product_id)
+
+    def _remove_product(self, product_id: int):
+        current = self.products.pop(product_id, None)
+        if current is None:
+            return
+        name, category_id = current
+        scopes = [self.product_tokens[None], self.product_tokens.get(category_id)]
+        for token in name_tokens(name):
+            for scope in scopes:
+                if scope is not None:
+                    scope.remove(token, product_id)
+
+    def _set_category(self, category_id: int, name: str):
+        current = self.categories.get(category_id)
+        if current == name:
+            return
+        if current is not None:
+            for token in name_tokens(current):
+                self.category_tokens.remove(token, category_id)
+        self.categories[category_id] = name
+        for token in name_tokens(name):
+            self.category_tokens.add(token, category_id)
+
+
+suggestion_index = SuggestionIndex() if SUGGEST_ENABLED else None
+
+
+async def refresh_periodically(index: SuggestionIndex, interval: float):
+    """
+    Catch the index up with the writes of other processes every interval seconds.
+
+    Runs until cancelled, at shutdown; a failed refresh is logged and retried
+    at the next interval.
+
+    :param index: The suggestion index of this process.
+    :param interval: Seconds between refreshes.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_new_session(index.refresh)
+        except Exception:
+            logger.exception("Suggestion index refresh failed")
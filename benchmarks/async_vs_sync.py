@@ -0,0 +1,114 @@
+"""
+Compare requests/sec of the sync and async database modes.
+
+Starts the application under uvicorn once per mode (DB_ASYNC=0 and
+DB_ASYNC=1) against the database configured in the environment, then drives
+it with many concurrent clients and prints the results as JSON.
+
+Usage:
+    python -m benchmarks.async_vs_sync --clients 500 --duration 30
+
+Requires httpx and uvicorn in addition to the application dependencies.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+# Read-mostly request mix, weighted like the admin UI traffic
+PATHS = [
+    "/products/?page_number=1&page_size=10",
+    "/categories/?page_number=1&page_size=10",
+    "/products/1",
+    "/categories/1",
+]
+
+
+def start_server(port: int, async_mode: bool) -> subprocess.Popen:
+    env = dict(os.environ, DB_ASYNC="1" if async_mode else "0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get("/openapi.json")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+async def run_load(base_url: str, clients: int, duration: float) -> dict:
+    completed = 0
+    errors = 0
+    stop_at = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=clients,
+                          max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(offset: int):
+            nonlocal completed, errors
+            i = offset
+            while time.monotonic() < stop_at:
+                try:
+                    response = await client.get(PATHS[i % len(PATHS)])
+                    if response.status_code >= 500:
+                        errors += 1
+                    else:
+                        completed += 1
+                except httpx.HTTPError:
+                    errors += 1
+                i += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(n) for n in range(clients)))
+        elapsed = time.monotonic() - started
+
+    return {
+        "requests": completed,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(completed / elapsed, 1),
+    }
+
+
+def benchmark_mode(async_mode: bool, port: int, clients: int, duration: float) -> dict:
+    server = start_server(port, async_mode)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_until_ready(base_url))
+        return asyncio.run(run_load(base_url, clients, duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    results = {
+        "clients": args.clients,
+        "sync": benchmark_mode(False, args.port, args.clients, args.duration),
+        "async": benchmark_mode(True, args.port, args.clients, args.duration),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
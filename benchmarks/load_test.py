@@ -0,0 +1,318 @@
+"""
+Load-test the API over a seeded catalogue and report latency percentiles.
+
+Seeds the configured database with the requested number of categories and
+products (unless --skip-seed is given, to reuse the catalogue of an earlier
+run), starts the application under uvicorn and drives it with concurrent
+clients over a weighted mix of requests. Prints throughput and p50/p95/p99
+latency per operation as JSON, tagged with the current git commit.
+
+Mixes:
+    read    lists with and without search, deep pages, single GETs, suggestions
+    mixed   the read mix with 10% creates and updates
+    write   mostly creates and updates
+
+With --baseline, the run is compared to an earlier report and the script
+exits with status 1 if the p95 of any operation regressed by more than
+--tolerance, so it can gate changes in CI.
+
+Usage:
+    python -m benchmarks.load_test --categories 100 --products 1000000 --mix mixed
+    python -m benchmarks.load_test --skip-seed --output after.json --baseline before.json
+
+Requires httpx and uvicorn in addition to the application dependencies.
+The database is modified: run it against a scratch database.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import func, insert, select
+
+from app.database import Base, SessionLocal, engine
+from app.migrations import migrate
+from app.models.category import Category
+from app.models.product import Product
+from benchmarks.async_vs_sync import start_server, wait_until_ready
+from benchmarks.search_scaling import WORDS, seed as seed_postgres
+
+# Products inserted per statement when seeding without PostgreSQL
+SEED_BATCH = 10000
+
+
+def seed(categories: int, products: int):
+    Base.metadata.drop_all(bind=engine)
+    migrate(engine)
+    rng = random.Random(0)
+    db = SessionLocal()
+    try:
+        db.add_all(Category(name=f"Category {n}", description="Baked goods")
+                   for n in range(categories))
+        db.commit()
+        if engine.dialect.name == "postgresql":
+            seed_postgres(db, 0, products, categories)
+            return
+        # Same names and spread as the server-side generator, in batches
+        for start in range(0, products, SEED_BATCH):
+            db.execute(insert(Product), [
+                {
+                    "name": f"{WORDS[i % len(WORDS)]} {WORDS[i // 7 % len(WORDS)]} {i:08x}",
+                    "description": f"Baked with {WORDS[i // 3 % len(WORDS)]}",
+                    "price": round(rng.random() * 20, 2),
+                    "quantity": rng.randrange(100),
+                    "category_id": 1 + i % categories,
+                }
+                for i in range(start, min(start + SEED_BATCH, products))
+            ])
+            db.commit()
+    finally:
+        db.close()
+
+
+def catalogue_size() -> tuple:
+    db = SessionLocal()
+    try:
+        return (db.scalar(select(func.count()).select_from(Category)),
+                db.scalar(select(func.max(Product.id))) or 0)
+    finally:
+        db.close()
+
+
+def list_products(rng, categories: int, products: int):
+    return "GET", f"/products/?page_number={rng.randint(1, 5)}&page_size=20", None
+
+
+def search_products(rng, categories: int, products: int):
+    term = rng.choice(WORDS)[:rng.randint(3, 6)]
+    return "GET", f"/products/?search_term={term}&page_size=20", None
+
+
+def suggest_products(rng, categories: int, products: int):
+    # What a picker sends while a name is typed, one to five letters in
+    term = rng.choice(WORDS)[:rng.randint(1, 5)]
+    return "GET", f"/products/suggest?q={term}", None
+
+
+def list_category_products(rng, categories: int, products: int):
+    return "GET", f"/products/?category_id={rng.randint(1, categories)}&page_size=20", None
+
+
+def deep_page(rng, categories: int, products: int):
+    # Somewhere in the back half of the catalogue, where OFFSET hurts most
+    last_page = max(products // 20, 1)
+    page = rng.randint(last_page // 2 + 1, last_page)
+    return "GET", f"/products/?page_number={page}&page_size=20", None
+
+
+def cursor_page(rng, categories: int, products: int):
+    return "GET", "/products/?pagination=cursor&page_size=20&sort_by=name", None
+
+
+def get_product(rng, categories: int, products: int):
+    return "GET", f"/products/{rng.randint(1, products)}", None
+
+
+def list_categories(rng, categories: int, products: int):
+    return "GET", "/categories/?page_size=20", None
+
+
+def get_category(rng, categories: int, products: int):
+    return "GET", f"/categories/{rng.randint(1, categories)}", None
+
+
+def create_product(rng, categories: int, products: int):
+    return "POST", "/products/", {
+        # Product names are unique
+        "name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} load {rng.getrandbits(64):016x}",
+        "description": "Created by the load test",
+        "price": round(rng.random() * 20, 2),
+        "quantity": rng.randrange(100),
+        "category_id": rng.randint(1, categories),
+    }
+
+
+def update_product(rng, categories: int, products: int):
+    return "PUT", f"/products/{rng.randint(1, products)}", {
+        "price": round(rng.random() * 20, 2),
+        "quantity": rng.randrange(100),
+    }
+
+
+# Operations and their weights per mix
+MIXES = {
+    "read": {
+        list_products: 20, search_products: 20, list_category_products: 10,
+        deep_page: 5, cursor_page: 5, get_product: 30, list_categories: 5,
+        get_category: 5, suggest_products: 10,
+    },
+    "mixed": {
+        list_products: 18, search_products: 18, list_category_products: 9,
+        deep_page: 4, cursor_page: 4, get_product: 27, list_categories: 5,
+        get_category: 5, suggest_products: 10, create_product: 5, update_product: 5,
+    },
+    "write": {
+        get_product: 20, create_product: 40, update_product: 40,
+    },
+}
+
+
+def percentile(timings: list, fraction: float) -> float:
+    # Nearest-rank percentile of sorted timings
+    return timings[max(math.ceil(fraction * len(timings)) - 1, 0)]
+
+
+def summarize(timings: list, errors: int, seconds: float) -> dict:
+    timings = sorted(timings)
+    if not timings:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "requests_per_second": round(len(timings) / seconds, 1),
+        "mean_ms": round(sum(timings) / len(timings), 2),
+        "p50_ms": round(percentile(timings, 0.50), 2),
+        "p95_ms": round(percentile(timings, 0.95), 2),
+        "p99_ms": round(percentile(timings, 0.99), 2),
+    }
+
+
+async def run_load(base_url: str, mix: dict, clients: int, duration: float,
+                   warmup: float, categories: int, products: int, rng_seed: int) -> dict:
+    operations = list(mix)
+    weights = list(mix.values())
+    timings = {operation.__name__: [] for operation in operations}
+    errors = {operation.__name__: 0 for operation in operations}
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(n: int):
+            rng = random.Random(rng_seed * 100003 + n)
+            while True:
+                operation = rng.choices(operations, weights)[0]
+                method, path, body = operation(rng, categories, products)
+                sent = time.monotonic()
+                if sent >= stop_at:
+                    return
+                try:
+                    response = await client.request(method, path, json=body)
+                    failed = response.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                if sent < measure_from:
+                    continue
+                if failed:
+                    errors[operation.__name__] += 1
+                else:
+                    timings[operation.__name__].append((time.monotonic() - sent) * 1000)
+
+        await asyncio.gather(*(worker(n) for n in range(clients)))
+
+    seconds = time.monotonic() - measure_from
+    return {
+        "seconds": round(seconds, 2),
+        "total": summarize([t for values in timings.values() for t in values],
+                           sum(errors.values()), seconds),
+        "operations": {name: summarize(values, errors[name], seconds)
+                       for name, values in timings.items()},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    # Operations whose p95 grew by more than the tolerance over the baseline
+    found = []
+    for name, current in report["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if not previous or "p95_ms" not in previous or "p95_ms" not in current:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append({"operation": name, "baseline_p95_ms": previous["p95_ms"],
+                          "p95_ms": current["p95_ms"]})
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--skip-seed", action="store_true",
+                        help="Reuse the catalogue already in the database")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="Seconds measured, after the warm-up")
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the request generator, for repeatable runs")
+    parser.add_argument("--async-mode", action="store_true",
+                        help="Serve with DB_ASYNC=1")
+    parser.add_argument("--url", help="Load an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Also write the report to this file")
+    parser.add_argument("--baseline", help="Report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p95 growth over the baseline (default: 0.2 for 20%%)")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(args.categories, args.products)
+    categories, products = catalogue_size()
+    if not categories or not products:
+        raise SystemExit("The database holds no catalogue; run without --skip-seed")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = start_server(args.port, args.async_mode)
+        base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        results = asyncio.run(run_load(
+            base_url, MIXES[args.mix], args.clients, args.duration, args.warmup,
+            categories, products, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "dialect": engine.dialect.name,
+        "async_mode": args.async_mode,
+        "mix": args.mix,
+        "clients": args.clients,
+        "categories": categories,
+        "products": products,
+        **results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = regressions(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
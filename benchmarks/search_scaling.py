@@ -0,0 +1,124 @@
+"""
+Measure product search latency as the products table grows.
+
+Grows the products table of the configured PostgreSQL database through
+each requested size, then times ProductService.get_products with a
+search_term at every step and prints the latency percentiles as JSON.
+Search terms are 5-character hex prefixes of the generated product codes,
+so each one matches a handful of rows at any table size.
+
+Usage:
+    python -m benchmarks.search_scaling --sizes 10000 100000 1000000 5000000
+
+The database is modified: run it against a scratch database.
+"""
+import argparse
+import hashlib
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.database import Base, SessionLocal, engine
+from app.migrations import migrate
+from app.models.category import Category
+from app.models.product import Product
+from app.services.product_service import ProductService
+
+WORDS = [
+    "sourdough", "rye", "baguette", "brioche", "croissant", "focaccia",
+    "ciabatta", "bagel", "muffin", "scone", "danish", "eclair", "tart",
+    "cheesecake", "cupcake", "pretzel", "pumpernickel", "challah",
+    "cinnamon", "chocolate", "almond", "walnut", "raisin", "seeded",
+]
+
+# Server-side generation keeps seeding fast at millions of rows
+SEED_SQL = text("""
+    INSERT INTO products (name, description, price, quantity, category_id, version)
+    SELECT
+        w.words[1 + i % cardinality(w.words)] || ' '
+            || w.words[1 + (i / 7) % cardinality(w.words)] || ' '
+            || md5(i::text),
+        'Baked with ' || w.words[1 + (i / 3) % cardinality(w.words)],
+        round((random() * 20)::numeric, 2),
+        (random() * 100)::int,
+        1 + i % :categories,
+        nextval('products_version_seq')
+    FROM generate_series(:start, :stop - 1) AS i, (SELECT CAST(:words AS text[]) AS words) AS w
+""")
+
+
+def seed(db, start: int, stop: int, categories: int, batch: int = 500000):
+    for offset in range(start, stop, batch):
+        db.execute(SEED_SQL, {
+            "start": offset,
+            "stop": min(offset + batch, stop),
+            "categories": categories,
+            "words": WORDS,
+        })
+        db.commit()
+    # Flush the GIN pending list and refresh statistics, as autovacuum
+    # would in a long-running database
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE products"))
+
+
+def measure(db, size: int, queries: int) -> dict:
+    service = ProductService()
+    terms = [
+        hashlib.md5(str(random.randrange(size)).encode()).hexdigest()[:5]
+        for _ in range(queries)
+    ]
+    timings = []
+    matches = 0
+    for term in terms:
+        started = time.perf_counter()
+        page = service.get_products(db, page_size=10, search_term=term)
+        timings.append((time.perf_counter() - started) * 1000)
+        matches += page.total
+        db.rollback()
+    timings.sort()
+    return {
+        "rows": size,
+        "queries": queries,
+        "avg_matches": round(matches / queries, 1),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "max_ms": round(timings[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000, 1000000, 5000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=100)
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("The search benchmark requires PostgreSQL")
+
+    Base.metadata.drop_all(bind=engine)
+    migrate(engine)
+
+    results = []
+    db = SessionLocal()
+    try:
+        db.add_all(Category(name=f"Category {n}")
+                   for n in range(args.categories))
+        db.commit()
+        current = 0
+        for size in sorted(args.sizes):
+            seed(db, current, size, args.categories)
+            current = size
+            results.append(measure(db, size, args.queries))
+    finally:
+        db.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
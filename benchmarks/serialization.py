@@ -0,0 +1,119 @@
+"""
+Compare response times of the standard and fast (orjson) response paths per endpoint.
+
+Seeds the configured database, then runs the application in-process once
+per mode (FAST_RESPONSES=0 and FAST_RESPONSES=1, each in a fresh
+interpreter since the flag is read at import) and times every endpoint
+through the ASGI test client, so no network or server overhead is
+included. Prints p50/p95 latency per endpoint and mode as JSON.
+
+Usage:
+    python -m benchmarks.serialization --products 5000 --requests 200
+
+Requires orjson and httpx in addition to the application dependencies.
+The database is modified: run it against a scratch database.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENDPOINTS = [
+    "/products/?page_size=500",
+    "/products/?pagination=cursor&page_size=500",
+    "/products/?page_size=500&fields=id,name,price",
+    "/products/1",
+    "/categories/?page_size=100",
+    "/categories/1",
+]
+
+
+def seed(products: int, categories: int):
+    from app.database import Base, SessionLocal, engine
+    from app.migrations import migrate
+    from app.models.category import Category
+    from app.models.product import Product
+
+    Base.metadata.drop_all(bind=engine)
+    migrate(engine)
+    db = SessionLocal()
+    try:
+        db.add_all(Category(name=f"Category {n}", description="Baked goods")
+                   for n in range(categories))
+        db.commit()
+        db.add_all(Product(name=f"Product {n}", description="Freshly baked",
+                           price=n % 50 + 0.5, quantity=n % 100,
+                           category_id=1 + n % categories)
+                   for n in range(products))
+        db.commit()
+    finally:
+        db.close()
+
+
+def measure(requests: int) -> dict:
+    # Runs in the child interpreter, with FAST_RESPONSES already set
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    results = {}
+    with TestClient(app) as client:
+        for path in ENDPOINTS:
+            for _ in range(10):
+                client.get(path)
+            timings = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = client.get(path)
+                timings.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+            timings.sort()
+            results[path] = {
+                "p50_ms": round(statistics.median(timings), 3),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+                "bytes": len(response.content),
+            }
+    return results
+
+
+def run_mode(fast: bool, requests: int) -> dict:
+    env = dict(os.environ, FAST_RESPONSES="1" if fast else "0")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.serialization",
+         "--measure", "--requests", str(requests)],
+        env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Timed requests per endpoint and mode")
+    parser.add_argument("--measure", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.requests)))
+        return
+
+    seed(args.products, args.categories)
+    standard = run_mode(False, args.requests)
+    fast = run_mode(True, args.requests)
+    print(json.dumps([
+        {
+            "endpoint": path,
+            "standard": standard[path],
+            "fast": fast[path],
+            "speedup": round(standard[path]["p50_ms"] / fast[path]["p50_ms"], 2),
+        }
+        for path in ENDPOINTS
+    ], indent=2))
+
+
+if __name__ == "__main__":
+    main()
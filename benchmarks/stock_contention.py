@@ -0,0 +1,176 @@
+"""
+Stress the stock adjustment path for lost updates under high parallelism.
+
+Many threads, each on its own database session, hammer a few hot products
+with random single and multi-SKU stock adjustments through
+ProductService.adjust_stock. Afterwards every product's quantity must equal
+its starting stock plus the deltas reported as applied, must never be
+negative, and must match the sum and last entry of its stock movement
+ledger. The result is printed as JSON and the script exits with status 1
+if any check fails.
+
+Every adjustment also updates the category_inventory row of the product's
+category, and that row stays locked until the adjustment commits, so
+adjustments of different products in one category still run one at a time.
+Compare the throughput with the products in one category and spread over
+one category each to measure that cost.
+
+Usage:
+    python -m benchmarks.stock_contention --workers 64 --adjustments 200
+    python -m benchmarks.stock_contention --products 32 --categories 1
+    python -m benchmarks.stock_contention --products 32 --categories 32
+
+The database is modified: run it against a scratch database.
+tests/test_stock_contention.py runs a smaller version on a scratch SQLite
+database.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+from app.database import CONNECT_ARGS, SQLALCHEMY_DATABASE_URL, Base
+from app.migrations import migrate
+from app.models.category import Category
+from app.models.product import Product
+from app.models.stock_movement import StockMovement
+from app.services.product_service import ProductService
+
+
+def worker(sessions, seed: int, product_ids: list, adjustments: int, applied: dict, errors: list, lock):
+    service = ProductService()
+    rng = random.Random(seed)
+    db = sessions()
+    try:
+        for _ in range(adjustments):
+            # Mostly single-SKU sales, some deliveries and multi-SKU baskets
+            if rng.random() < 0.2:
+                items = [(product_id, -rng.randint(1, 3))
+                         for product_id in rng.sample(product_ids, 2)]
+            else:
+                items = [(rng.choice(product_ids), rng.choice((-1, -1, -2, 1, 3)))]
+            try:
+                report = service.adjust_stock(db, items, reason="stress")
+            except Exception as e:
+                db.rollback()
+                with lock:
+                    errors.append(str(e).splitlines()[0])
+                continue
+            with lock:
+                for result in report["results"]:
+                    if result["status"] == "adjusted":
+                        applied[result["product_id"]] += result["delta"]
+    finally:
+        db.close()
+
+
+def seed(sessions, products: int, categories: int, stock: int) -> list:
+    # The products, spread over the categories round robin; returns their ids
+    db = sessions()
+    try:
+        rows = [Category(name=f"Stress {n}") for n in range(categories)]
+        db.add_all(rows)
+        db.flush()
+        skus = [Product(name=f"Hot SKU {n}", price=1, quantity=stock,
+                        category_id=rows[n % len(rows)].id) for n in range(products)]
+        db.add_all(skus)
+        db.commit()
+        return [product.id for product in skus]
+    finally:
+        db.close()
+
+
+def stress(sessions, product_ids: list, workers: int, adjustments: int) -> tuple:
+    """
+    Run the workers in parallel threads until each made its adjustments.
+
+    :return: The deltas applied by product, the error messages and the seconds taken.
+    """
+    applied = {product_id: 0 for product_id in product_ids}
+    errors = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(
+            sessions, n, product_ids, adjustments, applied, errors, lock))
+        for n in range(workers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return applied, errors, time.perf_counter() - started
+
+
+def check(sessions, product_ids: list, stock: int, applied: dict) -> list:
+    # Compare every product with the deltas applied and with its ledger
+    db = sessions()
+    checks = []
+    try:
+        for product_id in product_ids:
+            quantity = db.scalar(select(Product.quantity).where(Product.id == product_id))
+            ledger_sum = db.scalar(select(func.coalesce(func.sum(StockMovement.delta), 0)).where(
+                StockMovement.product_id == product_id))
+            last_after = db.scalar(select(StockMovement.quantity_after).where(
+                StockMovement.product_id == product_id).order_by(StockMovement.id.desc()).limit(1))
+            checks.append({
+                "product_id": product_id,
+                "quantity": quantity,
+                "expected": stock + applied[product_id],
+                "ledger_sum": ledger_sum,
+                "ledger_last": last_after,
+                "ok": quantity == stock + applied[product_id] == stock + ledger_sum
+                and quantity >= 0 and last_after in (None, quantity),
+            })
+    finally:
+        db.close()
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--adjustments", type=int, default=200,
+                        help="Adjustments per worker")
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--categories", type=int, default=1,
+                        help="Categories the products are spread over, round robin")
+    parser.add_argument("--stock", type=int, default=500,
+                        help="Starting quantity of every product")
+    args = parser.parse_args()
+
+    # One connection per worker, so the workers contend on rows and not on the pool
+    sqlite = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+    pool_args = {} if sqlite else {"pool_size": args.workers}
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=CONNECT_ARGS, **pool_args)
+    sessions = sessionmaker(bind=engine)
+    Base.metadata.drop_all(bind=engine)
+    migrate(engine)
+
+    product_ids = seed(sessions, args.products, args.categories, args.stock)
+    applied, errors, elapsed = stress(sessions, product_ids, args.workers, args.adjustments)
+    checks = check(sessions, product_ids, args.stock, applied)
+
+    total = args.workers * args.adjustments
+    print(json.dumps({
+        "dialect": engine.dialect.name,
+        "workers": args.workers,
+        "categories": args.categories,
+        "adjustments": total,
+        "adjustments_per_second": round(total / elapsed, 1),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "products": checks,
+    }, indent=2))
+    if not all(check["ok"] for check in checks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Count the SQL statements each product and category write sends to the database.
+
+Runs create, update, conditional update and delete through the services
+against the configured database and prints the statements per operation
+as JSON. On a backend with RETURNING every write must be a single
+statement, elsewhere it must stay within FALLBACK_STATEMENTS; the script
+exits with status 1 if one takes more, so it can guard against
+regressions in CI. tests/test_write_round_trips.py runs the same check on
+an in-memory SQLite database.
+
+Usage:
+    python -m benchmarks.write_round_trips
+
+The database is modified: run it against a scratch database.
+"""
+import json
+import sys
+
+from sqlalchemy import event
+
+from app.database import Base, SessionLocal, engine
+from app.migrations import migrate
+from app.schemas import category as category_schema
+from app.schemas import product as product_schema
+from app.services.category_service import CategoryService
+from app.services.product_service import ProductService
+
+# Statements per write on backends without RETURNING, where the written
+# rows are looked up around the statement, an update or delete after first
+# taking the write lock; also checked by the tests
+FALLBACK_STATEMENTS = {
+    "create_category": 2,
+    "update_category": 4,
+    "update_category_if_match": 4,
+    "create_product": 2,
+    "update_product": 4,
+    "update_product_if_match": 4,
+    "delete_product": 4,
+    "delete_category": 5,
+}
+
+
+def statement_budget(dialect) -> dict:
+    # A single round trip per write where the write can return its rows
+    if dialect.full_returning:
+        return dict.fromkeys(FALLBACK_STATEMENTS, 1)
+    return FALLBACK_STATEMENTS
+
+
+def count_statements(engine, db) -> dict:
+    """
+    Run each write through the services and count the statements it sends.
+
+    :param engine: The sync Engine db is bound to, listened to for statements.
+    :param db: A session on a migrated, empty database.
+
+    :return: The number of statements per operation, in FALLBACK_STATEMENTS order.
+    """
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    category_service = CategoryService()
+    product_service = ProductService()
+    # Each operation writes the rows of the earlier ones, by their ids and versions
+    written = {}
+    operations = {
+        "create_category": lambda: category_service.create_category(
+            db, category_schema.CategoryCreate(name="Bread")),
+        "update_category": lambda: category_service.update_category(
+            db, written["create_category"].id, category_schema.CategoryUpdate(name="Breads")),
+        "update_category_if_match": lambda: category_service.update_category(
+            db, written["update_category"].id, category_schema.CategoryUpdate(description="Loaves"),
+            written["update_category"].version),
+        "create_product": lambda: product_service.create_product(
+            db, product_schema.ProductCreate(
+                name="Loaf", price=2, category_id=written["create_category"].id)),
+        "update_product": lambda: product_service.update_product(
+            db, written["create_product"].id, product_schema.ProductUpdate(price=3)),
+        "update_product_if_match": lambda: product_service.update_product(
+            db, written["update_product"].id, product_schema.ProductUpdate(quantity=5),
+            written["update_product"].version),
+        "delete_product": lambda: product_service.delete_product(
+            db, written["create_product"].id),
+        "delete_category": lambda: category_service.delete_category(
+            db, written["create_category"].id),
+    }
+
+    results = {}
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        for name, operation in operations.items():
+            statements.clear()
+            written[name] = operation()
+            results[name] = len(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return results
+
+
+def main():
+    Base.metadata.drop_all(bind=engine)
+    migrate(engine)
+
+    db = SessionLocal()
+    try:
+        results = count_statements(engine, db)
+    finally:
+        db.close()
+
+    print(json.dumps({"dialect": engine.dialect.name, "statements": results}, indent=2))
+    budget = statement_budget(engine.dialect)
+    if any(count > budget[name] for name, count in results.items()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
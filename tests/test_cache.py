@@ -0,0 +1,50 @@
+from pydantic import BaseModel
+
+from app.cache import EntityCache, LRUCache
+
+
+class Item(BaseModel):
+    id: int
+    category_id: int
+
+
+def worker_caches(shared) -> tuple:
+    # Two workers, each with its own local tier, over the same shared tier
+    return EntityCache(LRUCache(), shared), EntityCache(LRUCache(), shared)
+
+
+def test_promoted_entries_keep_their_tags():
+    writer, reader = worker_caches(LRUCache())
+    writer.set("product:1", Item(id=1, category_id=7), tags=("category:7",))
+    writer.set("product:2", Item(id=2, category_id=7), tags=("category:7",))
+
+    # Shared tier hits, copied into the reader's local tier
+    assert reader.get("product:1", Item) == Item(id=1, category_id=7)
+    assert set(reader.get_many(["product:2"], Item)) == {"product:2"}
+    assert reader.local.stats()["size"] == 2
+
+    # A category update on the reader drops both copies
+    reader.invalidate_tags("category:7")
+    assert reader.get("product:1", Item) is None
+    assert reader.get_many(["product:2"], Item) == {}
+
+
+class RacingShared(LRUCache):
+    # Shared tier whose reads race with an invalidation in the reading worker
+    cache = None
+
+    def get(self, key: str):
+        value = super().get(key)
+        self.cache.invalidate(key)
+        return value
+
+
+def test_invalidation_during_shared_read_keeps_entry_out_of_local_tier():
+    shared = RacingShared()
+    writer, reader = worker_caches(shared)
+    shared.cache = reader
+    writer.set("product:1", Item(id=1, category_id=7), tags=("category:7",))
+
+    # The value read is returned, but not kept past the invalidation
+    assert reader.get("product:1", Item) == Item(id=1, category_id=7)
+    assert reader.local.get("product:1") is None
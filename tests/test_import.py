@@ -0,0 +1,26 @@
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.models.category import Category
+from app.models.product import Product
+from app.schemas.product import ProductCreate
+from app.services.product_service import ProductService
+from app.suggest import SuggestionIndex
+
+
+class FailingSuggestions(SuggestionIndex):
+    def refresh(self, db):
+        raise OperationalError("SELECT", {}, Exception("connection lost"))
+
+
+def test_failed_refresh_after_commit_keeps_import_result(db):
+    category = Category(name="Bread")
+    db.add(category)
+    db.commit()
+    products = [(row, ProductCreate(name=f"Loaf {row}", price=2, category_id=category.id))
+                for row in (1, 2)]
+
+    result = ProductService(suggestions=FailingSuggestions()).import_products(db, products)
+
+    assert result == {"inserted": 2, "updated": 0, "errors": []}
+    assert db.scalar(select(func.count()).select_from(Product)) == 2
@@ -0,0 +1,61 @@
+from sqlalchemy import (
+    Column, Float, ForeignKey, Integer, MetaData, String, Table, create_engine, inspect, text)
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.migrations import SCHEMA_VERSION, migrate
+from app.models.category import Category
+from app.models.product import Product
+from app.schemas.category import CategoryUpdate
+from app.services.category_service import CategoryService
+
+
+def create_baseline_schema(engine):
+    # The tables as create_all built them before migrations existed
+    metadata = MetaData()
+    Table("categories", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("name", String, index=True),
+          Column("description", String))
+    Table("products", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("name", String, index=True),
+          Column("description", String),
+          Column("price", Float),
+          Column("quantity", Integer),
+          Column("category_id", Integer, ForeignKey("categories.id")))
+    metadata.create_all(bind=engine)
+
+
+def test_migrate_adopts_baseline_schema():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    create_baseline_schema(engine)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO categories (id, name) VALUES (1, 'Bread')"))
+        connection.execute(text(
+            "INSERT INTO products (name, price, quantity, category_id) "
+            "VALUES ('Baguette', 2.5, 10, 1), ('Rye', 3, 4, 1)"))
+
+    assert migrate(engine) == (None, SCHEMA_VERSION)
+
+    inspector = inspect(engine)
+    for table in (Product.__table__, Category.__table__):
+        assert "version" in {column["name"] for column in inspector.get_columns(table.name)}
+        indexes = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= set(indexes)
+    assert {index["name"]: index["unique"] for index in inspector.get_indexes(
+        "products")}["ix_products_name"]
+
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        assert set(db.scalars(text("SELECT version FROM products"))) == {1}
+        # Writes draw versions above the adopted rows'
+        category = CategoryService().update_category(db, 1, CategoryUpdate(name="Breads"))
+        assert category.version > 1
+        summary = db.execute(text(
+            "SELECT product_count, total_units FROM category_inventory "
+            "WHERE category_id = 1")).one()
+        assert tuple(summary) == (2, 14)
+    finally:
+        db.close()
@@ -0,0 +1,71 @@
+import pytest
+
+from app.models.category import Category
+from app.models.product import Product
+from app.services.category_service import CategoryService
+from app.services.product_service import ProductService
+
+
+def page_ids(read_page) -> list:
+    # Follow next_cursor until the last page, collecting the item ids
+    ids, cursor = [], None
+    while True:
+        page = read_page(cursor)
+        ids.extend(item["id"] for item in page.items)
+        if page.next_cursor is None:
+            return ids
+        cursor = page.next_cursor
+
+
+def ordered_ids(rows, descending: bool = False) -> list:
+    # (sort key, id) pairs in keyset order: NULL keys last, first when descending
+    values = sorted((pair for pair in rows if pair[0] is not None), reverse=descending)
+    nulls = sorted((pair for pair in rows if pair[0] is None), reverse=descending)
+    ordered = nulls + values if descending else values + nulls
+    return [row_id for _, row_id in ordered]
+
+
+def test_cursor_pages_include_null_names(db):
+    names = ["Scones", None, "Bread", None, "Cake", "Bread"]
+    categories = [Category(name=name) for name in names]
+    db.add_all(categories)
+    db.flush()
+    # The product list only includes products with a category
+    products = [Product(name=name and f"{name} {n}", price=1, quantity=1,
+                        category_id=categories[0].id) for n, name in enumerate(names)]
+    db.add_all(products)
+    db.commit()
+
+    for size in (1, 2, 4):
+        assert page_ids(lambda cursor: CategoryService().get_categories_by_cursor(
+            db, cursor=cursor, page_size=size, sort_by="name")) == ordered_ids(
+            [(category.name, category.id) for category in categories])
+        assert page_ids(lambda cursor: ProductService().get_products_by_cursor(
+            db, cursor=cursor, page_size=size, sort_by="name")) == ordered_ids(
+            [(product.name, product.id) for product in products])
+
+
+@pytest.mark.parametrize("sort_by", ["price", "quantity"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_sorted_pages_include_null_keys(db, sort_by, descending):
+    category = Category(name="Bread")
+    db.add(category)
+    db.flush()
+    values = [3, None, 1, 3, None, 2, 1, None]
+    products = [Product(name=f"Loaf {n}", category_id=category.id, **{sort_by: value})
+                for n, value in enumerate(values)]
+    db.add_all(products)
+    db.commit()
+    expected = ordered_ids(
+        [(getattr(product, sort_by), product.id) for product in products], descending)
+
+    service = ProductService()
+    for size in (1, 3, 5):
+        for category_id in (None, category.id):
+            assert page_ids(lambda cursor: service.get_products_by_cursor(
+                db, cursor=cursor, page_size=size, sort_by=sort_by,
+                category_id=category_id, descending=descending)) == expected
+    # Page numbers list the products in the same order
+    page = service.get_products(
+        db, page_number=1, page_size=len(values), sort_by=sort_by, descending=descending)
+    assert [item["id"] for item in page.items] == expected
@@ -0,0 +1,24 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import connect_args
+from app.migrations import migrate
+from benchmarks.stock_contention import check, seed, stress
+
+
+def test_concurrent_adjustments_lose_no_updates(tmp_path):
+    # A database file rather than an in-memory one, so every worker thread
+    # has its own connection and transactions
+    url = f"sqlite:///{tmp_path / 'stock.db'}"
+    engine = create_engine(url, connect_args=connect_args(url))
+    migrate(engine)
+    sessions = sessionmaker(bind=engine)
+    # Little stock, so some sales are refused for insufficient stock
+    product_ids = seed(sessions, products=3, categories=1, stock=40)
+
+    applied, errors, _ = stress(sessions, product_ids, workers=8, adjustments=25)
+
+    assert not errors
+    checks = check(sessions, product_ids, 40, applied)
+    assert all(result["ok"] for result in checks), checks
+    engine.dispose()
@@ -0,0 +1,23 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.migrations import migrate
+from benchmarks.write_round_trips import FALLBACK_STATEMENTS, count_statements, statement_budget
+
+
+def test_writes_stay_within_statement_budget():
+    # One connection, so every session sees the same in-memory database
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    migrate(engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        results = count_statements(engine, db)
+    finally:
+        db.close()
+
+    assert list(results) == list(FALLBACK_STATEMENTS)
+    budget = statement_budget(engine.dialect)
+    over = {name: count for name, count in results.items() if count > budget[name]}
+    assert not over, f"Writes over their statement budget {budget}: {over}"